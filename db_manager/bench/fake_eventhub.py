@@ -0,0 +1,154 @@
+import itertools
+import json
+import random
+import threading
+from time import monotonic, sleep, time
+
+from db_manager.core.pivot import MEASURE_COLUMNS
+
+
+class FakeEventData:
+    # Just enough of azure.eventhub.EventData for on_event: body_as_str() plus offsets.
+    def __init__(self, body, sequence_number, partition_id):
+        self.body = body
+        self.sequence_number = sequence_number
+        self.offset = str(sequence_number)
+        self.partition_id = partition_id
+        self.received_monotonic = monotonic()
+
+    def body_as_str(self, encoding="UTF-8"):
+        return self.body
+
+
+class FakePartitionContext:
+    # Records checkpoints instead of persisting them; the delay between receiving an event
+    # and its checkpoint is the DB write lag (the writer checkpoints only after commit).
+    def __init__(self, partition_id):
+        self.partition_id = partition_id
+        self.last_checkpoint = None
+        self.checkpoints = 0
+        self.write_lags = []
+        self._lock = threading.Lock()
+
+    def update_checkpoint(self, event=None, **kwargs):
+        if event is None:
+            return
+        lag = monotonic() - event.received_monotonic
+        with self._lock:
+            self.last_checkpoint = event.sequence_number
+            self.checkpoints += 1
+            self.write_lags.append(lag)
+
+
+def synthetic_payloads(n_devices, n_measures, devices_per_event=1, device_prefix="bench", group_name="bench", seed=None):
+    # Endless stream of payloads in the documented schema (see jobs/ingest_eventhub.py).
+    # The first measures are the real ones mapped to tab_measurements, extra ones are generic.
+    rng = random.Random(seed)
+    measure_names = list(MEASURE_COLUMNS)[:n_measures]
+    measure_names += [f"Bench measure {i}" for i in range(len(measure_names), n_measures)]
+    device_ids = [f"{device_prefix}-{i:05d}" for i in range(n_devices)]
+    devices = itertools.cycle(device_ids)
+    while True:
+        now_ms = int(time() * 1000)
+        values = {}
+        for device_id in itertools.islice(devices, min(devices_per_event, n_devices)):
+            values[device_id] = {
+                name: {
+                    "raw_data": round(rng.uniform(0, 100), 2),
+                    "timestamp": now_ms // 1000,
+                    "status": 1,
+                    "timestampMsec": now_ms - rng.randint(0, 999),
+                }
+                for name in measure_names
+            }
+        yield json.dumps({
+            "timestamp": now_ms // 1000,
+            "timestampMsec": now_ms,
+            "group_name": group_name,
+            "values": values,
+        })
+
+
+def recorded_payloads(path, restamp=True, group_name=None):
+    # Replays payloads from a file (one JSON payload per line) in a loop. With restamp the
+    # parent timestamps are moved to "now", so replayed rows do not collide with the originals;
+    # group_name (if given) marks the replayed rows.
+    with open(path, encoding="utf-8") as f:
+        bodies = [line.strip() for line in f if line.strip()]
+    if not bodies:
+        raise ValueError(f"no payloads in {path}")
+    for body in itertools.cycle(bodies):
+        if restamp or group_name is not None:
+            payload = json.loads(body)
+            if restamp:
+                now_ms = int(time() * 1000)
+                payload["timestamp"] = now_ms // 1000
+                payload["timestampMsec"] = now_ms
+            if group_name is not None:
+                payload["group_name"] = group_name
+            body = json.dumps(payload)
+        yield body
+
+
+class FakeEventHubConsumerClient:
+    # Local stand-in for EventHubConsumerClient: receive() calls on_event from one thread per
+    # partition, like the SDK, until max_events or duration_seconds is reached (or close()).
+    # rate is the total target in events/s (0 = as fast as possible); events are released in
+    # bursts of `burst` back-to-back events, keeping the same average rate.
+    def __init__(self, payloads, partitions=1, rate=0, burst=1, max_events=None, duration_seconds=None):
+        self.payloads = payloads
+        self.partitions = partitions
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_events = max_events
+        self.duration_seconds = duration_seconds
+        self.contexts = [FakePartitionContext(str(i)) for i in range(partitions)]
+        self.events_sent = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._closed.set()
+
+    def _next_body(self):
+        with self._lock:
+            if self.max_events is not None and self.events_sent >= self.max_events:
+                return None
+            self.events_sent += 1
+            return next(self.payloads)
+
+    def _run_partition(self, context, on_event, deadline):
+        interval = self.burst / (self.rate / self.partitions) if self.rate > 0 else 0
+        next_burst = monotonic()
+        sequence_number = 0
+        while not self._closed.is_set():
+            if deadline is not None and monotonic() >= deadline:
+                return
+            for _ in range(self.burst):
+                body = self._next_body()
+                if body is None:
+                    return
+                on_event(context, FakeEventData(body, sequence_number, context.partition_id))
+                sequence_number += 1
+            if interval:
+                next_burst += interval
+                delay = next_burst - monotonic()
+                if delay > 0:
+                    sleep(delay)
+
+    def receive(self, on_event, **kwargs):
+        deadline = monotonic() + self.duration_seconds if self.duration_seconds else None
+        threads = [
+            threading.Thread(target=self._run_partition, args=(context, on_event, deadline), daemon=True)
+            for context in self.contexts
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
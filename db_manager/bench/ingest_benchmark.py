@@ -0,0 +1,127 @@
+import argparse
+from time import monotonic, perf_counter
+
+from db_manager.bench.fake_eventhub import FakeEventHubConsumerClient, synthetic_payloads, recorded_payloads
+from db_manager.config.settings import RAW_TABLE_NAME, INGEST_WIDE_ROWS, THROTTLE_MAX_DEVICES, THROTTLE_LOCK_STRIPES
+from db_manager.core.throttle import DeviceThrottle
+from db_manager.db.conn import get_conn
+from db_manager.db.schema import ensure_raw_table, ensure_raw_partitions
+from db_manager.jobs import ingest_eventhub
+
+"""
+Benchmark dell'ingestione senza Event Hub: un client finto chiama ingest_eventhub.on_event
+con payload sintetici o registrati e il writer reale scrive sul Postgres configurato
+(PGHOST, ...). Da usare solo su un DB locale/di test: le righe hanno group_name dedicato
+e --cleanup le cancella a fine run.
+
+Esempio:
+    py -m db_manager.bench.ingest_benchmark --devices 500 --measures 10 --events 50000 --partitions 4
+"""
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ingestion benchmark against a local Postgres")
+    parser.add_argument("--devices", type=int, default=100, help="distinct device ids (synthetic payloads)")
+    parser.add_argument("--measures", type=int, default=10, help="measures per device (synthetic payloads)")
+    parser.add_argument("--devices-per-event", type=int, default=1, help="gateways per payload (synthetic payloads)")
+    parser.add_argument("--recorded", help="file with one recorded JSON payload per line, replayed in a loop")
+    parser.add_argument("--events", type=int, default=10000, help="events to send (0 = until --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="stop sending after this many seconds")
+    parser.add_argument("--partitions", type=int, default=4, help="partitions (= callback threads)")
+    parser.add_argument("--rate", type=float, default=0, help="target events/s over all partitions (0 = max)")
+    parser.add_argument("--burst", type=int, default=1, help="events released back-to-back per partition")
+    parser.add_argument("--group-name", default="bench", help="group_name written on the benchmark rows")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--cleanup", action="store_true", help="delete the benchmark rows at the end")
+    return parser.parse_args(argv)
+
+
+def run_benchmark(args):
+    ensure_raw_table()
+    ensure_raw_partitions()
+    # Synthetic devices send far more often than the production throttle allows.
+    ingest_eventhub.THROTTLE = DeviceThrottle(0, THROTTLE_MAX_DEVICES, 0, THROTTLE_LOCK_STRIPES)
+    writer = ingest_eventhub.RAW_WRITER
+    writer.start()
+
+    if args.recorded:
+        payloads = recorded_payloads(args.recorded, group_name=args.group_name)
+    else:
+        payloads = synthetic_payloads(
+            args.devices,
+            args.measures,
+            devices_per_event=args.devices_per_event,
+            group_name=args.group_name,
+            seed=args.seed,
+        )
+    client = FakeEventHubConsumerClient(
+        payloads,
+        partitions=args.partitions,
+        rate=args.rate,
+        burst=args.burst,
+        max_events=args.events or None,
+        duration_seconds=args.duration,
+    )
+
+    callback_latencies = []
+
+    def on_event(partition_context, event):
+        t0 = perf_counter()
+        ingest_eventhub.on_event(partition_context, event)
+        callback_latencies.append(perf_counter() - t0)
+
+    print(
+        f"[bench] sending events (max {args.events or '-'}, duration {args.duration or '-'}s) "
+        f"on {args.partitions} partitions (rate {args.rate or 'max'}/s, burst {args.burst})"
+    )
+    t_start = monotonic()
+    client.receive(on_event=on_event)
+    t_sent = monotonic()
+    # Drain the writer so every accepted row is committed before measuring.
+    writer.stop(timeout=None)
+    t_done = monotonic()
+
+    writer_stats = writer.stats()
+    decode_stats = ingest_eventhub.DECODE_STATS.snapshot()
+    write_lags = [lag for context in client.contexts for lag in context.write_lags]
+    send_seconds = t_sent - t_start
+    total_seconds = t_done - t_start
+
+    print(f"[bench] events sent:      {client.events_sent} in {send_seconds:.2f}s ({client.events_sent / send_seconds:.0f} events/s)")
+    print(f"[bench] rows committed:   {writer_stats['rows']} in {total_seconds:.2f}s ({writer_stats['rows'] / total_seconds:.0f} rows/s)")
+    print(f"[bench] batches:          {writer_stats['batches']} (failed {writer_stats['failed_batches']}, dropped rows {writer_stats['dropped_rows']})")
+    print(f"[bench] rejected:         {decode_stats['measures_rejected']} measures, payload errors {decode_stats['payload_errors']}")
+    print(
+        f"[bench] callback latency: p50={percentile(callback_latencies, 50) * 1000:.3f} ms "
+        f"p99={percentile(callback_latencies, 99) * 1000:.3f} ms max={max(callback_latencies, default=0) * 1000:.3f} ms"
+    )
+    print(
+        f"[bench] DB write lag:     p50={percentile(write_lags, 50) * 1000:.1f} ms "
+        f"p99={percentile(write_lags, 99) * 1000:.1f} ms max={max(write_lags, default=0) * 1000:.1f} ms "
+        f"({len(write_lags)} checkpoints)"
+    )
+
+    if args.cleanup:
+        cleanup(args)
+
+
+def cleanup(args):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"DELETE FROM {RAW_TABLE_NAME} WHERE group_name = %s;", (args.group_name,))
+            print(f"[bench] cleanup: {cur.rowcount} raw rows deleted")
+            if INGEST_WIDE_ROWS and not args.recorded:
+                cur.execute("DELETE FROM hydro.tab_measurements WHERE device_id LIKE 'bench-%%';")
+                print(f"[bench] cleanup: {cur.rowcount} wide rows deleted")
+        conn.commit()
+
+
+if __name__ == "__main__":
+    run_benchmark(parse_args())
@@ -10,25 +10,105 @@ DB_NAME = os.getenv("PGDBNAME", "messages_trebisacce")
 DB_USER = os.getenv("PGUSER", "postgres")
 DB_PASSWORD = os.getenv("PGPASSWORD", "")
 
+# Connection pool (shared by consumers, schedulers and schema checks)
+DB_POOL_MIN_CONN = int(os.getenv("DB_POOL_MIN_CONN", "2"))
+DB_POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX_CONN", "10"))
+DB_POOL_TIMEOUT_SECONDS = 30  # max wait for a free connection
+DB_POOL_HEALTHCHECK_SECONDS = 60  # idle connections older than this are pinged before reuse
+
 # Ingestion pacing
 HEARTBEAT_SECONDS = int(os.getenv("HEARTBEAT_SECONDS", "60"))
 MIN_SECONDS_BETWEEN_EVENTS = 280  # 280 seconds (4 min 40s)
+THROTTLE_MAX_DEVICES = 100_000  # cap on devices tracked by the per-device throttle
+THROTTLE_TTL_SECONDS = MIN_SECONDS_BETWEEN_EVENTS  # older entries no longer throttle anything
+THROTTLE_LOCK_STRIPES = 16
+DECODE_STATS_MAX_DEVICES = 10_000  # devices with their own decode/reject counters (the rest are summed together)
+
+# Ingestion engine: "threads" (one consumer thread per meter) or "async" (all consumers on one event loop)
+INGEST_MODE = os.getenv("INGEST_MODE", "threads")
+ASYNC_CONSUMER_MAX_INFLIGHT = int(os.getenv("ASYNC_CONSUMER_MAX_INFLIGHT", "4"))  # concurrent inserts per consumer
+
+# Supervisor mode: meters are sharded across N ingest processes, schedulers run in a separate process.
+# 0 or 1 keeps everything in a single process.
+INGEST_WORKER_PROCESSES = int(os.getenv("INGEST_WORKER_PROCESSES", "0"))
+SECONDS_BEFORE_WORKER_RESTART = 5  # delay before a crashed worker is started again
+SECONDS_WORKER_SHUTDOWN_GRACE = 60  # time given to workers to flush rows and checkpoints on stop
+
+# Wide ingestion: pivot payloads in Python and write hydro.tab_measurements directly
+# (the raw -> measurements transform job is then not scheduled). The raw EAV rows can be kept for audit.
+INGEST_WIDE_ROWS = os.getenv("INGEST_WIDE_ROWS", "0") == "1"
+INGEST_KEEP_RAW = os.getenv("INGEST_KEEP_RAW", "1") == "1"
+
+# EventHub checkpoints: "postgres" (hydro.tab_eventhub_checkpoints), "file" (tests / local runs) or "none"
+CHECKPOINT_STORE = os.getenv("CHECKPOINT_STORE", "postgres")
+CHECKPOINT_FILE_PATH = os.getenv("CHECKPOINT_FILE_PATH", "eventhub_checkpoints.json")
+CHECKPOINT_FLUSH_EVENTS = 100  # persist checkpoints every N updates...
+CHECKPOINT_FLUSH_SECONDS = 10  # ... or every T seconds
+
+# Raw writer (COPY micro-batches, decoupled from the EventHub callback)
+RAW_WRITER_BATCH_ROWS = int(os.getenv("RAW_WRITER_BATCH_ROWS", "5000"))  # flush when this many rows are queued
+RAW_WRITER_MAX_AGE_SECONDS = 1.0  # ... or when the oldest queued event is this old
+RAW_WRITER_QUEUE_EVENTS = 10000  # bounded queue: on_event blocks when full
 
-# Scheduler intervals (seconds)
+# Spill-to-disk buffer for raw rows while Postgres is unreachable
+SPILL_ENABLED = os.getenv("SPILL_ENABLED", "1") == "1"
+SPILL_DIR = os.getenv("SPILL_DIR", "spill")
+SPILL_MAX_BYTES = 1024 * 1024 * 1024  # 1 GiB cap, then the consumers are slowed down again
+SPILL_SEGMENT_BYTES = 64 * 1024 * 1024  # 64 MiB per segment file
+SPILL_REPLAY_CHUNK_ROWS = 1000  # a rejected segment is replayed in chunks of this size, then row by row
+SPILL_AFTER_ATTEMPTS = 2  # failed DB writes before a batch is spilled
+SECONDS_BETWEEN_SPILL_REPLAY = 5
+
+# Job triggering: "notify" wakes transform/clean/stats/MV when the writers commit new rows
+# (Postgres LISTEN/NOTIFY, with a slow fallback poll); "poll" runs them every SECONDS_BETWEEN_* instead.
+JOB_TRIGGER_MODE = os.getenv("JOB_TRIGGER_MODE", "notify")
+JOB_TRIGGER_DEBOUNCE_SECONDS = 2  # bursts of commits within this window cause a single run
+SECONDS_BETWEEN_FALLBACK_POLL = 300  # 5 minutes
+
+# Scheduler intervals (seconds), used in "poll" mode
 SECONDS_BETWEEN_RAW_TO_MEASUREMENTS_TRANSFORM = 20  # 20 seconds
 SECONDS_BETWEEN_CLEAN_MEASUREMENTS = 20  # 20 seconds
 SECONDS_BETWEEN_REFRESH_STATS = 20  # 20 seconds
-SECONDS_BETWEEN_REFRESH_MV = 20  # 20 seconds
-SECONDS_BETWEEN_REFRESH_FLOW_HISTOGRAM = 86400  # 24 hours
+SECONDS_BETWEEN_REFRESH_ROLLUPS = 60  # 1 minute
+SECONDS_BETWEEN_REFRESH_DURATION_CURVE = 20  # 20 seconds
+SECONDS_BETWEEN_REFRESH_FLOW_HISTOGRAM = 60  # 1 minute
+SECONDS_BETWEEN_RAW_RETENTION = 3600  # 1 hour (also creates the partitions ahead)
+SECONDS_BETWEEN_STATS_REPORT = 300  # pool / throttle / writer counters
 
 # Tables
 RAW_TABLE_NAME = "hydro.tab_measurements_raw"
 
+# Raw table partitioning (daily partitions on parent_timestampmsec) and retention.
+# Partitions entirely below the transform watermark and older than RAW_RETENTION_DAYS are
+# archived (if RAW_ARCHIVE_DIR is set, as gzip CSV) and then dropped, or only detached.
+RAW_PARTITIONS_AHEAD_DAYS = 7
+RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "30"))
+RAW_RETENTION_ACTION = os.getenv("RAW_RETENTION_ACTION", "drop")  # "drop" or "detach"
+RAW_ARCHIVE_DIR = os.getenv("RAW_ARCHIVE_DIR", "")
+
+# raw -> measurements transform: raw rows pivoted per transaction (backlogs are worked off in chunks)
+TRANSFORM_CHUNK_ROWS = 200_000
+
 # Hampel filter parameters
 HAMPEL_WINDOW_SIZE = 49  # Must be odd
 HAMPEL_SIGMA_THRESHOLD = 3.5
 
+# Cleaning engine: "batch" re-filters each device's new rows with their left context on every run,
+# "stream" keeps per-device rolling windows in memory (snapshotted to CLEAN_STREAM_STATE_PATH).
+CLEAN_MODE = os.getenv("CLEAN_MODE", "batch")
+# Batch mode: devices are leased from hydro.tab_clean_device_state in batches (FOR UPDATE SKIP LOCKED),
+# so several threads/processes can clean disjoint devices.
+CLEAN_WORKERS = int(os.getenv("CLEAN_WORKERS", "1"))  # cleaning threads per process
+CLEAN_BATCH_DEVICES = 50  # devices leased per transaction
+CLEAN_DEVICE_MAX_ROWS = 200_000  # new rows per device per transaction (longer backlogs continue in the next one)
+CLEAN_STREAM_STATE_PATH = os.getenv("CLEAN_STREAM_STATE_PATH", "clean_stream_state.json")
+CLEAN_UPSERT_BATCH_ROWS = int(os.getenv("CLEAN_UPSERT_BATCH_ROWS", "50000"))  # rows COPYed to staging per merge
+REGENERATE_CHUNK_ROWS = 100_000  # rows per server-side cursor fetch in regenerate_clean_measurements
+REGENERATE_CHANGE_TOLERANCE = 5e-4  # half the last stored decimal of the NUMERIC columns: smaller differences are not rewritten
+
 # Flow histogram parameters
 FLOW_HIST_BINS = 100
-# 0 means "all-time" (no time window filter)
+# 0 means "all-time" (no time window filter); windows are rounded to whole UTC days
 FLOW_HIST_WINDOW_HOURS = 0
+FLOW_SKETCH_RELATIVE_ACCURACY = 0.01  # day sketch bins are (1 ± 1%) wide around their value
+FLOW_SKETCH_MIN_VALUE = 1e-6  # smaller absolute flows go in the zero bin
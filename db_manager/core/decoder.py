@@ -0,0 +1,173 @@
+import json
+import threading
+
+try:
+    # Optional faster backend; the stdlib parser is used when it is not installed.
+    import orjson
+    _loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    _loads = json.loads
+    JSON_BACKEND = "json"
+
+OTHER_DEVICES = "__other__"
+
+
+class PayloadError(ValueError):
+    # The whole payload is unusable (bad JSON or wrong top-level schema).
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+class DecodeStats:
+    # Per-device counters of decoded / rejected data, bounded to max_devices entries
+    # (further devices are accounted under OTHER_DEVICES).
+    def __init__(self, max_devices):
+        self.max_devices = max_devices
+        self._lock = threading.Lock()
+        self._payloads = 0
+        self._payload_errors = {}
+        # device_id -> [gateways, measures_ok, measures_rejected, partial_gateways, rejected_gateways]
+        self._devices = {}
+
+    def record_payload(self, error_kind=None):
+        with self._lock:
+            self._payloads += 1
+            if error_kind is not None:
+                self._payload_errors[error_kind] = self._payload_errors.get(error_kind, 0) + 1
+
+    def record_device(self, device_id, measures_ok, measures_rejected, gateway_valid=True):
+        with self._lock:
+            counters = self._devices.get(device_id)
+            if counters is None:
+                if len(self._devices) >= self.max_devices:
+                    device_id = OTHER_DEVICES
+                counters = self._devices.setdefault(device_id, [0, 0, 0, 0, 0])
+            counters[0] += 1
+            counters[1] += measures_ok
+            counters[2] += measures_rejected
+            if not gateway_valid:
+                counters[4] += 1
+            elif measures_rejected:
+                if measures_ok:
+                    counters[3] += 1
+                else:
+                    counters[4] += 1
+
+    def snapshot(self, top=5):
+        with self._lock:
+            devices = {device_id: list(c) for device_id, c in self._devices.items()}
+            snapshot = {
+                "backend": JSON_BACKEND,
+                "payloads": self._payloads,
+                "payload_errors": dict(self._payload_errors),
+            }
+        snapshot["measures_ok"] = sum(c[1] for c in devices.values())
+        snapshot["measures_rejected"] = sum(c[2] for c in devices.values())
+        snapshot["partial_gateways"] = sum(c[3] for c in devices.values())
+        snapshot["rejected_gateways"] = sum(c[4] for c in devices.values())
+        dirty = sorted(
+            ((device_id, c) for device_id, c in devices.items() if c[2] or c[4]),
+            key=lambda item: item[1][2] + item[1][4],
+            reverse=True,
+        )
+        snapshot["dirty_devices"] = [
+            {
+                "device_id": device_id,
+                "gateways": c[0],
+                "measures_rejected": c[2],
+                "partial_gateways": c[3],
+                "rejected_gateways": c[4],
+            }
+            for device_id, c in dirty[:top]
+        ]
+        return snapshot
+
+
+def _is_int(value):
+    return type(value) is int
+
+
+def _is_number(value):
+    return type(value) is int or type(value) is float
+
+
+def decode_rows(body, accept_device=None, stats=None):
+    # Parses and validates one payload (schema at the bottom of jobs/ingest_eventhub.py) and
+    # returns raw rows: (device_id, group_name, parent_timestamp, parent_timestampMsec,
+    # measure_name, raw_data, status, measure_timestamp, measure_timestampMsec).
+    # accept_device(device_id) -> bool lets the caller skip devices (throttling) before validation.
+    try:
+        payload = _loads(body)
+    except ValueError as e:
+        if stats is not None:
+            stats.record_payload("json")
+        raise PayloadError("json", f"JSON error: {e}")
+
+    error = None
+    if not isinstance(payload, dict):
+        error = ("payload", "payload is not an object")
+    else:
+        values = payload.get("values")
+        group_name = payload.get("group_name", "")
+        parent_timestamp = payload.get("timestamp")
+        parent_timestampMsec = payload.get("timestampMsec")
+        if not isinstance(values, dict):
+            error = ("values", "'values' is not an object")
+        elif not _is_int(parent_timestampMsec) or not (parent_timestamp is None or _is_int(parent_timestamp)):
+            error = ("timestamp", "missing or non-integer 'timestamp'/'timestampMsec'")
+        elif not isinstance(group_name, str):
+            error = ("group_name", "'group_name' is not a string")
+    if stats is not None:
+        stats.record_payload(error[0] if error else None)
+    if error:
+        raise PayloadError(*error)
+
+    rows = []
+    for device_id, gateway in values.items():
+        if accept_device is not None and not accept_device(device_id):
+            continue
+        if not isinstance(gateway, dict):
+            if stats is not None:
+                stats.record_device(device_id, 0, 0, gateway_valid=False)
+            continue
+        measures_ok = 0
+        measures_rejected = 0
+        for measure_name, measure in gateway.items():
+            if not isinstance(measure, dict):
+                measures_rejected += 1
+                continue
+            raw_data = measure.get("raw_data")
+            status = measure.get("status")
+            measure_timestamp = measure.get("timestamp")
+            measure_timestampMsec = measure.get("timestampMsec")
+            if not (
+                _is_number(raw_data)
+                and (status is None or _is_int(status))
+                and (measure_timestamp is None or _is_int(measure_timestamp))
+                and (measure_timestampMsec is None or _is_int(measure_timestampMsec))
+            ):
+                measures_rejected += 1
+                continue
+            try:
+                value = float(raw_data)
+            except OverflowError:
+                # JSON integer beyond the float range: an invalid measure like any other.
+                measures_rejected += 1
+                continue
+            rows.append((
+                device_id,
+                group_name,
+                parent_timestamp,
+                parent_timestampMsec,
+                measure_name,
+                value,
+                status,
+                measure_timestamp,
+                measure_timestampMsec,
+            ))
+            measures_ok += 1
+        if stats is not None:
+            stats.record_device(device_id, measures_ok, measures_rejected)
+    return rows
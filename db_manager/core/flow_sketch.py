@@ -0,0 +1,14 @@
+import math
+
+
+# Log-spaced bins (DDSketch mapping) of tab_flow_sketch_daily: with
+# gamma = (1 + a) / (1 - a), a value v > 0 falls in bin k = ceil(ln v / ln gamma), i.e. in
+# (gamma^(k-1), gamma^k], whose representative value 2 * gamma^k / (gamma + 1) is within a
+# relative error a of every value of the bin. Negative values use the same bins on |v|.
+
+def sketch_ln_gamma(relative_accuracy):
+    return math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+
+
+def bin_value(sign, bin_key, ln_gamma):
+    return sign * 2 * math.exp(bin_key * ln_gamma) / (math.exp(ln_gamma) + 1)
@@ -0,0 +1,53 @@
+from collections import namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Limits of the NUMERIC columns of tab_measurements_clean.
+MAX_NUMERIC = 9_999_999.999
+MIN_NUMERIC = -9_999_999.999
+
+# Windows processed per step, to bound the temporary (chunk x window) arrays.
+CHUNK_WINDOWS = 65536
+
+# filtered, medians, thresholds: float32 arrays; is_outlier: bool array;
+# has_window: False for the first/last window_size // 2 points, which get no median/threshold.
+HampelResult = namedtuple("HampelResult", ["filtered", "is_outlier", "medians", "thresholds", "has_window"])
+
+
+def hampel_filter(values, window_size, n_sigma):
+    # Vectorized Hampel filter, same results as hampel.hampel() 1.0.2: float32 arithmetic,
+    # centred window of 2 * (window_size // 2) + 1 points, MAD scaled by 1.4826, points with
+    # |x - median| > threshold replaced by the median, edge points left unfiltered.
+    data = np.asarray(values, dtype=np.float32)
+    n = len(data)
+    half = window_size // 2
+    filtered = data.copy()
+    is_outlier = np.zeros(n, dtype=bool)
+    medians = np.full(n, np.nan, dtype=np.float32)
+    thresholds = np.full(n, np.nan, dtype=np.float32)
+    has_window = np.zeros(n, dtype=bool)
+    if n < 2 * half + 1:
+        return HampelResult(filtered, is_outlier, medians, thresholds, has_window)
+
+    windows = sliding_window_view(data, 2 * half + 1)
+    # The library multiplies in double precision and stores the threshold as float32.
+    scale = float(np.float32(n_sigma)) * 1.4826
+    for start in range(0, len(windows), CHUNK_WINDOWS):
+        chunk = windows[start:start + CHUNK_WINDOWS]
+        median = np.median(chunk, axis=1)
+        mad = np.median(np.abs(chunk - median[:, None]), axis=1)
+        threshold = (scale * mad.astype(np.float64)).astype(np.float32)
+        centre = slice(half + start, half + start + len(chunk))
+        outliers = np.abs(data[centre] - median) > threshold
+        medians[centre] = median
+        thresholds[centre] = threshold
+        is_outlier[centre] = outliers
+        filtered[centre] = np.where(outliers, median, data[centre])
+    has_window[half:n - half] = True
+    return HampelResult(filtered, is_outlier, medians, thresholds, has_window)
+
+
+def clamp_numeric(values):
+    # Clamps to the NUMERIC column range in float64 (NaN passes through), as Python floats.
+    return np.clip(np.asarray(values, dtype=np.float64), MIN_NUMERIC, MAX_NUMERIC).tolist()
@@ -0,0 +1,109 @@
+import math
+from bisect import bisect_left, insort
+from collections import deque
+
+import numpy as np
+
+
+def _f32(value):
+    return float(np.float32(value))
+
+
+def _kth_smallest(a, na, b, nb, k):
+    # k-th smallest (0-based) of two ascending sequences given as accessors a(i), b(j): O(log).
+    lo, hi = max(0, k + 1 - nb), min(k + 1, na)
+    while lo < hi:
+        i = (lo + hi) // 2
+        if a(i) < b(k - i):
+            lo = i + 1
+        else:
+            hi = i
+    i = lo
+    j = k + 1 - i
+    return max(a(i - 1) if i > 0 else -math.inf, b(j - 1) if j > 0 else -math.inf)
+
+
+class _DeviceWindow:
+    __slots__ = ("points", "sorted_values", "nan_count")
+
+    def __init__(self, size):
+        self.points = deque(maxlen=size)  # (ts, raw, float32 value)
+        self.sorted_values = []  # float32 values of points, NaN excluded
+        self.nan_count = 0
+
+    def push(self, ts, raw):
+        value = _f32(raw)
+        if len(self.points) == self.points.maxlen:
+            _, _, old = self.points[0]
+            if math.isnan(old):
+                self.nan_count -= 1
+            else:
+                del self.sorted_values[bisect_left(self.sorted_values, old)]
+        self.points.append((ts, raw, value))
+        if math.isnan(value):
+            self.nan_count += 1
+        else:
+            insort(self.sorted_values, value)
+
+
+class OnlineHampel:
+    # Streaming Hampel filter with the same output as core.hampel_filter.hampel_filter over the
+    # whole series. push() returns clean rows (device_id, ts, raw, filtered, is_outlier, median,
+    # threshold): the new point as an edge row (no median yet, like the last points of a batch run)
+    # and the final row of the point that just got a complete centred window.
+    def __init__(self, window_size, n_sigma):
+        self.half = window_size // 2
+        self.size = 2 * self.half + 1
+        self.scale = float(np.float32(n_sigma)) * 1.4826
+        self.devices = {}
+
+    def push(self, device_id, ts, raw):
+        window = self.devices.get(device_id)
+        if window is None:
+            window = self.devices[device_id] = _DeviceWindow(self.size)
+        window.push(ts, raw)
+        rows = []
+        if len(window.points) == self.size:
+            rows.append(self._centre_row(device_id, window))
+        rows.append((device_id, ts, raw, _f32(raw), False, None, None))
+        return rows
+
+    def _centre_row(self, device_id, window):
+        ts, raw, value = window.points[self.half]
+        if window.nan_count:
+            # np.median propagates NaN: no outlier test possible in this window.
+            return (device_id, ts, raw, value, False, math.nan, math.nan)
+        s = window.sorted_values
+        half = self.half
+        median = s[half]
+        # Distances from the median grow moving outwards on both sides of the sorted window.
+        left = lambda i: _f32(median - s[half - 1 - i])
+        right = lambda j: _f32(s[half + j] - median)
+        mad = _kth_smallest(left, half, right, half + 1, half)
+        threshold = _f32(self.scale * mad)
+        is_outlier = _f32(abs(value - median)) > threshold
+        return (device_id, ts, raw, median if is_outlier else value, is_outlier, median, threshold)
+
+    def last_ts(self, device_id):
+        # Timestamp of the device's last pushed point, None without a window.
+        window = self.devices.get(device_id)
+        return window.points[-1][0] if window is not None and window.points else None
+
+    def snapshot(self):
+        # device_id -> [(ts, raw), ...], the last window_size - 1 points (enough to resume).
+        return {
+            device_id: [(ts, raw) for ts, raw, _ in list(window.points)[-(self.size - 1):]]
+            for device_id, window in self.devices.items()
+        }
+
+    def restore(self, points_by_device):
+        # Rebuilds all windows from snapshot() output.
+        self.devices = {}
+        self.seed(points_by_device)
+
+    def seed(self, points_by_device):
+        # (Re)starts the given devices from their last points, oldest first, without emitting rows.
+        for device_id, points in points_by_device.items():
+            window = self.devices[device_id] = _DeviceWindow(self.size)
+            for ts, raw in points[-(self.size - 1):]:
+                window.push(ts, raw)
@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+
+# measure_name -> tab_measurements column, same mapping as transform_raw_to_measurements.sql
+MEASURE_COLUMNS = {
+    "Instant flow rate 2": "instant_flow_rate_2",
+    "Instant flow rate 1": "instant_flow_rate_1",
+    "Fluid velocity 2": "fluid_velocity_2",
+    "Fluid velocity 1": "fluid_velocity_1",
+    "Instant heat flow rate 1": "instant_heat_flow_rate_2",
+    "Instant heat flow rate": "instant_heat_flow_rate_1",
+    "Return water temperature 2": "return_water_temperature_2",
+    "Return water temperature 1": "return_water_temperature_1",
+    "Supplying water temperature 1": "supplying_water_temperature_2",
+    "Supplying water temperature": "supplying_water_temperature_1",
+}
+
+# Column order of the wide rows (after device_id, ts_s).
+WIDE_COLUMNS = (
+    "instant_flow_rate_2",
+    "instant_flow_rate_1",
+    "fluid_velocity_2",
+    "fluid_velocity_1",
+    "instant_heat_flow_rate_2",
+    "instant_heat_flow_rate_1",
+    "return_water_temperature_2",
+    "return_water_temperature_1",
+    "supplying_water_temperature_2",
+    "supplying_water_temperature_1",
+)
+_MEASURE_INDEX = {name: WIDE_COLUMNS.index(column) for name, column in MEASURE_COLUMNS.items()}
+
+
+def pivot_raw_rows(rows):
+    # Raw EAV tuples (as built by the consumers) -> one wide row per (device_id, parent_timestampMsec),
+    # with the same semantics as the SQL pivot: MAX per column, NULLs ignored, unmapped measures skipped.
+    groups = {}
+    for device_id, _group_name, _parent_ts, parent_ts_msec, measure_name, raw_data, *_ in rows:
+        if parent_ts_msec is None:
+            continue
+        values = groups.get((device_id, parent_ts_msec))
+        if values is None:
+            values = groups[(device_id, parent_ts_msec)] = [None] * len(WIDE_COLUMNS)
+        i = _MEASURE_INDEX.get(measure_name)
+        if i is None or raw_data is None:
+            continue
+        if values[i] is None or raw_data > values[i]:
+            values[i] = raw_data
+    return [
+        (device_id, datetime.fromtimestamp(parent_ts_msec / 1000.0, tz=timezone.utc), *values)
+        for (device_id, parent_ts_msec), values in groups.items()
+    ]
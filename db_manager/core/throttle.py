@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+from time import time
+
+
+class DeviceThrottle:
+    # Per-device "at most one event every min_interval_seconds" state.
+    # Bounded: entries expire after ttl_seconds and the least recently accepted device is
+    # dropped when a stripe is full. Devices are spread over lock stripes so consumer
+    # threads rarely wait on each other; each check-and-set takes a single lock.
+    def __init__(self, min_interval_seconds, max_devices, ttl_seconds, stripes=16):
+        self.min_interval_seconds = min_interval_seconds
+        self.ttl_seconds = max(ttl_seconds, min_interval_seconds)
+        self._n_stripes = max(stripes, 1)
+        self._max_per_stripe = max(max_devices // self._n_stripes, 1)
+        # Each stripe: lock, device_id -> last accepted ts (oldest first), counters.
+        self._stripes = [
+            (threading.Lock(), OrderedDict(), {"hits": 0, "misses": 0, "throttled": 0, "evicted": 0, "dropped": 0})
+            for _ in range(self._n_stripes)
+        ]
+
+    def allow(self, device_id, now=None):
+        if now is None:
+            now = time()
+        lock, entries, counters = self._stripes[hash(device_id) % self._n_stripes]
+        with lock:
+            last_ts = entries.get(device_id)
+            if last_ts is not None:
+                counters["hits"] += 1
+                if now - last_ts < self.min_interval_seconds:
+                    counters["throttled"] += 1
+                    return False
+                entries.move_to_end(device_id)
+            else:
+                counters["misses"] += 1
+            entries[device_id] = now
+
+            # Oldest entries sit at the front: expire them, then enforce the size cap.
+            expire_before = now - self.ttl_seconds
+            while entries:
+                oldest_id, oldest_ts = next(iter(entries.items()))
+                if oldest_ts >= expire_before:
+                    break
+                del entries[oldest_id]
+                counters["evicted"] += 1
+            while len(entries) > self._max_per_stripe:
+                entries.popitem(last=False)
+                counters["dropped"] += 1
+            return True
+
+    def stats(self):
+        totals = {"devices": 0, "hits": 0, "misses": 0, "throttled": 0, "evicted": 0, "dropped": 0}
+        for lock, entries, counters in self._stripes:
+            with lock:
+                totals["devices"] += len(entries)
+                for name, value in counters.items():
+                    totals[name] += value
+        return totals
@@ -0,0 +1,22 @@
+import threading
+from time import sleep
+
+
+class JobTrigger:
+    # Wake-up signal for a scheduler loop. fire() may be called any number of times; wait()
+    # returns after a debounce so a burst of fires results in a single job run.
+    def __init__(self, debounce_seconds):
+        self.debounce_seconds = debounce_seconds
+        self._event = threading.Event()
+
+    def fire(self):
+        self._event.set()
+
+    def wait(self, timeout):
+        # True if fired, False on timeout (fallback poll). Fires arriving while the job
+        # runs are kept and trigger the next run.
+        fired = self._event.wait(timeout)
+        if fired and self.debounce_seconds > 0:
+            sleep(self.debounce_seconds)
+        self._event.clear()
+        return fired
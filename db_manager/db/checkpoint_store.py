@@ -0,0 +1,289 @@
+import json
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from azure.eventhub import CheckpointStore
+from psycopg2.extras import execute_values
+
+from db_manager.config.settings import (
+    CHECKPOINT_STORE,
+    CHECKPOINT_FILE_PATH,
+    CHECKPOINT_FLUSH_EVENTS,
+    CHECKPOINT_FLUSH_SECONDS,
+)
+from db_manager.db.conn import get_conn
+from db_manager.db.sql_loader import load_sql
+
+KEY_FIELDS = ("fully_qualified_namespace", "eventhub_name", "consumer_group", "partition_id")
+
+
+def _key(item):
+    return tuple(item[field] for field in KEY_FIELDS)
+
+
+class BatchedCheckpointStore(CheckpointStore, ABC):
+    # Buffers update_checkpoint() calls and persists only the latest checkpoint per partition,
+    # every flush_events updates or flush_seconds (whichever comes first), and on close().
+    def __init__(self, flush_events, flush_seconds):
+        self.flush_events = flush_events
+        self.flush_seconds = flush_seconds
+        self._pending = {}
+        self._pending_updates = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._closed = threading.Event()
+
+    def update_checkpoint(self, checkpoint, **kwargs):
+        with self._lock:
+            self._pending[_key(checkpoint)] = dict(checkpoint)
+            self._pending_updates += 1
+            due = (
+                self._pending_updates >= self.flush_events
+                or time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+            if self._flusher is None:
+                # Idle partitions still get their last checkpoint persisted within flush_seconds.
+                self._flusher = threading.Thread(target=self._flush_loop, name="checkpoint-flusher", daemon=True)
+                self._flusher.start()
+        if due:
+            self.flush()
+
+    def list_checkpoints(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        checkpoints = {
+            _key(cp): cp
+            for cp in self._read_checkpoints(fully_qualified_namespace, eventhub_name, consumer_group)
+        }
+        with self._lock:
+            for key, cp in self._pending.items():
+                if key[:3] == (fully_qualified_namespace, eventhub_name, consumer_group):
+                    checkpoints[key] = cp
+        return list(checkpoints.values())
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending = list(self._pending.values())
+                self._pending = {}
+                self._pending_updates = 0
+                self._last_flush = time.monotonic()
+            if not pending:
+                return
+            try:
+                self._write_checkpoints(pending)
+            except Exception:
+                # Put them back unless a newer checkpoint arrived meanwhile.
+                with self._lock:
+                    for cp in pending:
+                        self._pending.setdefault(_key(cp), cp)
+                raise
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[checkpoint_store] flush error: {e}")
+
+    @abstractmethod
+    def _read_checkpoints(self, fully_qualified_namespace, eventhub_name, consumer_group):
+        ...
+
+    @abstractmethod
+    def _write_checkpoints(self, checkpoints):
+        ...
+
+
+class PostgresCheckpointStore(BatchedCheckpointStore):
+    def __init__(self, flush_events, flush_seconds):
+        super().__init__(flush_events, flush_seconds)
+        self._sql_upsert = load_sql("upsert_eventhub_checkpoints.sql")
+
+    def list_ownership(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                            SELECT partition_id, owner_id, etag, last_modified_time
+                            FROM hydro.tab_eventhub_ownership
+                            WHERE fully_qualified_namespace = %s
+                            AND eventhub_name = %s
+                            AND consumer_group = %s;
+                            """, (fully_qualified_namespace, eventhub_name, consumer_group))
+                rows = cur.fetchall()
+        return [
+            {
+                "fully_qualified_namespace": fully_qualified_namespace,
+                "eventhub_name": eventhub_name,
+                "consumer_group": consumer_group,
+                "partition_id": partition_id,
+                "owner_id": owner_id,
+                "etag": etag,
+                "last_modified_time": last_modified_time,
+            }
+            for partition_id, owner_id, etag, last_modified_time in rows
+        ]
+
+    def claim_ownership(self, ownership_list, **kwargs):
+        claimed = []
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                for ownership in ownership_list:
+                    new_etag = str(uuid.uuid4())
+                    now = time.time()
+                    if ownership.get("etag") is None:
+                        cur.execute("""
+                                    INSERT INTO hydro.tab_eventhub_ownership (
+                                        fully_qualified_namespace, eventhub_name, consumer_group,
+                                        partition_id, owner_id, etag, last_modified_time
+                                    )
+                                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                                    ON CONFLICT DO NOTHING
+                                    RETURNING 1;
+                                    """, (*_key(ownership), ownership["owner_id"], new_etag, now))
+                    else:
+                        # Optimistic concurrency: only succeeds if nobody claimed it since we listed it.
+                        cur.execute("""
+                                    UPDATE hydro.tab_eventhub_ownership
+                                    SET owner_id = %s, etag = %s, last_modified_time = %s
+                                    WHERE fully_qualified_namespace = %s
+                                    AND eventhub_name = %s
+                                    AND consumer_group = %s
+                                    AND partition_id = %s
+                                    AND etag = %s
+                                    RETURNING 1;
+                                    """, (ownership["owner_id"], new_etag, now, *_key(ownership), ownership["etag"]))
+                    if cur.fetchone():
+                        claimed.append(dict(ownership, etag=new_etag, last_modified_time=now))
+            conn.commit()
+        return claimed
+
+    def _read_checkpoints(self, fully_qualified_namespace, eventhub_name, consumer_group):
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                            SELECT partition_id, offset_value, sequence_number
+                            FROM hydro.tab_eventhub_checkpoints
+                            WHERE fully_qualified_namespace = %s
+                            AND eventhub_name = %s
+                            AND consumer_group = %s;
+                            """, (fully_qualified_namespace, eventhub_name, consumer_group))
+                rows = cur.fetchall()
+        return [
+            {
+                "fully_qualified_namespace": fully_qualified_namespace,
+                "eventhub_name": eventhub_name,
+                "consumer_group": consumer_group,
+                "partition_id": partition_id,
+                "offset": offset_value,
+                "sequence_number": sequence_number,
+            }
+            for partition_id, offset_value, sequence_number in rows
+        ]
+
+    def _write_checkpoints(self, checkpoints):
+        rows = [
+            (*_key(cp), None if cp.get("offset") is None else str(cp["offset"]), cp.get("sequence_number"))
+            for cp in checkpoints
+        ]
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, self._sql_upsert, rows)
+            conn.commit()
+
+
+class FileCheckpointStore(BatchedCheckpointStore):
+    # Local JSON file, meant for tests and single-node development runs.
+    def __init__(self, path, flush_events, flush_seconds):
+        super().__init__(flush_events, flush_seconds)
+        self.path = Path(path)
+        self._file_lock = threading.Lock()
+
+    def _load(self):
+        if not self.path.exists():
+            return {"checkpoints": [], "ownership": []}
+        return json.loads(self.path.read_text(encoding="utf-8"))
+
+    def _save(self, data):
+        # Write-then-rename so a crash never leaves a truncated file behind.
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def list_ownership(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        with self._file_lock:
+            data = self._load()
+        return [
+            o for o in data["ownership"]
+            if _key(o)[:3] == (fully_qualified_namespace, eventhub_name, consumer_group)
+        ]
+
+    def claim_ownership(self, ownership_list, **kwargs):
+        claimed = []
+        with self._file_lock:
+            data = self._load()
+            current = {_key(o): o for o in data["ownership"]}
+            for ownership in ownership_list:
+                old = current.get(_key(ownership))
+                if old is not None and old["etag"] != ownership.get("etag"):
+                    continue
+                new = dict(ownership, etag=str(uuid.uuid4()), last_modified_time=time.time())
+                current[_key(ownership)] = new
+                claimed.append(new)
+            data["ownership"] = list(current.values())
+            self._save(data)
+        return claimed
+
+    def _read_checkpoints(self, fully_qualified_namespace, eventhub_name, consumer_group):
+        with self._file_lock:
+            data = self._load()
+        return [
+            cp for cp in data["checkpoints"]
+            if _key(cp)[:3] == (fully_qualified_namespace, eventhub_name, consumer_group)
+        ]
+
+    def _write_checkpoints(self, checkpoints):
+        with self._file_lock:
+            data = self._load()
+            current = {_key(cp): cp for cp in data["checkpoints"]}
+            for cp in checkpoints:
+                current[_key(cp)] = cp
+            data["checkpoints"] = list(current.values())
+            self._save(data)
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_checkpoint_store():
+    # Process-wide store selected by CHECKPOINT_STORE ("postgres", "file" or "none").
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            if CHECKPOINT_STORE == "postgres":
+                _STORE = PostgresCheckpointStore(CHECKPOINT_FLUSH_EVENTS, CHECKPOINT_FLUSH_SECONDS)
+            elif CHECKPOINT_STORE == "file":
+                _STORE = FileCheckpointStore(CHECKPOINT_FILE_PATH, CHECKPOINT_FLUSH_EVENTS, CHECKPOINT_FLUSH_SECONDS)
+        return _STORE
+
+
+def close_checkpoint_store():
+    if _STORE is not None:
+        try:
+            _STORE.close()
+            print("[checkpoint_store] pending checkpoints flushed")
+        except Exception as e:
+            print(f"[checkpoint_store] flush on close failed: {e}")
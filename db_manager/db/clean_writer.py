@@ -0,0 +1,26 @@
+from time import perf_counter
+
+from db_manager.config.settings import CLEAN_UPSERT_BATCH_ROWS
+from db_manager.db.copy import copy_rows
+from db_manager.db.sql_loader import load_sql
+
+ENSURE_CLEAN_STAGING_SQL = load_sql("ensure_clean_staging_table.sql")
+COPY_CLEAN_STAGING_SQL = load_sql("copy_clean_staging.sql")
+UPSERT_CLEAN_SQL = load_sql("upsert_cleaned_measurements.sql")
+
+
+def upsert_clean_rows(cur, rows, batch_rows=CLEAN_UPSERT_BATCH_ROWS):
+    # Bulk upsert of (id_misuratore, data_misurazione, flow_ls_raw, flow_ls_smoothed, is_outlier,
+    # window_median, thresholds) rows, at most one per key: each batch is COPYed into a temp
+    # staging table and merged with one set-based INSERT ... ON CONFLICT. Runs in the caller's
+    # transaction; returns the elapsed seconds.
+    t0 = perf_counter()
+    cur.execute(ENSURE_CLEAN_STAGING_SQL)
+    for start in range(0, len(rows), batch_rows):
+        copy_rows(cur, COPY_CLEAN_STAGING_SQL, rows[start:start + batch_rows])
+        cur.execute(UPSERT_CLEAN_SQL)
+    return perf_counter() - t0
+
+
+def format_rate(n_rows, seconds):
+    return f"{n_rows} rows in {seconds:.2f}s ({n_rows / seconds if seconds > 0 else 0:.0f} rows/s)"
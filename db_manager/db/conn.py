@@ -1,9 +1,27 @@
+import os
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 
-from db_manager.config.settings import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from db_manager.config.settings import (
+    DB_HOST,
+    DB_PORT,
+    DB_NAME,
+    DB_USER,
+    DB_PASSWORD,
+    DB_POOL_MIN_CONN,
+    DB_POOL_MAX_CONN,
+    DB_POOL_TIMEOUT_SECONDS,
+    DB_POOL_HEALTHCHECK_SECONDS,
+)
 
 
-def get_conn():
+def open_conn():
+    # Dedicated connection, not managed by the pool (caller must close it).
     return psycopg2.connect(
         host=DB_HOST,
         port=DB_PORT,
@@ -11,3 +29,187 @@ def get_conn():
         user=DB_USER,
         password=DB_PASSWORD,
     )
+
+
+# Errors that say nothing about the rows being written (DB down, connection lost, pool
+# exhausted): writers retry or spill on these instead of dropping data.
+TRANSIENT_DB_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, psycopg2.pool.PoolError)
+
+
+class ConnectionPool:
+    # Thread-safe pool: borrowers block (up to timeout) when max_conn connections are in use.
+    def __init__(self, min_conn, max_conn, timeout_seconds, healthcheck_seconds):
+        self.min_conn = min_conn
+        self.max_conn = max(max_conn, 1)
+        self.timeout_seconds = timeout_seconds
+        self.healthcheck_seconds = healthcheck_seconds
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, returned_at), LIFO so warm connections are reused first
+        self._in_use = 0
+        self._opened = 0
+        self._stats = {
+            "borrows": 0,
+            "wait_total_s": 0.0,
+            "wait_max_s": 0.0,
+            "timeouts": 0,
+            "peak_in_use": 0,
+            "connects": 0,
+            "discarded": 0,
+        }
+        for _ in range(min(min_conn, self.max_conn)):
+            self._idle.append((open_conn(), monotonic()))
+            self._opened += 1
+            self._stats["connects"] += 1
+
+    def _discard(self, conn):
+        self._opened -= 1
+        self._stats["discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if monotonic() - idle_since < self.healthcheck_seconds:
+            return True
+        # Long-idle connections may have been dropped by the server or a firewall.
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        t0 = monotonic()
+        deadline = t0 + self.timeout_seconds
+        with self._cond:
+            while not self._idle and self._opened >= self.max_conn:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise psycopg2.pool.PoolError(
+                        f"connection pool exhausted (waited {self.timeout_seconds}s)"
+                    )
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, idle_since = self._idle.pop()
+            else:
+                conn, idle_since = None, None
+                self._opened += 1  # reserve the slot while connecting outside the lock
+            self._in_use += 1
+            waited = monotonic() - t0
+            self._stats["borrows"] += 1
+            self._stats["wait_total_s"] += waited
+            self._stats["wait_max_s"] = max(self._stats["wait_max_s"], waited)
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._in_use)
+
+        try:
+            if conn is not None:
+                if self._is_healthy(conn, idle_since):
+                    return conn
+                # Replace a broken connection, keeping its slot reserved.
+                with self._cond:
+                    self._stats["discarded"] += 1
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            conn = open_conn()
+            with self._cond:
+                self._stats["connects"] += 1
+            return conn
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn):
+        healthy = not conn.closed and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        if healthy:
+            try:
+                # Hand the next borrower a clean session.
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                healthy = False
+        with self._cond:
+            self._in_use -= 1
+            if healthy:
+                self._idle.append((conn, monotonic()))
+            else:
+                self._discard(conn)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._opened
+            stats["in_use"] = self._in_use
+            stats["idle"] = len(self._idle)
+            stats["max_conn"] = self.max_conn
+        stats["utilisation"] = stats["in_use"] / self.max_conn
+        stats["wait_avg_ms"] = (stats["wait_total_s"] / stats["borrows"] * 1000) if stats["borrows"] else 0.0
+        return stats
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            for conn, _ in idle:
+                self._discard(conn)
+
+
+_POOL = None
+_POOL_PID = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    global _POOL, _POOL_PID
+    pid = os.getpid()
+    if _POOL is not None and _POOL_PID == pid:
+        return _POOL
+    with _POOL_LOCK:
+        # A forked child must not reuse the parent's sockets: start a fresh pool.
+        if _POOL is None or _POOL_PID != pid:
+            _POOL = ConnectionPool(
+                DB_POOL_MIN_CONN,
+                DB_POOL_MAX_CONN,
+                DB_POOL_TIMEOUT_SECONDS,
+                DB_POOL_HEALTHCHECK_SECONDS,
+            )
+            _POOL_PID = pid
+    return _POOL
+
+
+@contextmanager
+def get_conn():
+    # Borrow a pooled connection; commit on success, rollback on error, then return it.
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def close_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None and _POOL_PID == os.getpid():
+            _POOL.close()
+        _POOL = None
@@ -0,0 +1,39 @@
+import io
+import math
+from datetime import date, datetime
+
+
+def _copy_value(value):
+    # Text-format COPY encoding (NULL as \N, special characters escaped).
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "Infinity" if value > 0 else "-Infinity"
+        return repr(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    text = str(value)
+    if "\\" in text or "\t" in text or "\n" in text or "\r" in text:
+        text = (
+            text.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+    return text
+
+
+def format_copy_rows(rows):
+    return "".join("\t".join(_copy_value(v) for v in row) + "\n" for row in rows)
+
+
+def copy_rows(cur, copy_sql, rows):
+    # Streams rows to the server with a single COPY ... FROM STDIN.
+    cur.copy_expert(copy_sql, io.StringIO(format_copy_rows(rows)))
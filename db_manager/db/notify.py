@@ -0,0 +1,56 @@
+import select
+import threading
+from time import sleep
+
+from db_manager.db.conn import open_conn
+
+# Sent by the raw writers in the same transaction as the rows, so it is delivered on commit.
+RAW_COMMITTED_CHANNEL = "hydro_raw_committed"
+
+MAX_RECONNECT_SLEEP_SECONDS = 30
+
+
+def notify(cur, channel, payload=""):
+    cur.execute("SELECT pg_notify(%s, %s);", (channel, payload))
+
+
+def start_notify_listener(triggers_by_channel, poll_seconds=5):
+    # LISTENs on a dedicated connection and fires the JobTriggers registered for each channel.
+    # After (re)connecting all triggers fire once, since notifications may have been missed.
+    def loop():
+        attempt = 0
+        while True:
+            conn = None
+            try:
+                conn = open_conn()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    for channel in triggers_by_channel:
+                        cur.execute(f"LISTEN {channel};")
+                print(f"[notify] listening on {', '.join(triggers_by_channel)}")
+                attempt = 0
+                for triggers in triggers_by_channel.values():
+                    for trigger in triggers:
+                        trigger.fire()
+                while True:
+                    if select.select([conn], [], [], poll_seconds) == ([], [], []):
+                        continue
+                    conn.poll()
+                    channels = {n.channel for n in conn.notifies}
+                    conn.notifies.clear()
+                    for channel in channels:
+                        for trigger in triggers_by_channel.get(channel, ()):
+                            trigger.fire()
+            except Exception as e:
+                attempt += 1
+                print(f"[notify] listener error (attempt {attempt}): {e}")
+                sleep(min(2 ** (attempt - 1), MAX_RECONNECT_SLEEP_SECONDS))
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    thread = threading.Thread(target=loop, name="notify-listener", daemon=True)
+    thread.start()
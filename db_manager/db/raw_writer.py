@@ -0,0 +1,195 @@
+import queue
+import threading
+import traceback
+from time import monotonic, sleep
+
+from psycopg2.extras import execute_values
+
+from db_manager.config.settings import RAW_TABLE_NAME, SPILL_AFTER_ATTEMPTS, INGEST_WIDE_ROWS, INGEST_KEEP_RAW
+from db_manager.core.pivot import pivot_raw_rows
+from db_manager.db.conn import get_conn, TRANSIENT_DB_ERRORS
+from db_manager.db.copy import copy_rows
+from db_manager.db.notify import notify, RAW_COMMITTED_CHANNEL
+from db_manager.db.sql_loader import load_sql
+
+MAX_RETRY_SLEEP_SECONDS = 30
+COPY_RAW_SQL = load_sql("copy_raw_measurements.sql").replace("{RAW_TABLE_NAME}", RAW_TABLE_NAME)
+INSERT_WIDE_SQL = load_sql("insert_wide_measurements.sql")
+
+
+def write_raw_rows(rows):
+    # Writes raw EAV rows to the raw table and/or, in wide mode, pivoted straight into
+    # tab_measurements; both in the same transaction, which also wakes the downstream jobs.
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            if not INGEST_WIDE_ROWS or INGEST_KEEP_RAW:
+                copy_rows(cur, COPY_RAW_SQL, rows)
+            if INGEST_WIDE_ROWS:
+                execute_values(cur, INSERT_WIDE_SQL, pivot_raw_rows(rows), page_size=1000)
+            notify(cur, RAW_COMMITTED_CHANNEL, str(len(rows)))
+        conn.commit()
+
+
+class RawWriter:
+    # Drains raw rows queued by the consumers and writes them in micro-batches with COPY.
+    # on_commit callbacks (checkpoints) run only after the batch holding the rows has committed,
+    # or has been made durable in the spill buffer while the DB is unreachable.
+    def __init__(self, batch_rows, max_age_seconds, queue_events, spill=None):
+        self.batch_rows = batch_rows
+        self.max_age_seconds = max_age_seconds
+        self.spill = spill
+        self._queue = queue.Queue(maxsize=queue_events)
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "events": 0,
+            "rows": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "dropped_rows": 0,
+            "spilled_batches": 0,
+            "last_flush_ms": 0.0,
+            "max_lag_ms": 0.0,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="raw-writer", daemon=True)
+        self._thread.start()
+        print(
+            f"[raw_writer] started (batch {self.batch_rows} rows / {self.max_age_seconds}s, "
+            f"queue {self._queue.maxsize} events)"
+        )
+
+    def submit(self, rows, on_commit=None):
+        # Blocks when the queue is full, so a slow DB applies backpressure to the consumers.
+        self._queue.put((rows, on_commit, monotonic()))
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queued_events"] = self._queue.qsize()
+        if self.spill is not None:
+            stats.update({f"spill_{name}": value for name, value in self.spill.stats().items()})
+        return stats
+
+    def _next_batch(self):
+        try:
+            first = self._queue.get(timeout=self.max_age_seconds)
+        except queue.Empty:
+            return []
+        batch = [first]
+        n_rows = len(first[0])
+        deadline = first[2] + self.max_age_seconds
+        while n_rows < self.batch_rows:
+            remaining = deadline - monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            n_rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        rows = [row for item_rows, _, _ in batch for row in item_rows]
+        t0 = monotonic()
+        attempt = 0
+        spilled = False
+        while True:
+            try:
+                # While older rows are still on disk, newer ones queue up behind them to keep the order.
+                if self.spill is not None and self.spill.pending():
+                    with self.spill.lock:
+                        behind_spill = self.spill.pending()
+                        if behind_spill:
+                            spilled = self.spill.append(rows)
+                    if behind_spill and not spilled:
+                        print("[raw_writer] spill buffer full, waiting for replay")
+                        sleep(1)
+                        continue
+                if not spilled:
+                    write_raw_rows(rows)
+                break
+            except TRANSIENT_DB_ERRORS as e:
+                # DB unreachable or pool exhausted: spill the batch to disk, or keep it and retry with backoff.
+                attempt += 1
+                with self._stats_lock:
+                    self._stats["failed_batches"] += 1
+                print(f"[raw_writer] DB unavailable (attempt {attempt}): {type(e).__name__}: {e}")
+                if self.spill is not None and attempt >= SPILL_AFTER_ATTEMPTS:
+                    spilled = self.spill.append(rows)
+                    if spilled:
+                        break
+                if self._stop.is_set() and attempt >= 3:
+                    self._drop(rows, "shutdown while DB unavailable")
+                    return
+                sleep(min(2 ** (attempt - 1), MAX_RETRY_SLEEP_SECONDS))
+            except Exception as e:
+                print(f"[raw_writer] COPY error, retrying the {len(batch)} events one by one: {e}")
+                traceback.print_exc()
+                self._flush_one_by_one(batch, t0)
+                return
+
+        self._committed(batch, t0, spilled)
+
+    def _flush_one_by_one(self, batch, t0):
+        # The batch was rejected for its content: write each event on its own so only the
+        # failing ones are dropped and the others get their checkpoints.
+        written = []
+        for index, (item_rows, _, _) in enumerate(batch):
+            try:
+                write_raw_rows(item_rows)
+            except TRANSIENT_DB_ERRORS:
+                # DB gone meanwhile: the rest takes the normal retry / spill path.
+                if written:
+                    self._committed(written, t0, False)
+                self._flush(batch[index:])
+                return
+            except Exception as e:
+                self._drop(item_rows, f"COPY error: {e}")
+                continue
+            written.append(batch[index])
+        if written:
+            self._committed(written, t0, False)
+
+    def _committed(self, batch, t0, spilled):
+        rows = sum(len(item_rows) for item_rows, _, _ in batch)
+        now = monotonic()
+        flush_ms = (now - t0) * 1000
+        with self._stats_lock:
+            self._stats["events"] += len(batch)
+            self._stats["rows"] += rows
+            self._stats["batches"] += 1
+            self._stats["last_flush_ms"] = flush_ms
+            self._stats["max_lag_ms"] = max(self._stats["max_lag_ms"], (now - batch[0][2]) * 1000)
+            if spilled:
+                self._stats["spilled_batches"] += 1
+        action = "spilled to disk" if spilled else "copied"
+        print(f"[raw_writer] {action} {rows} rows ({len(batch)} events) in {flush_ms:.1f} ms")
+
+        for _, on_commit, _ in batch:
+            if on_commit is None:
+                continue
+            try:
+                on_commit()
+            except Exception as e:
+                print(f"[raw_writer] on_commit callback error: {e}")
+
+    def _drop(self, rows, reason):
+        # The event's own checkpoint is not advanced, but a later committed event of the same
+        # partition moves past it: dropped rows are lost, only counted and logged.
+        with self._stats_lock:
+            self._stats["dropped_rows"] += len(rows)
+        print(f"[raw_writer] dropped {len(rows)} rows ({reason})")
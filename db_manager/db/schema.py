@@ -1,7 +1,11 @@
-from db_manager.config.settings import RAW_TABLE_NAME
+from datetime import datetime, timedelta, timezone
+
+from db_manager.config.settings import RAW_TABLE_NAME, RAW_PARTITIONS_AHEAD_DAYS
 from db_manager.db.conn import get_conn
 from db_manager.db.sql_loader import load_sql
 
+RAW_PARTITION_PREFIX = "_p"  # daily partitions: <RAW_TABLE_NAME>_pYYYYMMDD
+
 def ensure_raw_table():
     try:
         with get_conn() as conn:
@@ -14,6 +18,56 @@ def ensure_raw_table():
         print(f"[schema] raw table error: {e}")
         raise
 
+def raw_partition_name(day):
+    return f"{RAW_TABLE_NAME}{RAW_PARTITION_PREFIX}{day:%Y%m%d}"
+
+def raw_partition_day(partition_name):
+    # Inverse of raw_partition_name (table name without schema); None for the default partition.
+    table = RAW_TABLE_NAME.split(".")[-1]
+    suffix = partition_name[len(table + RAW_PARTITION_PREFIX):]
+    if not partition_name.startswith(table + RAW_PARTITION_PREFIX) or len(suffix) != 8 or not suffix.isdigit():
+        return None
+    return datetime.strptime(suffix, "%Y%m%d").date()
+
+def is_raw_table_partitioned(cur):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass;", (RAW_TABLE_NAME,))
+    return cur.fetchone()[0] == "p"
+
+def ensure_raw_partitions(days_ahead=RAW_PARTITIONS_AHEAD_DAYS):
+    # Creates the default partition and one partition per UTC day from yesterday to today + days_ahead.
+    # Returns False (partitioning unavailable) when the raw table predates partitioning.
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            if not is_raw_table_partitioned(cur):
+                print(
+                    f"[schema] WARNING: {RAW_TABLE_NAME} is not partitioned; "
+                    "partition management and raw retention are disabled (see README)"
+                )
+                return False
+            cur.execute(load_sql("ensure_raw_default_partition.sql").replace("{RAW_TABLE_NAME}", RAW_TABLE_NAME))
+        conn.commit()
+
+    sql_partition = load_sql("ensure_raw_partition.sql").replace("{RAW_TABLE_NAME}", RAW_TABLE_NAME)
+    today = datetime.now(timezone.utc).date()
+    for offset in range(-1, days_ahead + 1):
+        day = today + timedelta(days=offset)
+        day_start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        sql = (
+            sql_partition
+            .replace("{PARTITION_NAME}", raw_partition_name(day))
+            .replace("{FROM_MSEC}", str(int(day_start.timestamp() * 1000)))
+            .replace("{TO_MSEC}", str(int((day_start + timedelta(days=1)).timestamp() * 1000)))
+        )
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql)
+                conn.commit()
+        except Exception as e:
+            # Typically rows for that day already sit in the default partition.
+            print(f"[schema] raw partition {raw_partition_name(day)} error: {e}")
+    return True
+
 def ensure_etl_state_table():
     try:
         with get_conn() as conn:
@@ -49,3 +103,87 @@ def ensure_flow_histogram_table():
     except Exception as e:
         print(f"[schema] flow histogram table error: {e}")
         raise
+
+def ensure_eventhub_checkpoint_tables():
+    try:
+        with get_conn() as conn:
+            sql = load_sql("ensure_eventhub_checkpoint_tables.sql")
+            with conn.cursor() as cur:
+                cur.execute(sql)
+            conn.commit()
+        print("[schema] eventhub checkpoint tables ok")
+    except Exception as e:
+        print(f"[schema] eventhub checkpoint tables error: {e}")
+        raise
+
+def ensure_clean_regenerate_progress_table():
+    try:
+        with get_conn() as conn:
+            sql = load_sql("ensure_clean_regenerate_progress_table.sql")
+            with conn.cursor() as cur:
+                cur.execute(sql)
+            conn.commit()
+        print("[schema] clean regenerate progress table ok")
+    except Exception as e:
+        print(f"[schema] clean regenerate progress table error: {e}")
+        raise
+
+def ensure_clean_device_state_table():
+    try:
+        with get_conn() as conn:
+            sql = load_sql("ensure_clean_device_state_table.sql")
+            with conn.cursor() as cur:
+                cur.execute(sql)
+            conn.commit()
+        print("[schema] clean device state table ok")
+    except Exception as e:
+        print(f"[schema] clean device state table error: {e}")
+        raise
+
+def ensure_clean_daily_partials_table():
+    try:
+        with get_conn() as conn:
+            sql = load_sql("ensure_clean_daily_partials_table.sql")
+            with conn.cursor() as cur:
+                cur.execute(sql)
+            conn.commit()
+        print("[schema] clean daily partials table ok")
+    except Exception as e:
+        print(f"[schema] clean daily partials table error: {e}")
+        raise
+
+def ensure_clean_rollup_tables():
+    try:
+        with get_conn() as conn:
+            sql = load_sql("ensure_clean_rollup_tables.sql")
+            with conn.cursor() as cur:
+                cur.execute(sql)
+            conn.commit()
+        print("[schema] clean rollup tables ok")
+    except Exception as e:
+        print(f"[schema] clean rollup tables error: {e}")
+        raise
+
+def ensure_flow_duration_curve_table():
+    try:
+        with get_conn() as conn:
+            sql = load_sql("ensure_flow_duration_curve_table.sql")
+            with conn.cursor() as cur:
+                cur.execute(sql)
+            conn.commit()
+        print("[schema] flow duration curve table ok")
+    except Exception as e:
+        print(f"[schema] flow duration curve table error: {e}")
+        raise
+
+def ensure_flow_sketch_table():
+    try:
+        with get_conn() as conn:
+            sql = load_sql("ensure_flow_sketch_table.sql")
+            with conn.cursor() as cur:
+                cur.execute(sql)
+            conn.commit()
+        print("[schema] flow sketch table ok")
+    except Exception as e:
+        print(f"[schema] flow sketch table error: {e}")
+        raise
@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+from pathlib import Path
+from time import sleep, time_ns
+
+from db_manager.db.conn import TRANSIENT_DB_ERRORS
+
+
+class SpillBuffer:
+    # Append-only, fsync'd segment files holding raw rows while Postgres is unreachable.
+    # Segments are replayed oldest first; while any segment is pending, new rows must be
+    # spilled too (check pending() and append() under .lock) so rows reach the DB in order.
+    def __init__(self, directory, max_bytes, segment_bytes, replay_chunk_rows=1000):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.replay_chunk_rows = replay_chunk_rows
+        self.lock = threading.RLock()
+        self._active = None  # (path, file)
+        self._active_bytes = 0
+        self._seq = 0
+        self._head_done = 0  # rows of the oldest segment already written by an interrupted replay
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Segments left over by a previous run are replayed like any other sealed segment.
+        self._sealed = sorted(self.directory.glob("*.jsonl"))
+        self._bytes = sum(p.stat().st_size for p in self._sealed)
+        self._stats = {"spilled_rows": 0, "replayed_rows": 0, "rejected_rows": 0, "corrupt_lines": 0, "bad_segments": 0, "bad_rows": 0}
+
+    def pending(self):
+        with self.lock:
+            return bool(self._sealed) or self._active_bytes > 0
+
+    def append(self, rows):
+        # Returns False (nothing written) when the size cap would be exceeded.
+        data = "".join(json.dumps(list(row)) + "\n" for row in rows).encode("utf-8")
+        with self.lock:
+            if self._bytes + len(data) > self.max_bytes:
+                self._stats["rejected_rows"] += len(rows)
+                return False
+            if self._active is not None and self._active_bytes + len(data) > self.segment_bytes:
+                self.seal()
+            if self._active is None:
+                self._seq += 1
+                path = self.directory / f"{time_ns():020d}-{self._seq:06d}.jsonl"
+                self._active = (path, open(path, "ab"))
+                self._active_bytes = 0
+            f = self._active[1]
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            self._active_bytes += len(data)
+            self._bytes += len(data)
+            self._stats["spilled_rows"] += len(rows)
+            return True
+
+    def seal(self):
+        with self.lock:
+            if self._active is None:
+                return
+            path, f = self._active
+            f.close()
+            self._active = None
+            if self._active_bytes:
+                self._sealed.append(path)
+            else:
+                path.unlink(missing_ok=True)
+            self._active_bytes = 0
+
+    def _read_segment(self, path):
+        rows = []
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    rows.append(tuple(json.loads(line)))
+                except ValueError:
+                    # Torn write from a crash: the rest of the segment is still usable.
+                    self._stats["corrupt_lines"] += 1
+        return rows
+
+    def _set_aside(self, path, rows, error):
+        # Rows the DB rejects for their content would block everything behind them: they are
+        # appended to <segment>.bad (kept for inspection, never replayed again).
+        with open(path.with_suffix(".bad"), "ab") as f:
+            f.write("".join(json.dumps(list(row)) + "\n" for row in rows).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            self._stats["bad_rows"] += len(rows)
+        print(f"[spill] set aside {len(rows)} rows of {path.name} in {path.with_suffix('.bad').name}: {error}")
+
+    def _write_salvaging(self, path, rows, write_rows):
+        # Writes rows[self._head_done:]. On a content error the rest is retried per chunk, and a
+        # failing chunk per row, so only the rejected rows are set aside. Transient DB errors are
+        # raised; _head_done keeps the progress so the next replay does not write rows twice.
+        # Returns the number of rows set aside.
+        try:
+            write_rows(rows[self._head_done:])
+            return 0
+        except TRANSIENT_DB_ERRORS:
+            raise
+        except Exception as e:
+            print(f"[spill] {path.name} rejected, replaying it in chunks: {e}")
+        bad_rows = 0
+        while self._head_done < len(rows):
+            chunk = rows[self._head_done:self._head_done + self.replay_chunk_rows]
+            try:
+                write_rows(chunk)
+                self._head_done += len(chunk)
+                continue
+            except TRANSIENT_DB_ERRORS:
+                raise
+            except Exception:
+                pass
+            for row in chunk:
+                try:
+                    write_rows([row])
+                except TRANSIENT_DB_ERRORS:
+                    raise
+                except Exception as e:
+                    self._set_aside(path, [row], e)
+                    bad_rows += 1
+                self._head_done += 1
+        return bad_rows
+
+    def replay(self, write_rows):
+        # Loads pending segments through write_rows(rows); stops at the first transient DB error.
+        while True:
+            with self.lock:
+                if not self._sealed:
+                    if self._active_bytes == 0:
+                        return
+                    self.seal()
+                path = self._sealed[0]
+            rows = self._read_segment(path)
+            bad_rows = self._write_salvaging(path, rows, write_rows) if rows else 0
+            size = path.stat().st_size
+            path.unlink(missing_ok=True)
+            with self.lock:
+                self._sealed.pop(0)
+                self._head_done = 0
+                self._bytes -= size
+                self._stats["replayed_rows"] += len(rows) - bad_rows
+                if bad_rows:
+                    self._stats["bad_segments"] += 1
+            print(f"[spill] replayed {len(rows) - bad_rows} rows from {path.name}")
+
+    def start_replayer(self, write_rows, interval_seconds):
+        def loop():
+            while True:
+                sleep(interval_seconds)
+                if not self.pending():
+                    continue
+                try:
+                    self.replay(write_rows)
+                except TRANSIENT_DB_ERRORS as e:
+                    print(f"[spill] DB still unavailable, replay postponed: {type(e).__name__}: {e}")
+                except Exception as e:
+                    print(f"[spill] replay error: {e}")
+        thread = threading.Thread(target=loop, name="spill-replayer", daemon=True)
+        thread.start()
+        print(f"[spill] replayer started on {self.directory} (every {interval_seconds}s)")
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self._stats)
+            stats["segments"] = len(self._sealed) + (1 if self._active_bytes else 0)
+            stats["bytes"] = self._bytes
+        return stats
+
+
+def adopt_segments(directory, from_directories):
+    # Moves the segments left in directories no buffer will open (e.g. worker-N after lowering
+    # the worker count) into directory, before its buffer starts. Names are kept (they sort by
+    # creation time), so the replay order stays oldest first. Returns the segments moved.
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    moved = 0
+    for source in map(Path, from_directories):
+        if not source.is_dir() or source.resolve() == directory.resolve():
+            continue
+        segments = sorted(source.glob("*.jsonl"))
+        for path in segments:
+            target = directory / path.name
+            n = 0
+            while target.exists():
+                n += 1
+                target = directory / f"{path.stem}-{n}.jsonl"
+            path.rename(target)
+        if segments:
+            print(f"[spill] moved {len(segments)} orphaned segments from {source} to {directory}")
+        moved += len(segments)
+    return moved
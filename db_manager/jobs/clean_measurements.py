@@ -1,17 +1,20 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
 import pandas as pd
-from hampel import hampel
+from psycopg2.extras import execute_values
 
+from db_manager.core.hampel_filter import hampel_filter, clamp_numeric
 from db_manager.db.conn import get_conn
+from db_manager.db.clean_writer import upsert_clean_rows, format_rate
 from db_manager.db.sql_loader import load_sql
-from db_manager.config.settings import HAMPEL_WINDOW_SIZE, HAMPEL_SIGMA_THRESHOLD
+from db_manager.config.settings import HAMPEL_WINDOW_SIZE, HAMPEL_SIGMA_THRESHOLD, CLEAN_WORKERS, CLEAN_BATCH_DEVICES, CLEAN_DEVICE_MAX_ROWS
 
 
 JOB_NAME = "clean_measurements"
-MAX_NUMERIC = 9_999_999.999
-MIN_NUMERIC = -9_999_999.999
 
 def _get_last_ts(cur):
-    # Read last processed timestamp (ms) from ETL state.
+    # Global watermark (ms) of the pre per-device job: only the starting point of tab_clean_device_state.
     cur.execute("""
                 SELECT last_parent_timestampmsec
                 FROM hydro.tab_etl_state
@@ -20,80 +23,124 @@ def _get_last_ts(cur):
     row = cur.fetchone()
     return row[0] if row else 0
 
-def _clamp_numeric(value):
-    if value is None:
-        return None
-    if value > MAX_NUMERIC:
-        return MAX_NUMERIC
-    if value < MIN_NUMERIC:
-        return MIN_NUMERIC
-    return value
-
-def _update_last_ts(cur, ts):
-    # Persist last processed timestamp (ms) for incremental runs.
-    cur.execute("""
-                INSERT INTO hydro.tab_etl_state (job_name, last_parent_timestampmsec, updated_at)
-                VALUES (%s, %s, now())
-                ON CONFLICT (job_name)
-                DO UPDATE SET last_parent_timestampmsec = EXCLUDED.last_parent_timestampmsec,
-                updated_at = EXCLUDED.updated_at
-                """, (JOB_NAME, ts))
 
+def build_clean_rows(device_id, timestamps, flow_raw, start=0):
+    # Applies the Hampel filter to one device's series (ordered by time) and returns
+    # the upsert_cleaned_measurements.sql parameters from index start on, built column-wise.
+    result = hampel_filter(flow_raw, HAMPEL_WINDOW_SIZE, HAMPEL_SIGMA_THRESHOLD)
+    medians = clamp_numeric(result.medians[start:])
+    thresholds = clamp_numeric(result.thresholds[start:])
+    has_window = result.has_window[start:].tolist()
+    return list(zip(
+        [device_id] * (len(timestamps) - start),
+        timestamps[start:],
+        clamp_numeric(flow_raw[start:]),
+        clamp_numeric(result.filtered[start:]),
+        result.is_outlier[start:].tolist(),
+        # No window around the first/last points of the series: no median/threshold.
+        [m if ok else None for m, ok in zip(medians, has_window)],
+        [t if ok else None for t, ok in zip(thresholds, has_window)],
+    ))
+
+
+def _sync_device_state():
+    # Registers new devices in tab_clean_device_state. The first time (empty table) every device
+    # starts from the old global watermark; devices appearing later start from the beginning.
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM hydro.tab_clean_device_state);")
+            if cur.fetchone()[0]:
+                initial_ts = "-infinity"
+            else:
+                initial_ts = datetime.fromtimestamp(_get_last_ts(cur) / 1000.0, tz=timezone.utc)
+            cur.execute(load_sql("sync_clean_device_state.sql"), {"initial_ts": initial_ts})
+        conn.commit()
 
-def clean_measurements():
-    # Load SQL upsert for tab_measurements_clean.
-    sql_upsert = load_sql("upsert_cleaned_measurements.sql")
+
+def update_device_state(cur, last_ts_by_device):
+    # Advances the per-device watermarks (never backwards).
+    execute_values(cur, load_sql("upsert_clean_device_state.sql"), list(last_ts_by_device.items()))
+
+
+def _clean_device_batch():
+    # Leases up to CLEAN_BATCH_DEVICES devices with new rows and cleans them in one transaction:
+    # each device's new rows are filtered together with its last 2 * (HAMPEL_WINDOW_SIZE // 2)
+    # cleaned points, and the rows whose centred window changed (the last
+    # HAMPEL_WINDOW_SIZE // 2 old points plus the new ones) are upserted; the result equals a
+    # full regeneration. Returns None when no device is left to lease.
+    half_window = HAMPEL_WINDOW_SIZE // 2
 
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # Fetch only new measurements (incremental).
-            last_ts = _get_last_ts(cur)
-
-            cur.execute("""
-                        SELECT device_id, ts_s, instant_flow_rate_2
-            FROM hydro.tab_measurements
-            WHERE extract(epoch FROM ts_s) * 1000 > %s
-            ORDER BY device_id, ts_s;
-            """, (last_ts,))
+            cur.execute(load_sql("claim_clean_devices.sql"), {"batch_devices": CLEAN_BATCH_DEVICES})
+            device_ids = [row[0] for row in cur.fetchall()]
+            if not device_ids:
+                conn.commit()
+                return None
+
+            cur.execute(load_sql("select_clean_new_rows.sql"), {
+                "device_ids": device_ids,
+                "max_rows": CLEAN_DEVICE_MAX_ROWS,
+            })
             rows = cur.fetchall()
-
-        if not rows:
-            print("No new measurements to clean.")
-            return
+            cur.execute(load_sql("select_clean_device_context.sql"), {
+                "device_ids": device_ids,
+                "context_rows": 2 * half_window,
+            })
+            context_rows = cur.fetchall()
 
         df = pd.DataFrame(rows, columns=["device_id", "ts_s", "flow_raw"])
+        context_df = pd.DataFrame(context_rows, columns=["device_id", "ts_s", "flow_raw"])
+        context_by_device = dict(tuple(context_df.groupby("device_id", sort=False)))
 
         out_params = []
-        max_ts = last_ts
-        for device_id, group in df.groupby("device_id"):
-            # Apply Hampel filter per device.
-            series = group["flow_raw"].astype(float)
-
-            result = hampel(series, window_size=HAMPEL_WINDOW_SIZE, n_sigma=HAMPEL_SIGMA_THRESHOLD)
-            filtered = result.filtered_data
-            outlier_indices = set(result.outlier_indices)
-            medians = result.medians
-            thresholds = result.thresholds
-
-            for i, (idx, row) in enumerate(group.iterrows()):
-                ts_s = row["ts_s"]
-                ts_msec = int(ts_s.timestamp() * 1000)
-                max_ts = max(max_ts, ts_msec)
-
-                is_outlier = i in outlier_indices
-                # Prepare row for upsert in tab_measurements_clean.
-                out_params.append((
-                    device_id,
-                    ts_s,
-                    _clamp_numeric(float(row["flow_raw"])),
-                    _clamp_numeric(float(filtered[i])),
-                    bool(is_outlier),
-                    _clamp_numeric(float(medians[i])) if medians is not None else None,
-                    _clamp_numeric(float(thresholds[i])) if thresholds is not None else None
-                ))
+        last_ts_by_device = {}
+        recomputed = 0
+        for device_id, group in df.groupby("device_id", sort=False):
+            # Apply Hampel filter per device (rows are ordered by device_id, ts_s).
+            context = context_by_device.get(device_id)
+            n_context = 0 if context is None else len(context.index)
+            if n_context:
+                group = pd.concat([context, group])
+            timestamps = group["ts_s"].tolist()
+            # Old points further back than half a window are not affected by the new rows.
+            start = max(n_context - half_window, 0)
+            out_params.extend(build_clean_rows(device_id, timestamps, group["flow_raw"].astype(float).to_numpy(), start))
+            recomputed += n_context - start
+            last_ts_by_device[device_id] = timestamps[-1]
 
         with conn.cursor() as cur:
-            cur.executemany(sql_upsert, out_params)
-            _update_last_ts(cur, max_ts)
+            write_seconds = upsert_clean_rows(cur, out_params)
+            if last_ts_by_device:
+                update_device_state(cur, last_ts_by_device)
         conn.commit()
-        print(f"[clean_measurements] upserted {len(out_params)} rows")
+        print(
+            f"[clean_measurements] {len(device_ids)} devices: upserted {format_rate(len(out_params), write_seconds)} "
+            f"({len(rows)} new, {recomputed} recomputed)"
+        )
+        return len(out_params)
+
+
+def _clean_worker():
+    # Leases and cleans device batches until no device has new rows.
+    total_rows = 0
+    while True:
+        rows = _clean_device_batch()
+        if rows is None:
+            return total_rows
+        total_rows += rows
+
+
+def clean_measurements(workers=CLEAN_WORKERS):
+    # Incremental cleaning with per-device watermarks (tab_clean_device_state): a lagging or
+    # backfilled meter only delays itself. Devices are leased with FOR UPDATE SKIP LOCKED, so
+    # `workers` threads here, and any other process running this job, clean disjoint devices.
+    _sync_device_state()
+    if workers <= 1:
+        total_rows = _clean_worker()
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            total_rows = sum(executor.map(lambda _: _clean_worker(), range(workers)))
+    if not total_rows:
+        print("No new measurements to clean.")
+    return total_rows
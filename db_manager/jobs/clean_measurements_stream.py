@@ -0,0 +1,143 @@
+import json
+import math
+import os
+from datetime import datetime
+from pathlib import Path
+
+from db_manager.core.hampel_filter import MAX_NUMERIC, MIN_NUMERIC
+from db_manager.core.online_hampel import OnlineHampel
+from db_manager.db.conn import get_conn
+from db_manager.db.clean_writer import upsert_clean_rows, format_rate
+from db_manager.db.sql_loader import load_sql
+from db_manager.jobs.clean_measurements import _sync_device_state, update_device_state
+from db_manager.config.settings import HAMPEL_WINDOW_SIZE, HAMPEL_SIGMA_THRESHOLD, CLEAN_STREAM_STATE_PATH, CLEAN_DEVICE_MAX_ROWS
+
+
+# Operator kept between runs; a device's window is valid only while it ends at the device watermark.
+_STATE = {"operator": None}
+
+
+def _clamp(value):
+    # Same clamping as clamp_numeric, for single values (None and NaN pass through).
+    if value is None:
+        return None
+    return min(max(value, MIN_NUMERIC), MAX_NUMERIC)
+
+
+def _to_float(value):
+    return math.nan if value is None else float(value)
+
+
+def _save_state(operator):
+    # Write-then-rename so a crash never leaves a truncated file behind.
+    path = Path(CLEAN_STREAM_STATE_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        "window_size": HAMPEL_WINDOW_SIZE,
+        "n_sigma": HAMPEL_SIGMA_THRESHOLD,
+        "devices": {
+            device_id: [[ts.isoformat(), raw] for ts, raw in points]
+            for device_id, points in operator.snapshot().items()
+        },
+    }
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _load_state():
+    # Snapshot usable only if written for the current filter parameters; each device's window
+    # is checked against its watermark when the device gets new rows.
+    path = Path(CLEAN_STREAM_STATE_PATH)
+    operator = OnlineHampel(HAMPEL_WINDOW_SIZE, HAMPEL_SIGMA_THRESHOLD)
+    if not path.exists():
+        return operator
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except ValueError as e:
+        print(f"[clean_stream] ignoring unreadable state {path}: {e}")
+        return operator
+    if (data.get("window_size"), data.get("n_sigma")) != (HAMPEL_WINDOW_SIZE, HAMPEL_SIGMA_THRESHOLD):
+        print(f"[clean_stream] state {path} is stale, reseeding from tab_measurements_clean")
+        return operator
+    operator.restore({
+        device_id: [(datetime.fromisoformat(ts), raw) for ts, raw in points]
+        for device_id, points in data["devices"].items()
+    })
+    print(f"[clean_stream] restored state of {len(operator.devices)} devices from {path}")
+    return operator
+
+
+def clean_measurements_stream():
+    # Online alternative to clean_measurements (CLEAN_MODE=stream): new rows are pushed one by
+    # one into per-device rolling Hampel windows kept in memory (and snapshotted to
+    # CLEAN_STREAM_STATE_PATH after each commit), so no history is re-read or re-filtered.
+    # Devices without a window ending at their watermark (new, or advanced by a batch run) are
+    # seeded with their last cleaned points. Same rows and per-device watermarks
+    # (tab_clean_device_state) as the batch job: the two modes can be switched at any time.
+    try:
+        return _run()
+    except Exception:
+        # The DB did not advance: drop the in-memory windows, they are ahead of it.
+        _STATE["operator"] = None
+        raise
+
+
+def _run():
+    _sync_device_state()
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id_misuratore, last_ts FROM hydro.tab_clean_device_state;")
+            device_state = dict(cur.fetchall())
+            cur.execute(load_sql("select_clean_new_rows.sql"), {
+                "device_ids": list(device_state),
+                "max_rows": CLEAN_DEVICE_MAX_ROWS,
+            })
+            rows = cur.fetchall()
+            operator = _STATE["operator"] or _load_state()
+
+            if not rows:
+                _STATE["operator"] = operator
+                print("No new measurements to clean.")
+                return 0
+
+            stale_devices = sorted(
+                device_id for device_id in {row[0] for row in rows}
+                if operator.last_ts(device_id) != device_state[device_id]
+            )
+            if stale_devices:
+                cur.execute(load_sql("select_clean_device_context.sql"), {
+                    "device_ids": stale_devices,
+                    "context_rows": operator.size - 1,
+                })
+                context = {device_id: [] for device_id in stale_devices}
+                for device_id, ts, raw in cur.fetchall():
+                    context[device_id].append((ts, _to_float(raw)))
+                operator.seed(context)
+
+        # A point is emitted as an edge row first and again once its window is complete:
+        # keep the last version of each row.
+        out_rows = {}
+        last_ts_by_device = {}
+        for device_id, ts, raw in rows:
+            for row in operator.push(device_id, ts, _to_float(raw)):
+                out_rows[row[:2]] = row
+            last_ts_by_device[device_id] = ts
+        out_params = [
+            (device_id, ts, _clamp(raw), _clamp(filtered), is_outlier, _clamp(median), _clamp(threshold))
+            for device_id, ts, raw, filtered, is_outlier, median, threshold in out_rows.values()
+        ]
+
+        with conn.cursor() as cur:
+            write_seconds = upsert_clean_rows(cur, out_params)
+            update_device_state(cur, last_ts_by_device)
+        conn.commit()
+
+    _STATE["operator"] = operator
+    _save_state(operator)
+    print(f"[clean_stream] upserted {format_rate(len(out_params), write_seconds)} ({len(rows)} new, {len(stale_devices)} devices seeded)")
+    return len(out_params)
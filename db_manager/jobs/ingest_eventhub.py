@@ -1,26 +1,41 @@
 import threading
 from time import time, sleep
-import json
-import traceback
 
-import psycopg2
 from azure.eventhub import EventHubConsumerClient
 
-from db_manager.config.settings import MIN_SECONDS_BETWEEN_EVENTS, RAW_TABLE_NAME
+from db_manager.config.settings import (
+    MIN_SECONDS_BETWEEN_EVENTS,
+    THROTTLE_MAX_DEVICES,
+    THROTTLE_TTL_SECONDS,
+    THROTTLE_LOCK_STRIPES,
+    DECODE_STATS_MAX_DEVICES,
+    RAW_WRITER_BATCH_ROWS,
+    RAW_WRITER_MAX_AGE_SECONDS,
+    RAW_WRITER_QUEUE_EVENTS,
+    SPILL_ENABLED,
+    SPILL_DIR,
+    SPILL_MAX_BYTES,
+    SPILL_SEGMENT_BYTES,
+    SPILL_REPLAY_CHUNK_ROWS,
+    SECONDS_BETWEEN_SPILL_REPLAY,
+)
+from db_manager.core.decoder import DecodeStats, PayloadError, decode_rows
+from db_manager.core.throttle import DeviceThrottle
+from db_manager.db.checkpoint_store import get_checkpoint_store, close_checkpoint_store
 from db_manager.db.conn import get_conn
+from db_manager.db.raw_writer import RawWriter, write_raw_rows
+from db_manager.db.spill_buffer import SpillBuffer
 from db_manager.db.sql_loader import load_sql
 
-LAST_EVENT_TS_BY_ID = {}
-STATE_LOCK = threading.Lock()
+THROTTLE = DeviceThrottle(MIN_SECONDS_BETWEEN_EVENTS, THROTTLE_MAX_DEVICES, THROTTLE_TTL_SECONDS, THROTTLE_LOCK_STRIPES)
+DECODE_STATS = DecodeStats(DECODE_STATS_MAX_DEVICES)
+RAW_WRITER = RawWriter(RAW_WRITER_BATCH_ROWS, RAW_WRITER_MAX_AGE_SECONDS, RAW_WRITER_QUEUE_EVENTS)
 
 """
 NOTE (problemi aperti / possibili miglioramenti):
-- La connessione DB viene aperta per ogni evento: su carichi continui aumenta latenza e rischio di saturare il DB.
-- Il retry e' minimo (1 solo tentativo con 1s fisso): se il DB ha un guasto temporaneo si perdono eventi.
-- Il checkpoint si aggiorna solo dopo insert riuscito: se fallisce l'insert l'evento viene riprocessato in loop.
-- LAST_EVENT_TS_BY_ID cresce senza limiti: con molti device nel tempo puo' consumare RAM (serve TTL/eviction).
+- Con il DB giu' il writer salva i batch su disco (db/spill_buffer.py) fino a SPILL_MAX_BYTES; oltre,
+  i consumer tornano a rallentare finche' il replay non libera spazio.
 - I consumer sono thread daemon: in uscita non c'e' uno shutdown pulito, quindi close/checkpoint non garantiti.
-- La validazione del payload e' minima: dati malformati passano silenziosamente, difficile fare debug.
 """
 
 
@@ -46,73 +61,27 @@ def load_eventhub_configs():
     return eventhub_configs
 
 
-def on_event(partition_context, event):
-    try:
-        payload = json.loads(event.body_as_str())
-    except Exception as e:
-        print(f"[on_event] JSON error: {e}")
-        return
-
+def parse_event_rows(event):
+    # Decodes an EventHub event into raw rows (one per valid measure), applying the per-device throttle.
     current_ts = time()
+    try:
+        return decode_rows(
+            event.body_as_str(),
+            accept_device=lambda device_id: THROTTLE.allow(device_id, current_ts),
+            stats=DECODE_STATS,
+        )
+    except PayloadError as e:
+        print(f"[on_event] rejected payload ({e.kind}): {e}")
+        return []
 
-    values = payload.get("values", {})
-    if not isinstance(values, dict):
-        return
-    group_name = payload.get("group_name", "")
-    parent_timestamp = payload.get("timestamp")
-    parent_timestampMsec = payload.get("timestampMsec")
-
-    params = []
-    for device_id, gateway in values.items():
-        with STATE_LOCK:
-            last_ts = LAST_EVENT_TS_BY_ID.get(device_id, 0.0)
-            elapsed = current_ts - last_ts
-        if elapsed < MIN_SECONDS_BETWEEN_EVENTS:
-            continue
-        with STATE_LOCK:
-            LAST_EVENT_TS_BY_ID[device_id] = current_ts
-        if not isinstance(gateway, dict):
-            continue
-        for measure_name, measure_data in gateway.items():
-            params.append((
-                device_id,
-                group_name,
-                parent_timestamp,
-                parent_timestampMsec,
-                measure_name,
-                measure_data.get("raw_data"),
-                measure_data.get("status"),
-                measure_data.get("timestamp"),
-                measure_data.get("timestampMsec"),
-            ))
 
+def on_event(partition_context, event):
+    params = parse_event_rows(event)
     if not params:
         return
 
-    # Insert rows into DB (one row per measure)
-    for attempt in range(2):
-        try:
-            with get_conn() as conn:
-                sql = load_sql("insert_raw_measurements.sql").replace("{RAW_TABLE_NAME}", RAW_TABLE_NAME)
-                with conn.cursor() as cur:
-                    cur.executemany(sql, params)
-                conn.commit()
-            print(f"[on_event] inserted {len(params)} rows")
-            print(f"[on_event] waiting for next event (min {MIN_SECONDS_BETWEEN_EVENTS}s per device)...")
-            break
-        except psycopg2.OperationalError as e:
-            print(f"[on_event] DB insert operational error: {e}")
-            traceback.print_exc()
-            if attempt == 0:
-                sleep(1)
-                continue
-            return
-        except Exception as e:
-            print(f"[on_event] DB insert error: {e}")
-            traceback.print_exc()
-            return
-
-    partition_context.update_checkpoint(event)
+    # Hand the rows to the writer thread; the checkpoint advances once their batch has committed.
+    RAW_WRITER.submit(params, lambda: partition_context.update_checkpoint(event))
 
 
 def run_consumer(config):
@@ -120,14 +89,15 @@ def run_consumer(config):
     try:
         client = EventHubConsumerClient.from_connection_string(
             conn_str=config["eventhub_connection_string"],
-            consumer_group=config["eventhub_consumer_group"]
+            consumer_group=config["eventhub_consumer_group"],
+            checkpoint_store=get_checkpoint_store(),
         )
         print(f"EventHubConsumerClient created successfully for misuratore {config['id_misuratore']}.")
 
         with client:
             client.receive(
                 on_event=on_event,
-                starting_position="-1"  # Inizia dagli eventi piu recenti
+                starting_position="-1"  # Usato solo per partizioni senza checkpoint salvato
             )
     except Exception as e:
         print(f"Error creating EventHubConsumerClient for misuratore {config['id_misuratore']}: {e}")
@@ -139,7 +109,17 @@ def run_consumer(config):
                 pass
 
 
-def start_consumers(eventhub_configs):
+def start_spill_buffer(spill_dir=SPILL_DIR):
+    # Attaches the disk buffer to the writer and starts replaying leftover/new segments.
+    spill = SpillBuffer(spill_dir, SPILL_MAX_BYTES, SPILL_SEGMENT_BYTES, SPILL_REPLAY_CHUNK_ROWS)
+    spill.start_replayer(write_raw_rows, SECONDS_BETWEEN_SPILL_REPLAY)
+    return spill
+
+
+def start_consumers(eventhub_configs, spill_dir=SPILL_DIR):
+    if SPILL_ENABLED:
+        RAW_WRITER.spill = start_spill_buffer(spill_dir)
+    RAW_WRITER.start()
     threads = []
     for config in eventhub_configs:
         thread = threading.Thread(target=run_consumer, args=(config,), daemon=True)
@@ -152,6 +132,9 @@ def start_consumers(eventhub_configs):
             sleep(1)
     except KeyboardInterrupt:
         print("Stopping consumers...")
+        # Flush rows still queued in the writer, then their checkpoints, before exiting.
+        RAW_WRITER.stop()
+        close_checkpoint_store()
 
 
 """
@@ -0,0 +1,224 @@
+import asyncio
+import signal
+import traceback
+from time import monotonic
+
+from azure.eventhub.aio import EventHubConsumerClient, CheckpointStore
+from psycopg import OperationalError
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+from db_manager.config.settings import (
+    DB_HOST,
+    DB_PORT,
+    DB_NAME,
+    DB_USER,
+    DB_PASSWORD,
+    DB_POOL_MIN_CONN,
+    DB_POOL_MAX_CONN,
+    DB_POOL_TIMEOUT_SECONDS,
+    ASYNC_CONSUMER_MAX_INFLIGHT,
+    INGEST_WIDE_ROWS,
+    INGEST_KEEP_RAW,
+    SPILL_ENABLED,
+    SPILL_DIR,
+    SPILL_AFTER_ATTEMPTS,
+)
+from db_manager.core.pivot import pivot_raw_rows, WIDE_COLUMNS
+from db_manager.db.checkpoint_store import get_checkpoint_store, close_checkpoint_store
+from db_manager.db.notify import RAW_COMMITTED_CHANNEL
+from db_manager.db.raw_writer import COPY_RAW_SQL, INSERT_WIDE_SQL
+from db_manager.jobs.ingest_eventhub import parse_event_rows, start_spill_buffer
+
+MAX_RETRY_SLEEP_SECONDS = 30
+# psycopg 3 has no execute_values: one placeholder row, sent with executemany (pipelined).
+INSERT_WIDE_ROW_SQL = INSERT_WIDE_SQL.replace("VALUES %s", "VALUES (" + ", ".join(["%s"] * (len(WIDE_COLUMNS) + 2)) + ")")
+
+"""
+Modalita' async (INGEST_MODE=async): tutti i consumer girano come coroutine su un
+solo event loop (azure.eventhub.aio) e scrivono con COPY tramite un pool psycopg async.
+Ogni consumer ha al massimo ASYNC_CONSUMER_MAX_INFLIGHT insert in volo; i checkpoint
+di una partizione avanzano in ordine, solo dopo il commit delle righe dell'evento.
+"""
+
+
+class AsyncCheckpointStoreAdapter(CheckpointStore):
+    # Exposes the (batched, blocking) checkpoint store to the aio client without blocking the loop.
+    def __init__(self, store):
+        self.store = store
+
+    async def list_ownership(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        return await asyncio.to_thread(self.store.list_ownership, fully_qualified_namespace, eventhub_name, consumer_group)
+
+    async def claim_ownership(self, ownership_list, **kwargs):
+        return await asyncio.to_thread(self.store.claim_ownership, list(ownership_list))
+
+    async def update_checkpoint(self, checkpoint, **kwargs):
+        await asyncio.to_thread(self.store.update_checkpoint, checkpoint)
+
+    async def list_checkpoints(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        return await asyncio.to_thread(self.store.list_checkpoints, fully_qualified_namespace, eventhub_name, consumer_group)
+
+
+class AsyncConsumer:
+    def __init__(self, config, pool, checkpoint_store, spill):
+        self.config = config
+        self.pool = pool
+        self.checkpoint_store = checkpoint_store
+        self.spill = spill
+        self.inflight = asyncio.Semaphore(ASYNC_CONSUMER_MAX_INFLIGHT)
+        self.tasks = set()
+        self.last_task_by_partition = {}
+        self.rows = 0
+
+    async def on_event(self, partition_context, event):
+        if event is None:
+            return
+        params = parse_event_rows(event)
+        if not params:
+            return
+        # Backpressure: the partition waits here while too many inserts are in flight.
+        await self.inflight.acquire()
+        partition_id = partition_context.partition_id
+        previous = self.last_task_by_partition.get(partition_id)
+        task = asyncio.create_task(self._write_and_checkpoint(partition_context, event, params, previous))
+        self.last_task_by_partition[partition_id] = task
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _write_and_checkpoint(self, partition_context, event, params, previous):
+        try:
+            written = await self._write(params)
+            if previous is not None:
+                # Keep checkpoints monotonic per partition: wait for the earlier event first.
+                await asyncio.shield(previous)
+            if written:
+                await partition_context.update_checkpoint(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[async_ingest] checkpoint error for misuratore {self.config['id_misuratore']}: {e}")
+        finally:
+            self.inflight.release()
+            if self.last_task_by_partition.get(partition_context.partition_id) is asyncio.current_task():
+                del self.last_task_by_partition[partition_context.partition_id]
+
+    def _spill_behind_pending(self, params):
+        # Rows go to disk behind older spilled rows, so they reach the DB in order.
+        # Returns None when nothing is pending, else whether the rows were appended.
+        with self.spill.lock:
+            if not self.spill.pending():
+                return None
+            return self.spill.append(params)
+
+    async def _write(self, params):
+        attempt = 0
+        while True:
+            try:
+                if self.spill is not None and self.spill.pending():
+                    spilled = await asyncio.to_thread(self._spill_behind_pending, params)
+                    if spilled:
+                        return True
+                    if spilled is False:
+                        await asyncio.sleep(1)  # spill buffer full: wait for the replayer
+                        continue
+                t0 = monotonic()
+                async with self.pool.connection() as conn:
+                    async with conn.cursor() as cur:
+                        if not INGEST_WIDE_ROWS or INGEST_KEEP_RAW:
+                            async with cur.copy(COPY_RAW_SQL) as copy:
+                                for row in params:
+                                    await copy.write_row(row)
+                        if INGEST_WIDE_ROWS:
+                            await cur.executemany(INSERT_WIDE_ROW_SQL, pivot_raw_rows(params))
+                        # Delivered on commit: wakes the downstream jobs.
+                        await cur.execute("SELECT pg_notify(%s, %s);", (RAW_COMMITTED_CHANNEL, str(len(params))))
+                self.rows += len(params)
+                print(
+                    f"[async_ingest] {self.config['id_misuratore']}: wrote {len(params)} rows "
+                    f"in {(monotonic() - t0) * 1000:.1f} ms"
+                )
+                return True
+            except OperationalError as e:
+                attempt += 1
+                print(f"[async_ingest] DB operational error (attempt {attempt}): {e}")
+                if self.spill is not None and attempt >= SPILL_AFTER_ATTEMPTS:
+                    if await asyncio.to_thread(self.spill.append, params):
+                        print(f"[async_ingest] {self.config['id_misuratore']}: spilled {len(params)} rows to disk")
+                        return True
+                await asyncio.sleep(min(2 ** (attempt - 1), MAX_RETRY_SLEEP_SECONDS))
+            except Exception as e:
+                print(f"[async_ingest] COPY error: {e}")
+                traceback.print_exc()
+                return False
+
+    async def run(self):
+        client = EventHubConsumerClient.from_connection_string(
+            conn_str=self.config["eventhub_connection_string"],
+            consumer_group=self.config["eventhub_consumer_group"],
+            checkpoint_store=self.checkpoint_store,
+        )
+        print(f"Async EventHubConsumerClient created for misuratore {self.config['id_misuratore']}.")
+        try:
+            async with client:
+                await client.receive(
+                    on_event=self.on_event,
+                    starting_position="-1",  # only for partitions without a stored checkpoint
+                )
+        finally:
+            # Let in-flight inserts finish so committed rows also get their checkpoint.
+            if self.tasks:
+                await asyncio.wait(set(self.tasks), timeout=DB_POOL_TIMEOUT_SECONDS)
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in async consumer for misuratore {self.config['id_misuratore']}: {e}")
+            await asyncio.sleep(5)
+
+
+async def _run_all(eventhub_configs, spill_dir):
+    conninfo = make_conninfo(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+    store = get_checkpoint_store()
+    checkpoint_store = AsyncCheckpointStoreAdapter(store) if store is not None else None
+    spill = start_spill_buffer(spill_dir) if SPILL_ENABLED else None
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: CTRL+C arrives as KeyboardInterrupt and cancels the main task instead.
+            pass
+
+    async with AsyncConnectionPool(
+        conninfo,
+        min_size=DB_POOL_MIN_CONN,
+        max_size=DB_POOL_MAX_CONN,
+        timeout=DB_POOL_TIMEOUT_SECONDS,
+        open=False,
+    ) as pool:
+        consumers = [AsyncConsumer(config, pool, checkpoint_store, spill) for config in eventhub_configs]
+        tasks = [asyncio.create_task(consumer.run_forever()) for consumer in consumers]
+        print(f"Async Event Hub consumers started ({len(tasks)} on one event loop). Press CTRL+C to stop.")
+        try:
+            await stop.wait()
+        finally:
+            print("Stopping async consumers...")
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(close_checkpoint_store)
+            total_rows = sum(consumer.rows for consumer in consumers)
+            print(f"[async_ingest] stopped, {total_rows} rows written")
+
+
+def start_async_consumers(eventhub_configs, spill_dir=SPILL_DIR):
+    try:
+        asyncio.run(_run_all(eventhub_configs, spill_dir))
+    except KeyboardInterrupt:
+        pass
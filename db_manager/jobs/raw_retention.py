@@ -0,0 +1,120 @@
+import gzip
+import os
+from datetime import datetime, timedelta, timezone
+
+from db_manager.config.settings import (
+    RAW_TABLE_NAME,
+    RAW_RETENTION_DAYS,
+    RAW_RETENTION_ACTION,
+    RAW_ARCHIVE_DIR,
+    INGEST_WIDE_ROWS,
+)
+from db_manager.db.conn import get_conn
+from db_manager.db.schema import ensure_raw_partitions, raw_partition_day
+
+
+def _list_raw_partitions(cur):
+    cur.execute("""
+                SELECT n.nspname, c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE i.inhparent = %s::regclass
+                ORDER BY c.relname;
+                """, (RAW_TABLE_NAME,))
+    return cur.fetchall()
+
+
+def _archive_partition(cur, qualified_name, relname):
+    # Client-side COPY to a gzip CSV; written to a temp file and renamed once complete.
+    os.makedirs(RAW_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(RAW_ARCHIVE_DIR, f"{relname}.csv.gz")
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8", newline="") as f:
+        cur.copy_expert(f"COPY {qualified_name} TO STDOUT WITH (FORMAT csv, HEADER true)", f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _retire_default_rows(cutoff):
+    # Late or badly stamped rows sit in the default partition, which is never detached: its rows
+    # below the cutoff are moved (one statement) into a standalone table, handled like a
+    # retired partition. Returns the number of rows moved.
+    # Named after the run, not the cutoff: a stuck transform watermark repeats the cutoff, and a
+    # kept (detach) table or an archive file of an earlier run must not be reused.
+    default_table = f"{RAW_TABLE_NAME}_default"
+    retired_table = f"{default_table}_r{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {retired_table} (LIKE {RAW_TABLE_NAME});")
+            cur.execute(f"""
+                        WITH moved AS (
+                            DELETE FROM {default_table}
+                            WHERE parent_timestampmsec < %s
+                            RETURNING *
+                        )
+                        INSERT INTO {retired_table}
+                        SELECT * FROM moved;
+                        """, (int(cutoff.timestamp() * 1000),))
+            moved = cur.rowcount
+            if not moved:
+                conn.rollback()
+                return 0
+            if RAW_ARCHIVE_DIR:
+                path = _archive_partition(cur, retired_table, retired_table.split(".")[-1])
+                print(f"[raw_retention] archived {retired_table} to {path}")
+            if RAW_RETENTION_ACTION == "drop":
+                cur.execute(f"DROP TABLE {retired_table};")
+        conn.commit()
+    action = "dropped" if RAW_RETENTION_ACTION == "drop" else f"moved to {retired_table}"
+    print(f"[raw_retention] {moved} rows of {default_table} {action}")
+    return moved
+
+
+def raw_retention():
+    # Creates the partitions ahead, then removes daily raw partitions that the transform has
+    # fully consumed (upper bound <= watermark) and that are older than RAW_RETENTION_DAYS,
+    # and the default partition's rows below the same cutoff.
+    if not ensure_raw_partitions():
+        return
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                        SELECT last_parent_timestampmsec
+                        FROM hydro.tab_etl_state
+                        WHERE job_name = 'transform_raw_to_measurements';
+                        """)
+            row = cur.fetchone()
+            partitions = _list_raw_partitions(cur)
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=RAW_RETENTION_DAYS)
+    if not INGEST_WIDE_ROWS:
+        # Raw rows are the transform's input: never remove what it has not consumed yet.
+        watermark = datetime.fromtimestamp((row[0] if row else 0) / 1000.0, tz=timezone.utc)
+        cutoff = min(cutoff, watermark)
+
+    removed = 0
+    for schema_name, relname in partitions:
+        day = raw_partition_day(relname)
+        if day is None:
+            continue
+        upper = datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + timedelta(days=1)
+        if upper > cutoff:
+            continue
+        qualified_name = f"{schema_name}.{relname}"
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                if RAW_ARCHIVE_DIR:
+                    path = _archive_partition(cur, qualified_name, relname)
+                    print(f"[raw_retention] archived {qualified_name} to {path}")
+                cur.execute(f"ALTER TABLE {RAW_TABLE_NAME} DETACH PARTITION {qualified_name};")
+                if RAW_RETENTION_ACTION == "drop":
+                    cur.execute(f"DROP TABLE {qualified_name};")
+            conn.commit()
+        removed += 1
+        action = "dropped" if RAW_RETENTION_ACTION == "drop" else "detached"
+        print(f"[raw_retention] {action} partition {qualified_name}")
+
+    default_rows = _retire_default_rows(cutoff)
+    print(f"[raw_retention] {removed} partitions and {default_rows} default partition rows removed (cutoff {cutoff:%Y-%m-%d %H:%M}Z)")
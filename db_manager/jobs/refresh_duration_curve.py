@@ -0,0 +1,42 @@
+from db_manager.db.conn import get_conn
+from db_manager.db.sql_loader import load_sql
+
+JOB_NAME = "refresh_duration_curve"
+
+
+def _get_watermark(cur):
+    # updated_at (ms) of tab_measurements_clean_daily up to which the curves are current.
+    cur.execute("""
+                SELECT last_parent_timestampmsec
+                FROM hydro.tab_etl_state
+                WHERE job_name = %s;
+                """, (JOB_NAME,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def refresh_duration_curve():
+    # Incremental replacement of REFRESH MATERIALIZED VIEW mv_flow_duration_curve_daily: the
+    # daily averages come from the daily rollup (only touched days are recomputed there) and
+    # ranks/exceedance are rebuilt only for the devices with changed days. Readers of
+    # tab_flow_duration_curve_daily keep seeing the previous curve until the commit.
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            since_ms = _get_watermark(cur)
+            cur.execute(load_sql("select_clean_changes_upper_bound.sql"))
+            until = cur.fetchone()[0]
+            cur.execute(load_sql("select_duration_curve_changed_devices.sql"), {"since_ms": since_ms, "until": until})
+            device_ids = [row[0] for row in cur.fetchall()]
+            if device_ids:
+                cur.execute(load_sql("refresh_flow_duration_curve.sql"), {"device_ids": device_ids})
+
+            cur.execute("""
+                        INSERT INTO hydro.tab_etl_state (job_name, last_parent_timestampmsec, updated_at)
+                        VALUES (%s, floor(extract(epoch FROM %s::timestamptz) * 1000)::bigint, now())
+                        ON CONFLICT (job_name)
+                        DO UPDATE SET last_parent_timestampmsec = EXCLUDED.last_parent_timestampmsec,
+                        updated_at = EXCLUDED.updated_at
+                        """, (JOB_NAME, until))
+        conn.commit()
+    print(f"[refresh_duration_curve] {len(device_ids)} devices rebuilt")
+    return len(device_ids)
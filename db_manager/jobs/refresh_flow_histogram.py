@@ -1,30 +1,106 @@
-from db_manager.config.settings import FLOW_HIST_BINS, FLOW_HIST_WINDOW_HOURS
+from datetime import datetime, timedelta, timezone
+
+from db_manager.config.settings import FLOW_HIST_BINS, FLOW_HIST_WINDOW_HOURS, FLOW_SKETCH_RELATIVE_ACCURACY, FLOW_SKETCH_MIN_VALUE
+from db_manager.core.flow_sketch import sketch_ln_gamma
 from db_manager.db.conn import get_conn
 from db_manager.db.sql_loader import load_sql
+from db_manager.jobs.refresh_rollups import JOB_NAME as ROLLUPS_JOB_NAME
 
+JOB_NAME = "refresh_flow_sketch"
+
+
+def _get_watermark(cur, job_name=JOB_NAME):
+    # updated_at (ms) of tab_measurements_clean up to which job_name is current.
+    cur.execute("""
+                SELECT last_parent_timestampmsec
+                FROM hydro.tab_etl_state
+                WHERE job_name = %s;
+                """, (job_name,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _update_watermark(cur, until_ms):
+    cur.execute("""
+                INSERT INTO hydro.tab_etl_state (job_name, last_parent_timestampmsec, updated_at)
+                VALUES (%s, %s, now())
+                ON CONFLICT (job_name)
+                DO UPDATE SET last_parent_timestampmsec = EXCLUDED.last_parent_timestampmsec,
+                updated_at = EXCLUDED.updated_at
+                """, (JOB_NAME, until_ms))
 
-def refresh_flow_histogram():
-    sql_refresh = load_sql("refresh_flow_histogram.sql")
-    sql_refresh = sql_refresh.replace("{BINS}", str(FLOW_HIST_BINS))
 
+def _check_sketch_params(cur):
+    # Sketches built with another accuracy / zero threshold cannot be merged with new ones:
+    # drop them all and start again from watermark 0. Returns the watermark to use.
+    cur.execute("""
+                SELECT relative_accuracy, min_value
+                FROM hydro.tab_flow_sketch_params
+                FOR UPDATE;
+                """)
+    row = cur.fetchone()
+    if row == (FLOW_SKETCH_RELATIVE_ACCURACY, FLOW_SKETCH_MIN_VALUE):
+        return _get_watermark(cur)
+    if row is not None:
+        print(f"[refresh_flow_histogram] sketch parameters changed from {row}, rebuilding all sketches")
+    cur.execute("DELETE FROM hydro.tab_flow_sketch_daily;")
+    _update_watermark(cur, 0)
+    cur.execute("""
+                INSERT INTO hydro.tab_flow_sketch_params (singleton, relative_accuracy, min_value, updated_at)
+                VALUES (TRUE, %s, %s, now())
+                ON CONFLICT (singleton)
+                DO UPDATE SET relative_accuracy = EXCLUDED.relative_accuracy, min_value = EXCLUDED.min_value,
+                updated_at = EXCLUDED.updated_at
+                """, (FLOW_SKETCH_RELATIVE_ACCURACY, FLOW_SKETCH_MIN_VALUE))
+    return 0
+
+
+def histogram_window():
     if FLOW_HIST_WINDOW_HOURS <= 0:
-        window_start = "TIMESTAMPTZ '1970-01-01 00:00:00+00'"
-        window_end = "TIMESTAMPTZ 'infinity'"
-        window_filter = "TRUE"
-    else:
-        window_end = "date_trunc('hour', now())"
-        window_start = f"date_trunc('hour', now()) - interval '{FLOW_HIST_WINDOW_HOURS} hours'"
-        window_filter = (
-            "data_misurazione >= (SELECT window_start FROM params) "
-            "AND data_misurazione < (SELECT window_end FROM params)"
-        )
-
-    sql_refresh = sql_refresh.replace("{WINDOW_START}", window_start)
-    sql_refresh = sql_refresh.replace("{WINDOW_END}", window_end)
-    sql_refresh = sql_refresh.replace("{WINDOW_FILTER}", window_filter)
+        return datetime(1970, 1, 1, tzinfo=timezone.utc), "infinity"
+    window_end = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return window_end - timedelta(hours=FLOW_HIST_WINDOW_HOURS), window_end
+
+
+def refresh_flow_histogram():
+    # Incremental: recomputes the day sketches of the (device, day) pairs with cleaned rows
+    # written since the last run, then rebuilds the histogram of the devices they belong to by
+    # merging their day sketches (with a rolling window every device moves, so all are rebuilt).
+    # The window range comes from tab_measurements_clean_daily, so the sketches only follow the
+    # cleaned rows up to the refresh_rollups watermark.
+    ln_gamma = sketch_ln_gamma(FLOW_SKETCH_RELATIVE_ACCURACY)
+    window_start, window_end = histogram_window()
+    sql_histogram = load_sql("refresh_flow_histogram.sql").replace("{BINS}", str(FLOW_HIST_BINS))
 
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql_refresh)
+            since_ms = _check_sketch_params(cur)
+            until_ms = _get_watermark(cur, ROLLUPS_JOB_NAME)
+            if not until_ms:
+                print("[refresh_flow_histogram] waiting for the first refresh_rollups run")
+                return 0
+            cur.execute(load_sql("refresh_flow_sketch_daily.sql"), {
+                "since_ms": since_ms,
+                "until_ms": until_ms,
+                "ln_gamma": ln_gamma,
+                "min_value": FLOW_SKETCH_MIN_VALUE,
+            })
+            device_ids = [row[0] for row in cur.fetchall()]
+            if FLOW_HIST_WINDOW_HOURS > 0:
+                cur.execute("""
+                            SELECT DISTINCT id_misuratore
+                            FROM hydro.tab_flow_sketch_daily
+                            WHERE day >= (%s::timestamptz AT TIME ZONE 'UTC')::date;
+                            """, (window_start,))
+                device_ids = sorted({row[0] for row in cur.fetchall()} | set(device_ids))
+            if device_ids:
+                cur.execute(sql_histogram, {
+                    "device_ids": device_ids,
+                    "window_start": window_start,
+                    "window_end": window_end,
+                    "ln_gamma": ln_gamma,
+                })
+            _update_watermark(cur, until_ms)
         conn.commit()
-    print("Flow histogram refreshed successfully.")
+    print(f"[refresh_flow_histogram] histogram of {len(device_ids)} devices refreshed")
+    return len(device_ids)
@@ -0,0 +1,46 @@
+from db_manager.db.conn import get_conn
+from db_manager.db.sql_loader import load_sql
+
+JOB_NAME = "refresh_rollups"
+
+
+def _get_watermark(cur):
+    # updated_at (ms) of tab_measurements_clean up to which the rollups are current.
+    cur.execute("""
+                SELECT last_parent_timestampmsec
+                FROM hydro.tab_etl_state
+                WHERE job_name = %s;
+                """, (JOB_NAME,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _update_watermark(cur, until):
+    cur.execute("""
+                INSERT INTO hydro.tab_etl_state (job_name, last_parent_timestampmsec, updated_at)
+                VALUES (%s, floor(extract(epoch FROM %s::timestamptz) * 1000)::bigint, now())
+                ON CONFLICT (job_name)
+                DO UPDATE SET last_parent_timestampmsec = EXCLUDED.last_parent_timestampmsec,
+                updated_at = EXCLUDED.updated_at
+                """, (JOB_NAME, until))
+
+
+def refresh_rollups():
+    # Incremental: recomputes the hourly rollup of the hours with cleaned rows written since the
+    # last run (from those rows only), then the daily rollup of their days from the hourly rows.
+    # Returns the touched (device, day) pairs.
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            since_ms = _get_watermark(cur)
+            cur.execute(load_sql("select_clean_changes_upper_bound.sql"))
+            until = cur.fetchone()[0]
+            params = {"since_ms": since_ms, "until": until}
+
+            cur.execute(load_sql("refresh_clean_hourly_rollup.sql"), params)
+            hours = cur.rowcount
+            cur.execute(load_sql("refresh_clean_daily_rollup.sql"), params)
+            touched_days = cur.fetchall()
+            _update_watermark(cur, until)
+        conn.commit()
+    print(f"[refresh_rollups] {hours} hourly and {len(touched_days)} daily rollup rows refreshed")
+    return touched_days
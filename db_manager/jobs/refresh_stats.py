@@ -1,10 +1,43 @@
 from db_manager.db.conn import get_conn
 from db_manager.db.sql_loader import load_sql
 
+JOB_NAME = "refresh_stats"
+
+
+def _get_watermark(cur):
+    # updated_at (ms) of tab_measurements_clean up to which the daily partials are current.
+    cur.execute("""
+                SELECT last_parent_timestampmsec
+                FROM hydro.tab_etl_state
+                WHERE job_name = %s;
+                """, (JOB_NAME,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
 def refresh_stats():
+    # Incremental: the daily partials (tab_clean_daily_partials) are recomputed only for the
+    # (device, day) pairs with cleaned rows written since the last run, and
+    # tab_statistiche_misuratori only for those devices, from the partials.
     with get_conn() as conn:
-        sql = load_sql("refresh_stats.sql")
         with conn.cursor() as cur:
-            cur.execute(sql)
+            since_ms = _get_watermark(cur)
+            cur.execute(load_sql("select_clean_changes_upper_bound.sql"))
+            until = cur.fetchone()[0]
+
+            cur.execute(load_sql("refresh_clean_daily_partials.sql"), {"since_ms": since_ms, "until": until})
+            partials = cur.fetchall()
+            device_ids = sorted({row[0] for row in partials})
+            if device_ids:
+                cur.execute(load_sql("refresh_stats.sql"), {"device_ids": device_ids})
+
+            cur.execute("""
+                        INSERT INTO hydro.tab_etl_state (job_name, last_parent_timestampmsec, updated_at)
+                        VALUES (%s, floor(extract(epoch FROM %s::timestamptz) * 1000)::bigint, now())
+                        ON CONFLICT (job_name)
+                        DO UPDATE SET last_parent_timestampmsec = EXCLUDED.last_parent_timestampmsec,
+                        updated_at = EXCLUDED.updated_at
+                        """, (JOB_NAME, until))
         conn.commit()
-            
\ No newline at end of file
+    print(f"[refresh_stats] {len(partials)} daily partials, {len(device_ids)} devices refreshed")
+    return len(device_ids)
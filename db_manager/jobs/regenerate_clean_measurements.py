@@ -1,91 +1,193 @@
-import pandas as pd
-from hampel import hampel
+import argparse
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import monotonic
 
-from db_manager.db.conn import get_conn
-from db_manager.db.sql_loader import load_sql
-from db_manager.config.settings import HAMPEL_WINDOW_SIZE, HAMPEL_SIGMA_THRESHOLD
-
-
-MAX_NUMERIC = 9_999_999.999
-MIN_NUMERIC = -9_999_999.999
-
-
-def _clamp_numeric(value):
-    if value is None:
-        return None
-    if value > MAX_NUMERIC:
-        return MAX_NUMERIC
-    if value < MIN_NUMERIC:
-        return MIN_NUMERIC
-    return value
+import numpy as np
 
+from db_manager.db.conn import get_conn
+from db_manager.db.clean_writer import upsert_clean_rows, format_rate
+from db_manager.db.schema import ensure_clean_regenerate_progress_table
+from db_manager.jobs.clean_measurements import build_clean_rows
+from db_manager.config.settings import HAMPEL_WINDOW_SIZE, HAMPEL_SIGMA_THRESHOLD, REGENERATE_CHUNK_ROWS, REGENERATE_CHANGE_TOLERANCE
+
+"""
+Rigenerazione completa di tab_measurements_clean (es. dopo un cambio dei parametri Hampel),
+in parallelo sui device e riprendibile. Esempio:
+    py -m db_manager.jobs.regenerate_clean_measurements --workers 8
+"""
+
+
+def default_run_name():
+    # A parameter change starts a new run; rerunning with the same parameters resumes.
+    return f"hampel-w{HAMPEL_WINDOW_SIZE}-s{HAMPEL_SIGMA_THRESHOLD}"
+
+
+def _column_changed(new_values, old_values, tolerance):
+    # NULL vs value and NaN vs number are changes; numbers differing by at most tolerance are not.
+    new_null = np.fromiter((v is None for v in new_values), bool, len(new_values))
+    old_null = np.fromiter((v is None for v in old_values), bool, len(old_values))
+    new = np.array(new_values, dtype=float)
+    old = np.array(old_values, dtype=float)
+    both = ~new_null & ~old_null
+    new_nan, old_nan = np.isnan(new), np.isnan(old)
+    with np.errstate(invalid="ignore"):
+        differs = (new_nan != old_nan) | (~new_nan & ~old_nan & (np.abs(new - old) > tolerance))
+    return (new_null != old_null) | (both & differs)
+
+
+def changed_rows(out_params, stored_rows, tolerance):
+    # out_params: build_clean_rows output; stored_rows: the same points as read from the table
+    # (data_misurazione, flow_ls_raw, flow_ls_smoothed, is_outlier, window_median, thresholds).
+    # flow_ls_raw is the filter input and cannot change.
+    if not out_params:
+        return []
+    new = list(zip(*out_params))
+    old = list(zip(*stored_rows))
+    changed = np.array(new[4], dtype=bool) != np.array(old[3], dtype=bool)
+    changed |= _column_changed(new[3], old[2], tolerance)
+    changed |= _column_changed(new[5], old[4], tolerance)
+    changed |= _column_changed(new[6], old[5], tolerance)
+    return [row for row, is_changed in zip(out_params, changed.tolist()) if is_changed]
+
+
+def regenerate_device(device_id, run_name, chunk_rows=REGENERATE_CHUNK_ROWS, tolerance=REGENERATE_CHANGE_TOLERANCE):
+    # Re-filters one device reading its series with a server-side cursor, chunk_rows at a time:
+    # each chunk is filtered together with the last 2 * (HAMPEL_WINDOW_SIZE // 2) points of the
+    # previous one, and its last HAMPEL_WINDOW_SIZE // 2 rows are held back until the next chunk
+    # completes their window, so the result equals filtering the whole series at once.
+    # Only rows whose stored values differ (beyond tolerance) from the recomputed ones are written.
+    # One transaction per device, which also records it as done for run_name.
+    half_window = HAMPEL_WINDOW_SIZE // 2
+    chunk_rows = max(chunk_rows, HAMPEL_WINDOW_SIZE)
+    total_rows = 0
+    unchanged_rows = 0
+    write_seconds = 0.0
+    with get_conn() as conn:
+        with conn.cursor(name=f"regenerate_{os.getpid()}") as src, conn.cursor() as cur:
+            src.itersize = chunk_rows
+            src.execute("""
+                        SELECT data_misurazione, flow_ls_raw, flow_ls_smoothed, is_outlier, window_median, thresholds
+                        FROM hydro.tab_measurements_clean
+                        WHERE id_misuratore = %s
+                        ORDER BY data_misurazione;
+                        """, (device_id,))
+            tail = []
+            chunk = src.fetchmany(chunk_rows)
+            while chunk:
+                next_chunk = src.fetchmany(chunk_rows)
+                stored = tail + chunk
+                timestamps = [row[0] for row in stored]
+                flow_raw = np.array([np.nan if row[1] is None else float(row[1]) for row in stored])
+                start = max(len(tail) - half_window, 0)
+                out_params = build_clean_rows(device_id, timestamps, flow_raw, start)
+                if next_chunk:
+                    out_params = out_params[:len(out_params) - half_window]
+                to_write = changed_rows(out_params, stored[start:start + len(out_params)], tolerance)
+                write_seconds += upsert_clean_rows(cur, to_write)
+                total_rows += len(to_write)
+                unchanged_rows += len(out_params) - len(to_write)
+                tail = stored[-2 * half_window:] if half_window else []
+                chunk = next_chunk
+            cur.execute("""
+                        INSERT INTO hydro.tab_clean_regenerate_progress (run_name, id_misuratore, rows_written, rows_unchanged)
+                        VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (run_name, id_misuratore)
+                        DO UPDATE SET rows_written = EXCLUDED.rows_written, rows_unchanged = EXCLUDED.rows_unchanged,
+                        finished_at = now();
+                        """, (run_name, device_id, total_rows, unchanged_rows))
+        conn.commit()
+    return device_id, total_rows, unchanged_rows, write_seconds
 
-def regenerate_clean_measurements():
-    sql_upsert = load_sql("upsert_cleaned_measurements.sql")
 
+def _pending_devices(run_name, restart):
     with get_conn() as conn:
         with conn.cursor() as cur:
+            if restart:
+                cur.execute("DELETE FROM hydro.tab_clean_regenerate_progress WHERE run_name = %s;", (run_name,))
             cur.execute("""
                         SELECT DISTINCT id_misuratore
                         FROM hydro.tab_measurements_clean
                         ORDER BY id_misuratore;
                         """)
             device_ids = [row[0] for row in cur.fetchall()]
-
-        if not device_ids:
-            print("No measurements to regenerate.")
-            return
-
-        total_rows = 0
-        for device_id in device_ids:
-            print(f"[regenerate] start device {device_id}")
-            with conn.cursor() as cur:
-                cur.execute("""
-                            SELECT data_misurazione, flow_ls_raw
-                            FROM hydro.tab_measurements_clean
-                            WHERE id_misuratore = %s
-                            ORDER BY data_misurazione;
-                            """, (device_id,))
-                rows = cur.fetchall()
-
-            if not rows:
+            cur.execute("""
+                        SELECT id_misuratore
+                        FROM hydro.tab_clean_regenerate_progress
+                        WHERE run_name = %s;
+                        """, (run_name,))
+            done = {row[0] for row in cur.fetchall()}
+        conn.commit()
+    return [device_id for device_id in device_ids if device_id not in done], len(done)
+
+
+def _format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+
+def regenerate_clean_measurements(workers=None, run_name=None, restart=False, chunk_rows=REGENERATE_CHUNK_ROWS,
+                                  tolerance=REGENERATE_CHANGE_TOLERANCE):
+    # Devices are spread over a pool of `workers` processes (default: one per CPU); devices
+    # already recorded for run_name are skipped, so a stopped run continues where it was.
+    ensure_clean_regenerate_progress_table()
+    run_name = run_name or default_run_name()
+    workers = workers or os.cpu_count() or 1
+
+    device_ids, skipped = _pending_devices(run_name, restart)
+    if not device_ids:
+        print(f"No measurements to regenerate (run {run_name}, {skipped} devices already done).")
+        return
+
+    print(f"[regenerate] run {run_name}: {len(device_ids)} devices to do, {skipped} already done, {workers} workers")
+    t_start = monotonic()
+    total_rows = 0
+    total_unchanged = 0
+    done = 0
+    failed = []
+    # spawn: the children open their own DB pool instead of inheriting the parent's sockets.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as executor:
+        futures = {
+            executor.submit(regenerate_device, device_id, run_name, chunk_rows, tolerance): device_id
+            for device_id in device_ids
+        }
+        for future in as_completed(futures):
+            device_id = futures[future]
+            done += 1
+            try:
+                _, rows, unchanged, write_seconds = future.result()
+            except Exception as e:
+                failed.append(device_id)
+                print(f"[regenerate] device {device_id} error: {e}")
                 continue
-
-            df = pd.DataFrame(rows, columns=["ts_s", "flow_raw"])
-            series = df["flow_raw"].astype(float)
-
-            result = hampel(series, window_size=HAMPEL_WINDOW_SIZE, n_sigma=HAMPEL_SIGMA_THRESHOLD)
-            filtered = result.filtered_data
-            outlier_indices = set(result.outlier_indices)
-            medians = result.medians
-            thresholds = result.thresholds
-
-            out_params = []
-            for i, row in df.iterrows():
-                ts_s = row["ts_s"]
-                if ts_s is None:
-                    continue
-                is_outlier = i in outlier_indices
-                flow_raw = row["flow_raw"]
-                out_params.append((
-                    device_id,
-                    ts_s,
-                    _clamp_numeric(float(flow_raw)) if flow_raw is not None else None,
-                    _clamp_numeric(float(filtered[i])) if filtered is not None else None,
-                    bool(is_outlier),
-                    _clamp_numeric(float(medians[i])) if medians is not None else None,
-                    _clamp_numeric(float(thresholds[i])) if thresholds is not None else None
-                ))
-
-            with conn.cursor() as cur:
-                cur.executemany(sql_upsert, out_params)
-            conn.commit()
-
-            total_rows += len(out_params)
-            print(f"[regenerate] device {device_id}: {len(out_params)} rows")
-
-        print(f"[regenerate] upserted {total_rows} rows")
+            total_rows += rows
+            total_unchanged += unchanged
+            elapsed = monotonic() - t_start
+            eta = elapsed / done * (len(device_ids) - done)
+            print(
+                f"[regenerate] {done}/{len(device_ids)} device {device_id}: {unchanged} unchanged, "
+                f"{format_rate(rows, write_seconds)} changed; "
+                f"total {total_rows + total_unchanged} rows ({(total_rows + total_unchanged) / elapsed:.0f} rows/s), "
+                f"ETA {_format_eta(eta)}"
+            )
+
+    print(f"[regenerate] {total_rows} rows changed and written, {total_unchanged} unchanged, in {monotonic() - t_start:.0f}s")
+    if failed:
+        print(f"[regenerate] {len(failed)} devices failed, rerun to retry them: {', '.join(failed)}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate tab_measurements_clean with the current Hampel parameters")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--run-name", default=None, help="progress key (default: derived from the Hampel parameters)")
+    parser.add_argument("--restart", action="store_true", help="forget the progress of this run and redo every device")
+    parser.add_argument("--chunk-rows", type=int, default=REGENERATE_CHUNK_ROWS, help="rows read per device per fetch")
+    parser.add_argument("--tolerance", type=float, default=REGENERATE_CHANGE_TOLERANCE, help="max difference still considered unchanged")
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    regenerate_clean_measurements()
+    args = parse_args()
+    regenerate_clean_measurements(args.workers, args.run_name, args.restart, args.chunk_rows, args.tolerance)
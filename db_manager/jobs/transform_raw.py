@@ -1,10 +1,61 @@
+from datetime import datetime, timezone
+from time import monotonic
+
+from db_manager.config.settings import RAW_TABLE_NAME, TRANSFORM_CHUNK_ROWS
 from db_manager.db.conn import get_conn
 from db_manager.db.sql_loader import load_sql
 
 def transform_raw_to_measurements():
-    sql = load_sql("transform_raw_to_measurements.sql")
+    # Pivots new raw rows into tab_measurements in chunks of ~TRANSFORM_CHUNK_ROWS raw rows,
+    # committing rows and watermark per chunk, until the backlog is consumed.
+    # Returns the number of rows inserted into tab_measurements.
+    sql_bound = load_sql("select_transform_chunk_bound.sql").replace("{RAW_TABLE_NAME}", RAW_TABLE_NAME)
+    sql_transform = load_sql("transform_raw_to_measurements.sql").replace("{RAW_TABLE_NAME}", RAW_TABLE_NAME)
+
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql)
-        conn.commit()
-        
\ No newline at end of file
+            cur.execute("""
+                        SELECT last_parent_timestampmsec
+                        FROM hydro.tab_etl_state
+                        WHERE job_name = 'transform_raw_to_measurements';
+                        """)
+            row = cur.fetchone()
+    lower = row[0] if row else 0
+
+    chunks = 0
+    total_raw = 0
+    total_inserted = 0
+    t_start = monotonic()
+    while True:
+        t0 = monotonic()
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql_bound, {"lower": lower, "offset": TRANSFORM_CHUNK_ROWS - 1})
+                upper = cur.fetchone()[0]
+                if upper is None:
+                    break
+                # All rows of a parent_timestampmsec fall in the same chunk (bounds are inclusive on upper).
+                cur.execute(sql_transform, {"lower": lower, "upper": upper})
+                raw_rows, inserted_rows = cur.fetchone()
+            conn.commit()
+
+        elapsed = monotonic() - t0
+        chunks += 1
+        total_raw += raw_rows
+        total_inserted += inserted_rows
+        lower = upper
+        watermark = datetime.fromtimestamp(upper / 1000.0, tz=timezone.utc)
+        lag = datetime.now(timezone.utc) - watermark
+        print(
+            f"[transform] chunk {chunks}: {raw_rows} raw -> {inserted_rows} rows in {elapsed:.2f}s "
+            f"({raw_rows / elapsed if elapsed > 0 else 0:.0f} raw rows/s), "
+            f"watermark {watermark:%Y-%m-%d %H:%M:%S}Z (lag {lag.total_seconds():.0f}s)"
+        )
+
+    if chunks > 1:
+        elapsed = monotonic() - t_start
+        print(
+            f"[transform] caught up: {chunks} chunks, {total_raw} raw -> {total_inserted} rows "
+            f"in {elapsed:.1f}s ({total_raw / elapsed if elapsed > 0 else 0:.0f} raw rows/s)"
+        )
+    return total_inserted
@@ -1,17 +1,44 @@
-from db_manager.db.conn import get_conn
-from db_manager.db.schema import ensure_raw_table, ensure_etl_state_table, ensure_measurements_index, ensure_flow_histogram_table
-from db_manager.jobs.ingest_eventhub import load_eventhub_configs, start_consumers
+from db_manager.core.trigger import JobTrigger
+from db_manager.db.conn import get_conn, pool_stats, close_pool
+from db_manager.db.notify import start_notify_listener, RAW_COMMITTED_CHANNEL
+from db_manager.db.spill_buffer import adopt_segments
+from db_manager.db.schema import ensure_raw_table, ensure_raw_partitions, ensure_etl_state_table, ensure_measurements_index, ensure_flow_histogram_table, ensure_eventhub_checkpoint_tables, ensure_clean_device_state_table, ensure_clean_daily_partials_table, ensure_clean_rollup_tables, ensure_flow_duration_curve_table, ensure_flow_sketch_table
+from db_manager.jobs.ingest_eventhub import load_eventhub_configs, start_consumers, THROTTLE, RAW_WRITER, DECODE_STATS
 from db_manager.jobs.transform_raw import transform_raw_to_measurements
 from db_manager.jobs.refresh_stats import refresh_stats
+from db_manager.jobs.refresh_rollups import refresh_rollups
 from db_manager.jobs.clean_measurements import clean_measurements
-from db_manager.jobs.refresh_duration_curve_mv import refresh_duration_curve_mv
+from db_manager.jobs.clean_measurements_stream import clean_measurements_stream
+from db_manager.jobs.refresh_duration_curve import refresh_duration_curve
 from db_manager.jobs.refresh_flow_histogram import refresh_flow_histogram
+from db_manager.jobs.raw_retention import raw_retention
 
-from db_manager.config.settings import RAW_TABLE_NAME, SECONDS_BETWEEN_RAW_TO_MEASUREMENTS_TRANSFORM, SECONDS_BETWEEN_REFRESH_STATS, SECONDS_BETWEEN_CLEAN_MEASUREMENTS, SECONDS_BETWEEN_REFRESH_MV, SECONDS_BETWEEN_REFRESH_FLOW_HISTOGRAM
+from db_manager.config.settings import RAW_TABLE_NAME, SECONDS_BETWEEN_RAW_TO_MEASUREMENTS_TRANSFORM, SECONDS_BETWEEN_REFRESH_STATS, SECONDS_BETWEEN_REFRESH_ROLLUPS, SECONDS_BETWEEN_CLEAN_MEASUREMENTS, SECONDS_BETWEEN_REFRESH_DURATION_CURVE, SECONDS_BETWEEN_REFRESH_FLOW_HISTOGRAM, SECONDS_BETWEEN_RAW_RETENTION, SECONDS_BETWEEN_STATS_REPORT, INGEST_MODE, CHECKPOINT_STORE, INGEST_WIDE_ROWS, INGEST_WORKER_PROCESSES, SECONDS_BEFORE_WORKER_RESTART, SECONDS_WORKER_SHUTDOWN_GRACE, SPILL_DIR, SPILL_ENABLED, JOB_TRIGGER_MODE, JOB_TRIGGER_DEBOUNCE_SECONDS, SECONDS_BETWEEN_FALLBACK_POLL, CLEAN_MODE
 
-from time import sleep
+from pathlib import Path
+from time import sleep, monotonic
+import multiprocessing
+import os
+import signal
 import threading 
 
+# Wake-ups for the downstream jobs (JOB_TRIGGER_MODE=notify): new raw rows -> transform ->
+# clean -> stats / rollups -> duration curve / flow histogram. Each job fires the next one only when it produced rows.
+TRANSFORM_TRIGGER = JobTrigger(JOB_TRIGGER_DEBOUNCE_SECONDS)
+CLEAN_TRIGGER = JobTrigger(JOB_TRIGGER_DEBOUNCE_SECONDS)
+REFRESH_STATS_TRIGGER = JobTrigger(JOB_TRIGGER_DEBOUNCE_SECONDS)
+REFRESH_ROLLUPS_TRIGGER = JobTrigger(JOB_TRIGGER_DEBOUNCE_SECONDS)
+REFRESH_DURATION_CURVE_TRIGGER = JobTrigger(JOB_TRIGGER_DEBOUNCE_SECONDS)
+REFRESH_FLOW_HISTOGRAM_TRIGGER = JobTrigger(JOB_TRIGGER_DEBOUNCE_SECONDS)
+
+
+def wait_next_run(trigger, interval_seconds):
+    # notify mode: wait for the trigger, polling anyway every SECONDS_BETWEEN_FALLBACK_POLL.
+    if JOB_TRIGGER_MODE == "notify":
+        trigger.wait(SECONDS_BETWEEN_FALLBACK_POLL)
+    else:
+        sleep(interval_seconds)
+
 
 def start_transform_scheduler(interval_seconds=300):
     # Runs the ETL transform in a background thread on a fixed interval.
@@ -19,12 +46,13 @@ def start_transform_scheduler(interval_seconds=300):
         i = 1
         while True: 
             try:
-                transform_raw_to_measurements()
+                if transform_raw_to_measurements():
+                    CLEAN_TRIGGER.fire()
                 print(f"Transform job {i} executed successfully.")
                 i += 1
             except Exception as e:
                 print(f"Error executing transform job {i}: {e}")
-            sleep(interval_seconds)
+            wait_next_run(TRANSFORM_TRIGGER, interval_seconds)
     # Start periodic raw -> measurements transform.
     print(f"[scheduler] transform_raw started (every {interval_seconds}s)")
     thread = threading.Thread(target=loop, daemon=True)
@@ -41,48 +69,70 @@ def start_refresh_stats_scheduler(interval_seconds=86400):
                 i += 1
             except Exception as e:
                 print(f"Error executing refresh stats job {i}: {e}")
-            sleep(interval_seconds)
+            wait_next_run(REFRESH_STATS_TRIGGER, interval_seconds)
     # Start periodic stats refresh.
     print(f"[scheduler] refresh_stats started (every {interval_seconds}s)")
     thread = threading.Thread(target=loop, daemon=True)
     thread.start()
 
+def start_refresh_rollups_scheduler(interval_seconds=60):
+    # refreshes the hourly/daily rollups of tab_measurements_clean in a background thread
+    def loop():
+        i = 1
+        while True:
+            try:
+                if refresh_rollups():
+                    REFRESH_DURATION_CURVE_TRIGGER.fire()
+                    REFRESH_FLOW_HISTOGRAM_TRIGGER.fire()
+                print(f"Refresh rollups job {i} executed successfully.")
+                i += 1
+            except Exception as e:
+                print(f"Error executing refresh rollups job {i}: {e}")
+            wait_next_run(REFRESH_ROLLUPS_TRIGGER, interval_seconds)
+    # start periodic rollups refresh
+    print(f"[scheduler] refresh_rollups started (every {interval_seconds}s)")
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+
 def start_clean_measurements_scheduler(interval_seconds=300):
     # runs the measurements cleaning in a background thread on a fixed interval 
+    job = clean_measurements_stream if CLEAN_MODE == "stream" else clean_measurements
     def loop():
         i = 1
         while True:
             try:
-                clean_measurements()
+                if job():
+                    REFRESH_STATS_TRIGGER.fire()
+                    REFRESH_ROLLUPS_TRIGGER.fire()
                 print(f"Clean measurements job {i} executed successfully.")
                 i += 1
             except Exception as e:
                 print(f"Error executing clean measurements job {i}: {e}")
-            sleep(interval_seconds)
+            wait_next_run(CLEAN_TRIGGER, interval_seconds)
     # start periodic measurements cleaning
-    print(f"[scheduler] clean_measurements started (every {interval_seconds}s)")
+    print(f"[scheduler] clean_measurements started (mode {CLEAN_MODE}, every {interval_seconds}s)")
     thread = threading.Thread(target=loop, daemon=True)
     thread.start()
 
-def start_refresh_mv_scheduler(interval_seconds=86400):
-    # runs materialized view refresh in a background thread on a fixed interval
+def start_refresh_duration_curve_scheduler(interval_seconds=86400):
+    # rebuilds the flow duration curve of the devices with new daily data in a background thread
     def loop():
         i = 1
         while True:
             try: 
-                refresh_duration_curve_mv()
-                print(f"Refresh duration curve MV job {i} executed successfully.")
+                refresh_duration_curve()
+                print(f"Refresh duration curve job {i} executed successfully.")
                 i += 1
             except Exception as e:
-                print(f"Error executing refresh duration curve MV job {i}: {e}")
-            sleep(interval_seconds)
-    # start periodic materialized view refresh
-    print(f"[scheduler] refresh_duration_curve_mv started (every {interval_seconds}s)")
+                print(f"Error executing refresh duration curve job {i}: {e}")
+            wait_next_run(REFRESH_DURATION_CURVE_TRIGGER, interval_seconds)
+    # start periodic duration curve refresh
+    print(f"[scheduler] refresh_duration_curve started (every {interval_seconds}s)")
     thread = threading.Thread(target=loop, daemon=True)
     thread.start()
 
-def start_refresh_flow_histogram_scheduler(interval_seconds=3600):
-    # runs flow histogram refresh in a background thread on a fixed interval
+def start_refresh_flow_histogram_scheduler(interval_seconds=60):
+    # folds new cleaned rows into the daily flow sketches and rebuilds the touched histograms
     def loop():
         i = 1
         while True:
@@ -92,12 +142,241 @@ def start_refresh_flow_histogram_scheduler(interval_seconds=3600):
                 i += 1
             except Exception as e:
                 print(f"Error executing flow histogram job {i}: {e}")
-            sleep(interval_seconds)
+            wait_next_run(REFRESH_FLOW_HISTOGRAM_TRIGGER, interval_seconds)
     # start periodic flow histogram refresh
     print(f"[scheduler] refresh_flow_histogram started (every {interval_seconds}s)")
     thread = threading.Thread(target=loop, daemon=True)
     thread.start()
 
+def start_raw_retention_scheduler(interval_seconds=3600):
+    # creates raw partitions ahead and drops the ones already transformed, on a fixed interval
+    def loop():
+        i = 1
+        while True:
+            sleep(interval_seconds)
+            try:
+                raw_retention()
+                print(f"Raw retention job {i} executed successfully.")
+                i += 1
+            except Exception as e:
+                print(f"Error executing raw retention job {i}: {e}")
+    # start periodic raw retention
+    print(f"[scheduler] raw_retention started (every {interval_seconds}s)")
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+
+def start_stats_reporter(interval_seconds=300):
+    # periodically prints connection pool, decoder, throttle and raw writer counters
+    def loop():
+        while True:
+            sleep(interval_seconds)
+            try:
+                stats = pool_stats()
+                print(
+                    "[db_pool] "
+                    f"size={stats['size']}/{stats['max_conn']} in_use={stats['in_use']} idle={stats['idle']} "
+                    f"peak_in_use={stats['peak_in_use']} utilisation={stats['utilisation']:.0%} "
+                    f"borrows={stats['borrows']} wait_avg_ms={stats['wait_avg_ms']:.2f} "
+                    f"wait_max_ms={stats['wait_max_s'] * 1000:.1f} timeouts={stats['timeouts']} "
+                    f"connects={stats['connects']} discarded={stats['discarded']}"
+                )
+                stats = THROTTLE.stats()
+                print(
+                    "[throttle] "
+                    f"devices={stats['devices']} hits={stats['hits']} misses={stats['misses']} "
+                    f"throttled={stats['throttled']} evicted={stats['evicted']} dropped={stats['dropped']}"
+                )
+                stats = DECODE_STATS.snapshot()
+                print(
+                    "[decoder] "
+                    f"backend={stats['backend']} payloads={stats['payloads']} payload_errors={stats['payload_errors']} "
+                    f"measures_ok={stats['measures_ok']} measures_rejected={stats['measures_rejected']} "
+                    f"partial_gateways={stats['partial_gateways']} rejected_gateways={stats['rejected_gateways']}"
+                )
+                for device in stats["dirty_devices"]:
+                    print(
+                        f"[decoder]   {device['device_id']}: measures_rejected={device['measures_rejected']} "
+                        f"partial={device['partial_gateways']} rejected={device['rejected_gateways']} "
+                        f"of {device['gateways']} gateways"
+                    )
+                stats = RAW_WRITER.stats()
+                print(
+                    "[raw_writer] "
+                    f"events={stats['events']} rows={stats['rows']} batches={stats['batches']} "
+                    f"queued_events={stats['queued_events']} failed_batches={stats['failed_batches']} "
+                    f"dropped_rows={stats['dropped_rows']} max_lag_ms={stats['max_lag_ms']:.1f}"
+                )
+                if "spill_segments" in stats:
+                    print(
+                        "[spill] "
+                        f"segments={stats['spill_segments']} bytes={stats['spill_bytes']} "
+                        f"spilled_rows={stats['spill_spilled_rows']} replayed_rows={stats['spill_replayed_rows']} "
+                        f"rejected_rows={stats['spill_rejected_rows']} corrupt_lines={stats['spill_corrupt_lines']} "
+                        f"bad_segments={stats['spill_bad_segments']} bad_rows={stats['spill_bad_rows']}"
+                    )
+            except Exception as e:
+                print(f"Error reading stats: {e}")
+    print(f"[scheduler] stats reporter started (every {interval_seconds}s)")
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+
+def start_schedulers():
+    if JOB_TRIGGER_MODE == "notify":
+        # With wide ingestion the writers fill tab_measurements themselves: wake clean directly.
+        first_trigger = CLEAN_TRIGGER if INGEST_WIDE_ROWS else TRANSFORM_TRIGGER
+        start_notify_listener({RAW_COMMITTED_CHANNEL: [first_trigger]})
+        print(f"[scheduler] jobs triggered by NOTIFY {RAW_COMMITTED_CHANNEL} (fallback poll every {SECONDS_BETWEEN_FALLBACK_POLL}s)")
+    if INGEST_WIDE_ROWS:
+        # Consumers already write pivoted rows into tab_measurements.
+        print("[scheduler] transform_raw disabled (INGEST_WIDE_ROWS)")
+    else:
+        start_transform_scheduler(SECONDS_BETWEEN_RAW_TO_MEASUREMENTS_TRANSFORM)
+    start_refresh_stats_scheduler(SECONDS_BETWEEN_REFRESH_STATS) 
+    start_refresh_rollups_scheduler(SECONDS_BETWEEN_REFRESH_ROLLUPS)
+    start_clean_measurements_scheduler(SECONDS_BETWEEN_CLEAN_MEASUREMENTS)
+    start_refresh_duration_curve_scheduler(SECONDS_BETWEEN_REFRESH_DURATION_CURVE)
+    start_refresh_flow_histogram_scheduler(SECONDS_BETWEEN_REFRESH_FLOW_HISTOGRAM)
+    start_raw_retention_scheduler(SECONDS_BETWEEN_RAW_RETENTION)
+    start_stats_reporter(SECONDS_BETWEEN_STATS_REPORT)
+
+def start_ingest(eventhub_configs, spill_dir=SPILL_DIR):
+    # Blocks until CTRL+C (or SIGTERM in worker processes).
+    if INGEST_MODE == "async":
+        # Imported lazily: the async engine needs psycopg (v3) and psycopg_pool.
+        from db_manager.jobs.ingest_eventhub_async import start_async_consumers
+        start_async_consumers(eventhub_configs, spill_dir)
+    else:
+        start_consumers(eventhub_configs, spill_dir)
+
+def worker_spill_dir(worker_id):
+    return os.path.join(SPILL_DIR, f"worker-{worker_id}")
+
+def adopt_orphaned_spill(spill_dirs):
+    # Spilled rows are only replayed by a buffer opened on their directory: segments left under
+    # SPILL_DIR (top level or worker-N) that none of spill_dirs covers go to the first of them.
+    if not SPILL_ENABLED:
+        return
+    root = Path(SPILL_DIR)
+    live = {Path(d) for d in spill_dirs}
+    orphans = [d for d in [root, *sorted(root.glob("worker-*"))] if d not in live]
+    adopt_segments(spill_dirs[0], orphans)
+
+def _worker_signals():
+    # CTRL+C is handled by the supervisor only; it stops the children with SIGTERM,
+    # which is turned into KeyboardInterrupt so the normal graceful shutdown runs.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+def run_ingest_worker(worker_id, eventhub_configs, events_counter, rows_counter):
+    # Entry point of an ingest worker process: consumes only its shard of meters.
+    _worker_signals()
+    print(f"[worker {worker_id}] pid {os.getpid()}, {len(eventhub_configs)} misuratori")
+
+    def publish_counters():
+        while True:
+            sleep(1)
+            stats = DECODE_STATS.snapshot(top=0)
+            events_counter.value = stats["payloads"]
+            rows_counter.value = stats["measures_ok"]
+
+    threading.Thread(target=publish_counters, daemon=True).start()
+    start_stats_reporter(SECONDS_BETWEEN_STATS_REPORT)
+    # Each worker gets its own spill directory, so replays never race across processes.
+    start_ingest(eventhub_configs, worker_spill_dir(worker_id))
+
+def run_scheduler_worker():
+    _worker_signals()
+    print(f"[worker scheduler] pid {os.getpid()}")
+    start_schedulers()
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+def start_supervisor(eventhub_configs, n_workers):
+    # Shards the meters round-robin over n_workers ingest processes (plus one scheduler process),
+    # restarts any process that exits and reports per-worker throughput.
+    n_workers = min(n_workers, len(eventhub_configs))
+    adopt_orphaned_spill([worker_spill_dir(worker_id) for worker_id in range(n_workers)])
+    workers = []
+    for worker_id in range(n_workers):
+        events_counter = multiprocessing.Value("q", 0)
+        rows_counter = multiprocessing.Value("q", 0)
+        workers.append({
+            "name": f"ingest-{worker_id}",
+            "target": run_ingest_worker,
+            "args": (worker_id, eventhub_configs[worker_id::n_workers], events_counter, rows_counter),
+            "events": events_counter,
+            "rows": rows_counter,
+        })
+    workers.append({"name": "scheduler", "target": run_scheduler_worker, "args": ()})
+    for worker in workers:
+        worker.update(process=None, restarts=0, exited_at=None, last_events=0, last_rows=0)
+
+    def start(worker):
+        if "events" in worker:
+            # A (re)started worker counts from zero.
+            worker["events"].value = worker["rows"].value = 0
+            worker["last_events"] = worker["last_rows"] = 0
+        process = multiprocessing.Process(target=worker["target"], args=worker["args"], name=worker["name"])
+        process.start()
+        worker["process"] = process
+        worker["exited_at"] = None
+
+    # The supervisor does not touch the DB itself; closing its pool also keeps forked
+    # children from inheriting (and later closing) the parent's connections.
+    close_pool()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    for worker in workers:
+        start(worker)
+    print(f"[supervisor] started {n_workers} ingest workers + scheduler. Press CTRL+C to stop.")
+
+    last_report = monotonic()
+    try:
+        while True:
+            sleep(1)
+            now = monotonic()
+            for worker in workers:
+                process = worker["process"]
+                if process.is_alive():
+                    continue
+                if worker["exited_at"] is None:
+                    worker["exited_at"] = now
+                    print(f"[supervisor] {worker['name']} (pid {process.pid}) exited with code {process.exitcode}")
+                elif now - worker["exited_at"] >= SECONDS_BEFORE_WORKER_RESTART:
+                    worker["restarts"] += 1
+                    start(worker)
+                    print(f"[supervisor] {worker['name']} restarted (restart #{worker['restarts']})")
+            if now - last_report >= SECONDS_BETWEEN_STATS_REPORT:
+                elapsed = now - last_report
+                last_report = now
+                for worker in workers:
+                    if "events" not in worker:
+                        continue
+                    events = worker["events"].value
+                    rows = worker["rows"].value
+                    delta_events = events - worker["last_events"]
+                    delta_rows = rows - worker["last_rows"]
+                    worker["last_events"] = events
+                    worker["last_rows"] = rows
+                    print(
+                        f"[supervisor] {worker['name']}: pid={worker['process'].pid} "
+                        f"meters={len(worker['args'][1])} events/s={delta_events / elapsed:.1f} "
+                        f"rows/s={delta_rows / elapsed:.1f} restarts={worker['restarts']}"
+                    )
+    except KeyboardInterrupt:
+        print("[supervisor] stopping workers...")
+        for worker in workers:
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+        deadline = monotonic() + SECONDS_WORKER_SHUTDOWN_GRACE
+        for worker in workers:
+            worker["process"].join(max(0, deadline - monotonic()))
+            if worker["process"].is_alive():
+                print(f"[supervisor] {worker['name']} did not stop in time, killing it")
+                worker["process"].kill()
+
 def main():
     print(r"""
  __        __   _                            _         ____  ____      __  __                                  
@@ -125,9 +404,17 @@ def main():
     # Ensure required tables/indexes exist before processing data.
     try:
         ensure_raw_table()
+        ensure_raw_partitions()
         ensure_etl_state_table()
         ensure_measurements_index()
+        ensure_clean_device_state_table()
+        ensure_clean_daily_partials_table()
+        ensure_clean_rollup_tables()
+        ensure_flow_duration_curve_table()
         ensure_flow_histogram_table()
+        ensure_flow_sketch_table()
+        if CHECKPOINT_STORE == "postgres":
+            ensure_eventhub_checkpoint_tables()
         print(f"\nTable {RAW_TABLE_NAME} checked/created successfully.\n")
     except Exception as e:
         print(f"Error creating/checking table {RAW_TABLE_NAME}: {e}")
@@ -140,13 +427,14 @@ def main():
     print(f"\n--- CREATING {length} EVENT HUB CONSUMER CLIENTS ---\n")
     
     
+    if INGEST_WORKER_PROCESSES > 1:
+        start_supervisor(eventhub_configs, INGEST_WORKER_PROCESSES)
+        return
+
     # Start background jobs before blocking on consumers.
-    start_transform_scheduler(SECONDS_BETWEEN_RAW_TO_MEASUREMENTS_TRANSFORM) 
-    start_refresh_stats_scheduler(SECONDS_BETWEEN_REFRESH_STATS) 
-    start_clean_measurements_scheduler(SECONDS_BETWEEN_CLEAN_MEASUREMENTS)
-    start_refresh_mv_scheduler(SECONDS_BETWEEN_REFRESH_MV)
-    start_refresh_flow_histogram_scheduler(SECONDS_BETWEEN_REFRESH_FLOW_HISTOGRAM)
-    start_consumers(eventhub_configs)
+    adopt_orphaned_spill([SPILL_DIR])
+    start_schedulers()
+    start_ingest(eventhub_configs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,13 @@
+-- Leases up to N devices with measurements newer than their watermark. Devices locked by
+-- another worker are skipped; the locks are released when the claiming transaction ends.
+SELECT s.id_misuratore
+FROM hydro.tab_clean_device_state s
+WHERE EXISTS (
+    SELECT 1
+    FROM hydro.tab_measurements m
+    WHERE m.device_id = s.id_misuratore
+    AND m.ts_s > s.last_ts
+)
+ORDER BY s.id_misuratore
+LIMIT %(batch_devices)s
+FOR UPDATE SKIP LOCKED;
@@ -0,0 +1,5 @@
+COPY tmp_measurements_clean_staging (
+    id_misuratore, data_misurazione, flow_ls_raw, flow_ls_smoothed,
+    is_outlier, window_median, thresholds
+)
+FROM STDIN;
@@ -1,5 +1,5 @@
-INSERT INTO {RAW_TABLE_NAME} (
+COPY {RAW_TABLE_NAME} (
     device_id, group_name, parent_timestamp, parent_timestampMsec,
     measure_name, raw_data, status, measure_timestamp, measure_timestampMsec
 )
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
+FROM STDIN;
@@ -0,0 +1,18 @@
+-- Per-device, per-day (UTC) aggregates of the valid cleaned flow (not NULL, not outlier),
+-- kept up to date by refresh_stats for the days touched since its last run.
+CREATE TABLE IF NOT EXISTS hydro.tab_clean_daily_partials (
+    id_misuratore TEXT NOT NULL,
+    day DATE NOT NULL,
+    n BIGINT NOT NULL,
+    sum_flow NUMERIC,
+    min_flow DOUBLE PRECISION,
+    max_flow DOUBLE PRECISION,
+    first_ts TIMESTAMPTZ,
+    last_ts TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (id_misuratore, day)
+);
+
+-- refresh_stats finds the touched days with "updated_at >= watermark".
+CREATE INDEX IF NOT EXISTS idx_measurements_clean_updated_at
+ON hydro.tab_measurements_clean (updated_at);
@@ -0,0 +1,8 @@
+-- Per-device cleaning watermark: the last ts_s of each device already cleaned.
+-- The rows also serve as the work queue: a worker leases devices by locking their
+-- rows (FOR UPDATE SKIP LOCKED) for the duration of its transaction.
+CREATE TABLE IF NOT EXISTS hydro.tab_clean_device_state (
+    id_misuratore TEXT PRIMARY KEY,
+    last_ts TIMESTAMPTZ NOT NULL DEFAULT '-infinity',
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,11 @@
+-- Devices already regenerated by a regenerate_clean_measurements run (to resume after a stop).
+CREATE TABLE IF NOT EXISTS hydro.tab_clean_regenerate_progress (
+    run_name TEXT NOT NULL,
+    id_misuratore TEXT NOT NULL,
+    rows_written BIGINT NOT NULL,
+    finished_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (run_name, id_misuratore)
+);
+
+ALTER TABLE hydro.tab_clean_regenerate_progress
+    ADD COLUMN IF NOT EXISTS rows_unchanged BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,36 @@
+-- Hourly and daily (UTC) rollups of tab_measurements_clean per device, kept up to date by
+-- refresh_rollups for the buckets touched since its last run. *_n count the non-NaN values
+-- behind avg/min/max; n_outliers counts the points replaced by the Hampel filter.
+CREATE TABLE IF NOT EXISTS hydro.tab_measurements_clean_hourly (
+    id_misuratore TEXT NOT NULL,
+    hour_start TIMESTAMPTZ NOT NULL,
+    n_rows BIGINT NOT NULL,
+    n_outliers BIGINT NOT NULL,
+    flow_raw_n BIGINT NOT NULL,
+    flow_raw_avg DOUBLE PRECISION,
+    flow_raw_min DOUBLE PRECISION,
+    flow_raw_max DOUBLE PRECISION,
+    flow_smoothed_n BIGINT NOT NULL,
+    flow_smoothed_avg DOUBLE PRECISION,
+    flow_smoothed_min DOUBLE PRECISION,
+    flow_smoothed_max DOUBLE PRECISION,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (id_misuratore, hour_start)
+);
+
+CREATE TABLE IF NOT EXISTS hydro.tab_measurements_clean_daily (
+    id_misuratore TEXT NOT NULL,
+    day DATE NOT NULL,
+    n_rows BIGINT NOT NULL,
+    n_outliers BIGINT NOT NULL,
+    flow_raw_n BIGINT NOT NULL,
+    flow_raw_avg DOUBLE PRECISION,
+    flow_raw_min DOUBLE PRECISION,
+    flow_raw_max DOUBLE PRECISION,
+    flow_smoothed_n BIGINT NOT NULL,
+    flow_smoothed_avg DOUBLE PRECISION,
+    flow_smoothed_min DOUBLE PRECISION,
+    flow_smoothed_max DOUBLE PRECISION,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (id_misuratore, day)
+);
@@ -0,0 +1,11 @@
+-- Session-local staging table for the bulk upsert of tab_measurements_clean:
+-- batches are COPYed here and merged with a single INSERT ... SELECT.
+CREATE TEMP TABLE IF NOT EXISTS tmp_measurements_clean_staging (
+    id_misuratore text NOT NULL,
+    data_misurazione timestamptz NOT NULL,
+    flow_ls_raw double precision,
+    flow_ls_smoothed double precision,
+    is_outlier boolean,
+    window_median double precision,
+    thresholds double precision
+) ON COMMIT DELETE ROWS;
@@ -0,0 +1,21 @@
+CREATE TABLE IF NOT EXISTS hydro.tab_eventhub_checkpoints (
+    fully_qualified_namespace TEXT NOT NULL,
+    eventhub_name TEXT NOT NULL,
+    consumer_group TEXT NOT NULL,
+    partition_id TEXT NOT NULL,
+    offset_value TEXT,
+    sequence_number BIGINT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (fully_qualified_namespace, eventhub_name, consumer_group, partition_id)
+);
+
+CREATE TABLE IF NOT EXISTS hydro.tab_eventhub_ownership (
+    fully_qualified_namespace TEXT NOT NULL,
+    eventhub_name TEXT NOT NULL,
+    consumer_group TEXT NOT NULL,
+    partition_id TEXT NOT NULL,
+    owner_id TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    last_modified_time DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (fully_qualified_namespace, eventhub_name, consumer_group, partition_id)
+);
@@ -0,0 +1,16 @@
+-- Flow duration curve from daily average flows (same columns as the old
+-- mv_flow_duration_curve_daily), rebuilt per device by refresh_duration_curve.
+CREATE TABLE IF NOT EXISTS hydro.tab_flow_duration_curve_daily (
+    id_misuratore TEXT NOT NULL,
+    giorno DATE NOT NULL,
+    flow_avg_day DOUBLE PRECISION NOT NULL,
+    m BIGINT NOT NULL,
+    n BIGINT NOT NULL,
+    p_exceed DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (id_misuratore, giorno)
+);
+
+-- refresh_duration_curve finds the devices with changed days with "updated_at >= watermark".
+CREATE INDEX IF NOT EXISTS idx_measurements_clean_daily_updated_at
+ON hydro.tab_measurements_clean_daily (updated_at);
@@ -0,0 +1,20 @@
+-- Mergeable per-device, per-day (UTC) sketch of the smoothed flow (DDSketch-style): a value v
+-- falls in bin_key = ceil(ln |v| / ln gamma) with sign = sign(v), values with |v| below the
+-- minimum in sign = 0. Any window is the sum of its days' counts per (sign, bin_key).
+CREATE TABLE IF NOT EXISTS hydro.tab_flow_sketch_daily (
+    id_misuratore TEXT NOT NULL,
+    day DATE NOT NULL,
+    sign SMALLINT NOT NULL,
+    bin_key INTEGER NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (id_misuratore, day, sign, bin_key)
+);
+
+-- Mapping the sketches were built with (one row): readers decode bin_key with it, and
+-- refresh_flow_histogram rebuilds every sketch when the settings no longer match.
+CREATE TABLE IF NOT EXISTS hydro.tab_flow_sketch_params (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    relative_accuracy DOUBLE PRECISION NOT NULL,
+    min_value DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
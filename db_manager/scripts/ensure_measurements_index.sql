@@ -1,2 +1,6 @@
 CREATE UNIQUE INDEX IF NOT EXISTS idx_measurements_device_ts
 ON hydro.tab_measurements (device_id, ts_s);
+
+-- Incremental jobs select "ts_s > watermark" across all devices.
+CREATE INDEX IF NOT EXISTS idx_measurements_ts
+ON hydro.tab_measurements (ts_s);
\ No newline at end of file
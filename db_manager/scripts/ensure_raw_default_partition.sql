@@ -0,0 +1,3 @@
+-- Catches rows outside the pre-created daily partitions (late or badly stamped payloads).
+CREATE TABLE IF NOT EXISTS {RAW_TABLE_NAME}_default
+PARTITION OF {RAW_TABLE_NAME} DEFAULT;
\ No newline at end of file
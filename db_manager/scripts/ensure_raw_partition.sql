@@ -0,0 +1,3 @@
+CREATE TABLE IF NOT EXISTS {PARTITION_NAME}
+PARTITION OF {RAW_TABLE_NAME}
+FOR VALUES FROM ({FROM_MSEC}) TO ({TO_MSEC});
\ No newline at end of file
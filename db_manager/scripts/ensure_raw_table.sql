@@ -1,15 +1,22 @@
+-- Range-partitioned by parent_timestampmsec (one partition per UTC day, created ahead by
+-- db/schema.py); old partitions are dropped by the raw retention job.
 CREATE TABLE IF NOT EXISTS {RAW_TABLE_NAME} (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     device_id TEXT,
     group_name TEXT,
     parent_timestamp BIGINT,
-    parent_timestampMsec BIGINT,
+    parent_timestampMsec BIGINT NOT NULL,
     measure_name TEXT,
     raw_data DOUBLE PRECISION,
     status INTEGER,
     measure_timestamp BIGINT,
-    measure_timestampMsec BIGINT
-);
+    measure_timestampMsec BIGINT,
+    PRIMARY KEY (id, parent_timestampMsec)
+) PARTITION BY RANGE (parent_timestampMsec);
 
 CREATE INDEX IF NOT EXISTS idx_raw_device_ts
-ON {RAW_TABLE_NAME} (device_id, measure_timestampMsec);
\ No newline at end of file
+ON {RAW_TABLE_NAME} (device_id, measure_timestampMsec);
+
+-- Drives the incremental transform (watermark on parent_timestampmsec, chunk bounds).
+CREATE INDEX IF NOT EXISTS idx_raw_parent_ts
+ON {RAW_TABLE_NAME} (parent_timestampmsec);
\ No newline at end of file
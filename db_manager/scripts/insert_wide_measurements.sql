@@ -0,0 +1,16 @@
+INSERT INTO hydro.tab_measurements (
+    device_id,
+    ts_s,
+    instant_flow_rate_2,
+    instant_flow_rate_1,
+    fluid_velocity_2,
+    fluid_velocity_1,
+    instant_heat_flow_rate_2,
+    instant_heat_flow_rate_1,
+    return_water_temperature_2,
+    return_water_temperature_1,
+    supplying_water_temperature_2,
+    supplying_water_temperature_1
+)
+VALUES %s
+ON CONFLICT (device_id, ts_s) DO NOTHING;
@@ -0,0 +1,44 @@
+-- Recomputes the daily partials of the (device, day) pairs with cleaned rows written in
+-- [since, until), from the rows of those days only; returns the touched devices.
+WITH touched AS (
+    SELECT DISTINCT id_misuratore, (data_misurazione AT TIME ZONE 'UTC')::date AS day
+    FROM hydro.tab_measurements_clean
+    -- First run (watermark 0): every row, also those written before updated_at was set.
+    WHERE %(since_ms)s = 0
+    OR (updated_at >= to_timestamp(%(since_ms)s / 1000.0) AND updated_at < %(until)s)
+)
+INSERT INTO hydro.tab_clean_daily_partials (
+    id_misuratore, day, n, sum_flow, min_flow, max_flow, first_ts, last_ts, updated_at
+)
+SELECT
+    t.id_misuratore,
+    t.day,
+    COUNT(*) FILTER (WHERE c.valid),
+    SUM(c.flow_ls_smoothed) FILTER (WHERE c.valid),
+    MIN(c.flow_ls_smoothed) FILTER (WHERE c.valid),
+    MAX(c.flow_ls_smoothed) FILTER (WHERE c.valid),
+    MIN(c.data_misurazione) FILTER (WHERE c.valid),
+    MAX(c.data_misurazione) FILTER (WHERE c.valid),
+    now()
+FROM touched t
+CROSS JOIN LATERAL (
+    SELECT
+        data_misurazione,
+        flow_ls_smoothed,
+        flow_ls_smoothed IS NOT NULL AND COALESCE(is_outlier, false) = false AS valid
+    FROM hydro.tab_measurements_clean
+    WHERE id_misuratore = t.id_misuratore
+    AND data_misurazione >= t.day::timestamp AT TIME ZONE 'UTC'
+    AND data_misurazione < (t.day + 1)::timestamp AT TIME ZONE 'UTC'
+) c
+GROUP BY t.id_misuratore, t.day
+ON CONFLICT (id_misuratore, day)
+DO UPDATE SET
+    n = EXCLUDED.n,
+    sum_flow = EXCLUDED.sum_flow,
+    min_flow = EXCLUDED.min_flow,
+    max_flow = EXCLUDED.max_flow,
+    first_ts = EXCLUDED.first_ts,
+    last_ts = EXCLUDED.last_ts,
+    updated_at = EXCLUDED.updated_at
+RETURNING id_misuratore;
@@ -0,0 +1,50 @@
+-- Recomputes the daily rollup of the (device, day) pairs with cleaned rows written in
+-- [since, until) from their (already refreshed) hourly rollup rows: at most 24 per day.
+-- Returns the touched devices and days.
+WITH touched AS (
+    SELECT DISTINCT id_misuratore, (data_misurazione AT TIME ZONE 'UTC')::date AS day
+    FROM hydro.tab_measurements_clean
+    -- First run (watermark 0): every row, also those written before updated_at was set.
+    WHERE %(since_ms)s = 0
+    OR (updated_at >= to_timestamp(%(since_ms)s / 1000.0) AND updated_at < %(until)s)
+)
+INSERT INTO hydro.tab_measurements_clean_daily (
+    id_misuratore, day, n_rows, n_outliers,
+    flow_raw_n, flow_raw_avg, flow_raw_min, flow_raw_max,
+    flow_smoothed_n, flow_smoothed_avg, flow_smoothed_min, flow_smoothed_max,
+    updated_at
+)
+SELECT
+    t.id_misuratore,
+    t.day,
+    SUM(h.n_rows),
+    SUM(h.n_outliers),
+    SUM(h.flow_raw_n),
+    SUM(h.flow_raw_avg * h.flow_raw_n) / NULLIF(SUM(h.flow_raw_n), 0),
+    MIN(h.flow_raw_min),
+    MAX(h.flow_raw_max),
+    SUM(h.flow_smoothed_n),
+    SUM(h.flow_smoothed_avg * h.flow_smoothed_n) / NULLIF(SUM(h.flow_smoothed_n), 0),
+    MIN(h.flow_smoothed_min),
+    MAX(h.flow_smoothed_max),
+    now()
+FROM touched t
+JOIN hydro.tab_measurements_clean_hourly h
+    ON h.id_misuratore = t.id_misuratore
+    AND h.hour_start >= t.day::timestamp AT TIME ZONE 'UTC'
+    AND h.hour_start < (t.day + 1)::timestamp AT TIME ZONE 'UTC'
+GROUP BY t.id_misuratore, t.day
+ON CONFLICT (id_misuratore, day)
+DO UPDATE SET
+    n_rows = EXCLUDED.n_rows,
+    n_outliers = EXCLUDED.n_outliers,
+    flow_raw_n = EXCLUDED.flow_raw_n,
+    flow_raw_avg = EXCLUDED.flow_raw_avg,
+    flow_raw_min = EXCLUDED.flow_raw_min,
+    flow_raw_max = EXCLUDED.flow_raw_max,
+    flow_smoothed_n = EXCLUDED.flow_smoothed_n,
+    flow_smoothed_avg = EXCLUDED.flow_smoothed_avg,
+    flow_smoothed_min = EXCLUDED.flow_smoothed_min,
+    flow_smoothed_max = EXCLUDED.flow_smoothed_max,
+    updated_at = EXCLUDED.updated_at
+RETURNING id_misuratore, day;
@@ -0,0 +1,56 @@
+-- Recomputes the hourly rollup of the (device, hour) pairs with cleaned rows written in
+-- [since, until), from the rows of those hours only.
+WITH touched AS (
+    SELECT DISTINCT
+        id_misuratore,
+        date_trunc('hour', data_misurazione AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS hour_start
+    FROM hydro.tab_measurements_clean
+    -- First run (watermark 0): every row, also those written before updated_at was set.
+    WHERE %(since_ms)s = 0
+    OR (updated_at >= to_timestamp(%(since_ms)s / 1000.0) AND updated_at < %(until)s)
+)
+INSERT INTO hydro.tab_measurements_clean_hourly (
+    id_misuratore, hour_start, n_rows, n_outliers,
+    flow_raw_n, flow_raw_avg, flow_raw_min, flow_raw_max,
+    flow_smoothed_n, flow_smoothed_avg, flow_smoothed_min, flow_smoothed_max,
+    updated_at
+)
+SELECT
+    t.id_misuratore,
+    t.hour_start,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE c.is_outlier),
+    COUNT(c.raw),
+    AVG(c.raw),
+    MIN(c.raw),
+    MAX(c.raw),
+    COUNT(c.smoothed),
+    AVG(c.smoothed),
+    MIN(c.smoothed),
+    MAX(c.smoothed),
+    now()
+FROM touched t
+CROSS JOIN LATERAL (
+    SELECT
+        COALESCE(is_outlier, false) AS is_outlier,
+        NULLIF(flow_ls_raw, 'NaN')::double precision AS raw,
+        NULLIF(flow_ls_smoothed, 'NaN')::double precision AS smoothed
+    FROM hydro.tab_measurements_clean
+    WHERE id_misuratore = t.id_misuratore
+    AND data_misurazione >= t.hour_start
+    AND data_misurazione < t.hour_start + interval '1 hour'
+) c
+GROUP BY t.id_misuratore, t.hour_start
+ON CONFLICT (id_misuratore, hour_start)
+DO UPDATE SET
+    n_rows = EXCLUDED.n_rows,
+    n_outliers = EXCLUDED.n_outliers,
+    flow_raw_n = EXCLUDED.flow_raw_n,
+    flow_raw_avg = EXCLUDED.flow_raw_avg,
+    flow_raw_min = EXCLUDED.flow_raw_min,
+    flow_raw_max = EXCLUDED.flow_raw_max,
+    flow_smoothed_n = EXCLUDED.flow_smoothed_n,
+    flow_smoothed_avg = EXCLUDED.flow_smoothed_avg,
+    flow_smoothed_min = EXCLUDED.flow_smoothed_min,
+    flow_smoothed_max = EXCLUDED.flow_smoothed_max,
+    updated_at = EXCLUDED.updated_at;
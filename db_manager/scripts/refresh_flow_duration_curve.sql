@@ -0,0 +1,30 @@
+-- Rebuilds the duration curve of the given devices from their daily average smoothed flow
+-- (tab_measurements_clean_daily): days ranked by flow descending (m), n days per device,
+-- exceedance probability m / (n + 1) * 100. Same formula as mv_flow_duration_curve_daily.
+DELETE FROM hydro.tab_flow_duration_curve_daily
+WHERE id_misuratore = ANY(%(device_ids)s);
+
+INSERT INTO hydro.tab_flow_duration_curve_daily (
+    id_misuratore, giorno, flow_avg_day, m, n, p_exceed, updated_at
+)
+WITH ranked AS (
+    SELECT
+        d.id_misuratore,
+        d.day AS giorno,
+        d.flow_smoothed_avg AS flow_avg_day,
+        row_number() OVER (PARTITION BY d.id_misuratore ORDER BY d.flow_smoothed_avg DESC) AS m,
+        count(*) OVER (PARTITION BY d.id_misuratore) AS n
+    FROM hydro.tab_measurements_clean_daily d
+    JOIN hydro.tab_misuratori mis ON mis.id_misuratore = d.id_misuratore
+    WHERE d.id_misuratore = ANY(%(device_ids)s)
+    AND d.flow_smoothed_avg IS NOT NULL
+)
+SELECT
+    id_misuratore,
+    giorno,
+    flow_avg_day,
+    m,
+    n,
+    m::double precision / (n + 1)::double precision * 100::double precision,
+    now()
+FROM ranked;
@@ -1,67 +1,71 @@
+-- Rebuilds the {BINS}-bin linear histogram of the given devices over [window_start, window_end)
+-- (whole UTC days) by merging their day sketches: every sketch bin is placed, with its count,
+-- in the linear bin of its representative value 2 * gamma^k / (gamma + 1). The range is the
+-- exact min/max of the smoothed flow from the daily rollup.
+DELETE FROM hydro.tab_flow_histogram
+WHERE id_misuratore = ANY(%(device_ids)s);
+
 WITH params AS (
     SELECT
-        {WINDOW_END} AS window_end,
-        {WINDOW_START} AS window_start
-),
-data AS (
-    SELECT
-        id_misuratore,
-        flow_ls_smoothed AS value
-    FROM hydro.tab_measurements_clean
-    WHERE {WINDOW_FILTER}
-    AND flow_ls_smoothed IS NOT NULL
+        %(window_start)s::timestamptz AS window_start,
+        %(window_end)s::timestamptz AS window_end,
+        (%(window_start)s::timestamptz AT TIME ZONE 'UTC')::date AS first_day,
+        (%(window_end)s::timestamptz AT TIME ZONE 'UTC')::date AS last_day
 ),
 ranges AS (
     SELECT
-        id_misuratore,
-        MIN(value) AS min_v,
-        MAX(value) AS max_v
-    FROM data
-    GROUP BY id_misuratore
+        d.id_misuratore,
+        MIN(d.flow_smoothed_min) AS min_v,
+        MAX(d.flow_smoothed_max) AS max_v
+    FROM hydro.tab_measurements_clean_daily d
+    JOIN hydro.tab_misuratori mis ON mis.id_misuratore = d.id_misuratore
+    CROSS JOIN params p
+    WHERE d.id_misuratore = ANY(%(device_ids)s)
+    AND d.day >= p.first_day
+    AND d.day <= p.last_day
+    AND d.flow_smoothed_n > 0
+    GROUP BY d.id_misuratore
 ),
-buckets AS (
+merged AS (
+    SELECT s.id_misuratore, s.sign, s.bin_key, SUM(s.count) AS count
+    FROM hydro.tab_flow_sketch_daily s
+    CROSS JOIN params p
+    WHERE s.id_misuratore = ANY(%(device_ids)s)
+    AND s.day >= p.first_day
+    AND s.day <= p.last_day
+    GROUP BY s.id_misuratore, s.sign, s.bin_key
+),
+placed AS (
     SELECT
-        d.id_misuratore,
+        m.id_misuratore,
         CASE
             WHEN r.max_v = r.min_v THEN 1
-            ELSE width_bucket(d.value, r.min_v, r.max_v, {BINS})
+            ELSE LEAST(GREATEST(width_bucket(
+                LEAST(GREATEST(m.sign * 2 * exp(m.bin_key * %(ln_gamma)s) / (exp(%(ln_gamma)s) + 1), r.min_v), r.max_v),
+                r.min_v, r.max_v, {BINS}
+            ), 1), {BINS})
         END AS bin_index,
-        r.min_v,
-        r.max_v
-    FROM data d
+        m.count
+    FROM merged m
     JOIN ranges r USING (id_misuratore)
 ),
 agg AS (
-    SELECT
-        id_misuratore,
-        bin_index,
-        min_v,
-        max_v,
-        COUNT(*) AS count
-    FROM buckets
-    WHERE bin_index BETWEEN 1 AND {BINS}
-    GROUP BY id_misuratore, bin_index, min_v, max_v
+    SELECT id_misuratore, bin_index, SUM(count) AS count
+    FROM placed
+    GROUP BY id_misuratore, bin_index
 ),
-bins AS (
+final AS (
     SELECT
         r.id_misuratore,
         gs AS bin_index,
         r.min_v,
-        r.max_v
-    FROM ranges r,
-        generate_series(1, {BINS}) AS gs
-),
-final AS (
-    SELECT
-        b.id_misuratore,
-        b.bin_index,
-        b.min_v,
-        b.max_v,
+        r.max_v,
         COALESCE(a.count, 0) AS count
-    FROM bins b
+    FROM ranges r
+    CROSS JOIN generate_series(1, {BINS}) AS gs
     LEFT JOIN agg a
-        ON a.id_misuratore = b.id_misuratore
-        AND a.bin_index = b.bin_index
+        ON a.id_misuratore = r.id_misuratore
+        AND a.bin_index = gs
 )
 INSERT INTO hydro.tab_flow_histogram (
     id_misuratore,
@@ -89,10 +93,4 @@ SELECT
     f.count,
     now()
 FROM final f
-CROSS JOIN params p
-ON CONFLICT (id_misuratore, window_start, window_end, bin_index)
-DO UPDATE SET
-    range_start = EXCLUDED.range_start,
-    range_end = EXCLUDED.range_end,
-    count = EXCLUDED.count,
-    updated_at = now();
+CROSS JOIN params p;
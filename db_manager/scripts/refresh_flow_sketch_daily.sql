@@ -0,0 +1,34 @@
+-- Recomputes the day sketches of the (device, day) pairs with cleaned rows written in
+-- [since, until), from the rows of those days only; returns the touched devices.
+CREATE TEMP TABLE tmp_flow_sketch_touched ON COMMIT DROP AS
+SELECT DISTINCT id_misuratore, (data_misurazione AT TIME ZONE 'UTC')::date AS day
+FROM hydro.tab_measurements_clean
+-- First run (watermark 0): every row, also those written before updated_at was set.
+WHERE %(since_ms)s = 0
+OR (updated_at >= to_timestamp(%(since_ms)s / 1000.0) AND updated_at < to_timestamp(%(until_ms)s / 1000.0));
+
+DELETE FROM hydro.tab_flow_sketch_daily s
+USING tmp_flow_sketch_touched t
+WHERE s.id_misuratore = t.id_misuratore
+AND s.day = t.day;
+
+INSERT INTO hydro.tab_flow_sketch_daily (id_misuratore, day, sign, bin_key, count)
+SELECT t.id_misuratore, t.day, k.sign, k.bin_key, COUNT(*)
+FROM tmp_flow_sketch_touched t
+CROSS JOIN LATERAL (
+    SELECT flow_ls_smoothed::double precision AS v
+    FROM hydro.tab_measurements_clean
+    WHERE id_misuratore = t.id_misuratore
+    AND data_misurazione >= t.day::timestamp AT TIME ZONE 'UTC'
+    AND data_misurazione < (t.day + 1)::timestamp AT TIME ZONE 'UTC'
+    AND flow_ls_smoothed IS NOT NULL
+    AND flow_ls_smoothed <> 'NaN'
+) c
+CROSS JOIN LATERAL (
+    SELECT
+        CASE WHEN abs(c.v) < %(min_value)s THEN 0 ELSE sign(c.v)::smallint END AS sign,
+        CASE WHEN abs(c.v) < %(min_value)s THEN 0 ELSE ceil(ln(abs(c.v)) / %(ln_gamma)s)::integer END AS bin_key
+) k
+GROUP BY t.id_misuratore, t.day, k.sign, k.bin_key;
+
+SELECT DISTINCT id_misuratore FROM tmp_flow_sketch_touched;
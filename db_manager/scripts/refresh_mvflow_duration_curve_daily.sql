@@ -1 +0,0 @@
-REFRESH MATERIALIZED VIEW hydro.mv_flow_duration_curve_daily;
@@ -1,4 +1,6 @@
---2) Popolare/aggiornare tab_statistiche_misuratori (UPSERT)
+--2) Popolare/aggiornare tab_statistiche_misuratori (UPSERT) per i device con giorni toccati,
+--   dai parziali giornalieri: i giorni interi della finestra dai parziali, il giorno di bordo
+--   (dove cade last_ts - finestra) dalle righe pulite di quel solo giorno.
 INSERT INTO hydro.tab_statistiche_misuratori (
   id_misuratore,
   total_measurements,
@@ -11,45 +13,65 @@ INSERT INTO hydro.tab_statistiche_misuratori (
   avg_all_time,
   updated_at
 )
-WITH base AS (
+WITH totals AS (
   SELECT
     id_misuratore,
-    data_misurazione,
-    flow_ls_smoothed AS flow
-  FROM hydro.tab_measurements_clean
-  WHERE flow_ls_smoothed IS NOT NULL
-    AND COALESCE(is_outlier, false) = false
-),
-last_per_sensor AS (
-  SELECT
-    id_misuratore,
-    MAX(data_misurazione) AS last_ts,
-    MIN(data_misurazione) AS first_ts,
-    COUNT(*)::bigint      AS total_measurements
-  FROM base
+    SUM(n)::bigint                  AS total_measurements,
+    MIN(first_ts)                   AS first_ts,
+    MAX(last_ts)                    AS last_ts,
+    SUM(sum_flow) / SUM(n)          AS avg_all_time
+  FROM hydro.tab_clean_daily_partials
+  WHERE id_misuratore = ANY(%(device_ids)s)
+    AND n > 0
   GROUP BY id_misuratore
 ),
-agg AS (
+windows AS (
+  SELECT t.id_misuratore, w.name, t.last_ts - w.span AS start_ts
+  FROM totals t
+  CROSS JOIN (VALUES
+    ('24h', interval '24 hours'),
+    ('7d', interval '7 days'),
+    ('30d', interval '30 days'),
+    ('360d', interval '360 days')
+  ) AS w(name, span)
+),
+window_avg AS (
   SELECT
-    l.id_misuratore,
-    l.total_measurements,
-    l.first_ts AS first_measurement,
-    l.last_ts  AS last_measurement,
-
-    AVG(b.flow) FILTER (WHERE b.data_misurazione >= l.last_ts - interval '24 hours') AS avg_24h,
-    AVG(b.flow) FILTER (WHERE b.data_misurazione >= l.last_ts - interval '7 days')   AS avg_7d,
-    AVG(b.flow) FILTER (WHERE b.data_misurazione >= l.last_ts - interval '30 days')  AS avg_30d,
-    AVG(b.flow) FILTER (WHERE b.data_misurazione >= l.last_ts - interval '360 days') AS avg_360d,
-    AVG(b.flow)                                                                      AS avg_all_time,
-
-    now() AS updated_at
-  FROM last_per_sensor l
-  JOIN base b
-    ON b.id_misuratore = l.id_misuratore
-  GROUP BY
-    l.id_misuratore, l.total_measurements, l.first_ts, l.last_ts
+    w.id_misuratore,
+    w.name,
+    (COALESCE(full_days.sum_flow, 0) + COALESCE(edge.sum_flow, 0))
+      / NULLIF(COALESCE(full_days.n, 0) + edge.n, 0) AS avg_flow
+  FROM windows w
+  CROSS JOIN LATERAL (
+    SELECT SUM(p.sum_flow) AS sum_flow, SUM(p.n) AS n
+    FROM hydro.tab_clean_daily_partials p
+    WHERE p.id_misuratore = w.id_misuratore
+      AND p.day > (w.start_ts AT TIME ZONE 'UTC')::date
+  ) full_days
+  CROSS JOIN LATERAL (
+    SELECT SUM(c.flow_ls_smoothed) AS sum_flow, COUNT(*) AS n
+    FROM hydro.tab_measurements_clean c
+    WHERE c.id_misuratore = w.id_misuratore
+      AND c.data_misurazione >= w.start_ts
+      AND c.data_misurazione < ((w.start_ts AT TIME ZONE 'UTC')::date + 1)::timestamp AT TIME ZONE 'UTC'
+      AND c.flow_ls_smoothed IS NOT NULL
+      AND COALESCE(c.is_outlier, false) = false
+  ) edge
 )
-SELECT * FROM agg
+SELECT
+  t.id_misuratore,
+  t.total_measurements,
+  t.first_ts AS first_measurement,
+  t.last_ts  AS last_measurement,
+  MAX(a.avg_flow) FILTER (WHERE a.name = '24h')  AS avg_24h,
+  MAX(a.avg_flow) FILTER (WHERE a.name = '7d')   AS avg_7d,
+  MAX(a.avg_flow) FILTER (WHERE a.name = '30d')  AS avg_30d,
+  MAX(a.avg_flow) FILTER (WHERE a.name = '360d') AS avg_360d,
+  t.avg_all_time,
+  now() AS updated_at
+FROM totals t
+JOIN window_avg a ON a.id_misuratore = t.id_misuratore
+GROUP BY t.id_misuratore, t.total_measurements, t.first_ts, t.last_ts, t.avg_all_time
 ON CONFLICT (id_misuratore)
 DO UPDATE SET
   total_measurements = EXCLUDED.total_measurements,
@@ -60,4 +82,4 @@ DO UPDATE SET
   avg_30d            = EXCLUDED.avg_30d,
   avg_360d           = EXCLUDED.avg_360d,
   avg_all_time       = EXCLUDED.avg_all_time,
-  updated_at         = EXCLUDED.updated_at;
\ No newline at end of file
+  updated_at         = EXCLUDED.updated_at;
@@ -0,0 +1,13 @@
+-- Upper bound for scans by updated_at of tables written by other transactions (clean rows for
+-- stats and rollups, daily rollup for the duration curve): rows of transactions still open have
+-- updated_at (their now()) >= the oldest open transaction start, so everything below it is committed.
+SELECT LEAST(
+    now(),
+    COALESCE((
+        SELECT MIN(xact_start)
+        FROM pg_stat_activity
+        WHERE datname = current_database()
+        AND pid <> pg_backend_pid()
+        AND xact_start IS NOT NULL
+    ), now())
+);
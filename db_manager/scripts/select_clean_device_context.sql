@@ -0,0 +1,14 @@
+-- Last N cleaned points (<= device watermark) of each leased device, oldest first: the left
+-- context the Hampel window needs to recompute the tail of the series with the new rows.
+SELECT s.id_misuratore, c.data_misurazione, c.flow_ls_raw
+FROM hydro.tab_clean_device_state s
+CROSS JOIN LATERAL (
+    SELECT data_misurazione, flow_ls_raw
+    FROM hydro.tab_measurements_clean
+    WHERE id_misuratore = s.id_misuratore
+    AND data_misurazione <= s.last_ts
+    ORDER BY data_misurazione DESC
+    LIMIT %(context_rows)s
+) c
+WHERE s.id_misuratore = ANY(%(device_ids)s)
+ORDER BY s.id_misuratore, c.data_misurazione;
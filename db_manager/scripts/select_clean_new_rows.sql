@@ -0,0 +1,14 @@
+-- New measurements (ts_s > device watermark) of the leased devices, at most N per device,
+-- oldest first: a long backlog is worked off over several runs.
+SELECT s.id_misuratore, m.ts_s, m.instant_flow_rate_2
+FROM hydro.tab_clean_device_state s
+CROSS JOIN LATERAL (
+    SELECT ts_s, instant_flow_rate_2
+    FROM hydro.tab_measurements
+    WHERE device_id = s.id_misuratore
+    AND ts_s > s.last_ts
+    ORDER BY ts_s
+    LIMIT %(max_rows)s
+) m
+WHERE s.id_misuratore = ANY(%(device_ids)s)
+ORDER BY s.id_misuratore, m.ts_s;
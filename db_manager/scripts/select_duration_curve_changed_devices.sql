@@ -0,0 +1,5 @@
+-- Devices whose daily rollup rows were written in [since, until).
+SELECT DISTINCT id_misuratore
+FROM hydro.tab_measurements_clean_daily
+WHERE updated_at >= to_timestamp(%(since_ms)s / 1000.0)
+AND updated_at < %(until)s;
@@ -0,0 +1,17 @@
+-- Upper parent_timestampmsec of the next chunk: the TRANSFORM_CHUNK_ROWS-th raw row above the
+-- watermark, or the newest one when fewer rows are left. Both lookups walk idx_raw_parent_ts.
+SELECT COALESCE(
+    (
+        SELECT parent_timestampmsec
+        FROM {RAW_TABLE_NAME}
+        WHERE parent_timestampmsec > %(lower)s
+        ORDER BY parent_timestampmsec
+        OFFSET %(offset)s
+        LIMIT 1
+    ),
+    (
+        SELECT MAX(parent_timestampmsec)
+        FROM {RAW_TABLE_NAME}
+        WHERE parent_timestampmsec > %(lower)s
+    )
+);
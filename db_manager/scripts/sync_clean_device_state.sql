@@ -0,0 +1,26 @@
+-- Registers the devices of tab_measurements that have no cleaning state yet.
+-- Distinct device ids via a skip scan on idx_measurements_device_ts: one index probe
+-- per device instead of reading the whole table.
+WITH RECURSIVE devices AS (
+    (
+        SELECT device_id
+        FROM hydro.tab_measurements
+        ORDER BY device_id
+        LIMIT 1
+    )
+    UNION ALL
+    SELECT (
+        SELECT m.device_id
+        FROM hydro.tab_measurements m
+        WHERE m.device_id > d.device_id
+        ORDER BY m.device_id
+        LIMIT 1
+    )
+    FROM devices d
+    WHERE d.device_id IS NOT NULL
+)
+INSERT INTO hydro.tab_clean_device_state (id_misuratore, last_ts)
+SELECT device_id, %(initial_ts)s::timestamptz
+FROM devices
+WHERE device_id IS NOT NULL
+ON CONFLICT (id_misuratore) DO NOTHING;
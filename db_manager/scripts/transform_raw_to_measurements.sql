@@ -1,12 +1,8 @@
-WITH last_state AS (
-    SELECT last_parent_timestampmsec
-    FROM hydro.tab_etl_state
-    WHERE job_name = 'transform_raw_to_measurements'
-),
-raw_filtered AS (
-    SELECT *
-    FROM hydro.tab_measurements_raw
-    WHERE parent_timestampmsec > COALESCE((SELECT last_parent_timestampmsec FROM last_state), 0)
+WITH raw_filtered AS (
+    SELECT device_id, parent_timestampmsec, measure_name, raw_data
+    FROM {RAW_TABLE_NAME}
+    WHERE parent_timestampmsec > %(lower)s
+    AND parent_timestampmsec <= %(upper)s
 ),
 agg AS (
     SELECT
@@ -58,16 +54,15 @@ ins AS (
     ON CONFLICT (device_id, ts_s) DO NOTHING
     RETURNING 1
 ),
-max_raw AS (
-    SELECT COALESCE(MAX(parent_timestampmsec), 0) AS max_ts
-    FROM raw_filtered
+state AS (
+    INSERT INTO hydro.tab_etl_state (job_name, last_parent_timestampmsec, updated_at)
+    VALUES ('transform_raw_to_measurements', %(upper)s, now())
+    ON CONFLICT (job_name)
+    DO UPDATE SET
+        last_parent_timestampmsec = EXCLUDED.last_parent_timestampmsec,
+        updated_at = EXCLUDED.updated_at
+    RETURNING 1
 )
-INSERT INTO hydro.tab_etl_state (job_name, last_parent_timestampmsec, updated_at)
-SELECT 'transform_raw_to_measurements',
-    max_ts,
-    now()
-FROM max_raw
-ON CONFLICT (job_name)
-DO UPDATE SET
-    last_parent_timestampmsec = EXCLUDED.last_parent_timestampmsec,
-    updated_at = EXCLUDED.updated_at;
+SELECT
+    (SELECT COUNT(*) FROM raw_filtered) AS raw_rows,
+    (SELECT COUNT(*) FROM ins) AS inserted_rows;
@@ -0,0 +1,6 @@
+INSERT INTO hydro.tab_clean_device_state (id_misuratore, last_ts)
+VALUES %s
+ON CONFLICT (id_misuratore)
+DO UPDATE SET
+    last_ts = GREATEST(hydro.tab_clean_device_state.last_ts, EXCLUDED.last_ts),
+    updated_at = now();
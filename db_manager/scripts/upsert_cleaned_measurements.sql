@@ -1,3 +1,5 @@
+-- Merges the staged batch (one row per key) into tab_measurements_clean, then empties the stage.
+-- updated_at is set on insert too: refresh_stats finds the touched days through it.
 INSERT INTO hydro.tab_measurements_clean (
     id_misuratore,
     data_misurazione,
@@ -5,9 +7,19 @@ INSERT INTO hydro.tab_measurements_clean (
     flow_ls_smoothed,
     is_outlier,
     window_median,
-    thresholds
+    thresholds,
+    updated_at
 )
-VALUES (%s, %s, %s, %s, %s, %s, %s)
+SELECT
+    id_misuratore,
+    data_misurazione,
+    flow_ls_raw,
+    flow_ls_smoothed,
+    is_outlier,
+    window_median,
+    thresholds,
+    now()
+FROM tmp_measurements_clean_staging
 ON CONFLICT (id_misuratore, data_misurazione)
 DO UPDATE SET
     flow_ls_raw = EXCLUDED.flow_ls_raw,
@@ -16,3 +28,5 @@ DO UPDATE SET
     window_median = EXCLUDED.window_median,
     thresholds = EXCLUDED.thresholds,
     updated_at = now();
+
+TRUNCATE tmp_measurements_clean_staging;
@@ -0,0 +1,16 @@
+INSERT INTO hydro.tab_eventhub_checkpoints (
+    fully_qualified_namespace,
+    eventhub_name,
+    consumer_group,
+    partition_id,
+    offset_value,
+    sequence_number
+)
+VALUES %s
+ON CONFLICT (fully_qualified_namespace, eventhub_name, consumer_group, partition_id)
+DO UPDATE SET
+    offset_value = EXCLUDED.offset_value,
+    sequence_number = EXCLUDED.sequence_number,
+    updated_at = now()
+WHERE hydro.tab_eventhub_checkpoints.sequence_number IS NULL
+    OR EXCLUDED.sequence_number >= hydro.tab_eventhub_checkpoints.sequence_number;
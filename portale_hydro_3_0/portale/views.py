@@ -1,4 +1,5 @@
-from datetime import timedelta
+from datetime import date, timedelta
+import math
 import time
 
 from django.http import JsonResponse
@@ -27,6 +28,25 @@ def facilities_map(request):
         "title": "Facilities Map"
     })
 
+# Long ranges are read from the rollups maintained by db_manager (refresh_rollups):
+# hourly / daily averages instead of millions of 5-minute rows.
+ROLLUP_QUERIES = {
+    "6m": """
+        SELECT hour_start, flow_raw_avg, flow_smoothed_avg, n_outliers > 0
+        FROM hydro.tab_measurements_clean_hourly
+        WHERE id_misuratore = %s AND hour_start >= %s AND hour_start <= %s
+        ORDER BY hour_start
+    """,
+    "all": """
+        SELECT day::timestamp AT TIME ZONE 'UTC', flow_raw_avg, flow_smoothed_avg, n_outliers > 0
+        FROM hydro.tab_measurements_clean_daily
+        WHERE id_misuratore = %s AND day >= %s::date AND day <= %s::date
+        ORDER BY day
+    """,
+}
+ROLLUP_QUERIES["1y"] = ROLLUP_QUERIES["6m"]
+
+
 @login_required
 def measurements_api(request):
     id_misuratore = request.GET.get("id_misuratore")
@@ -59,7 +79,12 @@ def measurements_api(request):
         elif range_key == "1y":
             cutoff = latest - timedelta(days=365)
 
-        if cutoff:
+        if range_key in ROLLUP_QUERIES:
+            first = cutoff or base_qs.order_by("data_misurazione").values_list("data_misurazione", flat=True).first()
+            with connection.cursor() as cursor:
+                cursor.execute(ROLLUP_QUERIES[range_key], [id_misuratore, first, latest])
+                rows = cursor.fetchall()
+        elif cutoff:
             rows = base_qs.filter(
                 data_misurazione__gte=cutoff, data_misurazione__lte=latest
             ).order_by("data_misurazione")
@@ -113,7 +138,7 @@ def duration_curve_api(request):
         cursor.execute(
             """
             SELECT flow_avg_day, p_exceed
-            FROM hydro.mv_flow_duration_curve_daily
+            FROM hydro.tab_flow_duration_curve_daily
             WHERE id_misuratore = %s
             ORDER BY p_exceed
             """,
@@ -203,6 +228,97 @@ def flow_histogram_api(request):
         }
     )
 
+# Percentiles come from the daily log-bin sketches maintained by db_manager
+# (tab_flow_sketch_daily, decoded with the accuracy stored in tab_flow_sketch_params).
+FLOW_PERCENTILES = (5, 50, 95, 99)
+
+
+def _sketch_quantiles(bins, relative_accuracy, percentiles, min_v, max_v):
+    # bins: (sign, bin_key, count) of the merged sketch. A bin stands for its representative
+    # value 2 * gamma^k / (gamma + 1), within the relative accuracy of all its values.
+    ln_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+    values = sorted(
+        (sign * 2 * math.exp(bin_key * ln_gamma) / (math.exp(ln_gamma) + 1), int(count))
+        for sign, bin_key, count in bins
+    )
+    total = sum(count for _value, count in values)
+    result = {}
+    for p in percentiles:
+        rank = p / 100 * (total - 1)
+        cumulative = 0
+        for value, count in values:
+            cumulative += count
+            if cumulative > rank:
+                break
+        result[f"p{p}"] = min(max(value, min_v), max_v)
+    return result, total
+
+
+@login_required
+def flow_percentiles_api(request):
+    # p5/p50/p95/p99 of the smoothed flow over the UTC days start..end (ISO dates, both
+    # optional and inclusive) by merging the device's day sketches: no scan of the measurements.
+    t0 = time.perf_counter()
+    id_misuratore = request.GET.get("id_misuratore")
+    if not id_misuratore:
+        return JsonResponse(
+            {"error": "id_misuratore is required"},
+            status=400,
+        )
+    try:
+        start = date.fromisoformat(request.GET["start"]) if request.GET.get("start") else date.min
+        end = date.fromisoformat(request.GET["end"]) if request.GET.get("end") else date.max
+    except ValueError:
+        return JsonResponse(
+            {"error": "start and end must be dates (YYYY-MM-DD)"},
+            status=400,
+        )
+
+    with connection.cursor() as cursor:
+        # Bins and the accuracy they were built with, in one snapshot.
+        cursor.execute(
+            """
+            SELECT p.relative_accuracy, s.sign, s.bin_key, SUM(s.count)
+            FROM hydro.tab_flow_sketch_daily s
+            CROSS JOIN hydro.tab_flow_sketch_params p
+            WHERE s.id_misuratore = %s AND s.day >= %s AND s.day <= %s
+            GROUP BY p.relative_accuracy, s.sign, s.bin_key
+            """,
+            [id_misuratore, start, end],
+        )
+        rows = cursor.fetchall()
+        # Exact extremes from the daily rollup, to bound the approximated percentiles.
+        cursor.execute(
+            """
+            SELECT MIN(flow_smoothed_min), MAX(flow_smoothed_max)
+            FROM hydro.tab_measurements_clean_daily
+            WHERE id_misuratore = %s AND day >= %s AND day <= %s AND flow_smoothed_n > 0
+            """,
+            [id_misuratore, start, end],
+        )
+        min_v, max_v = cursor.fetchone()
+    t1 = time.perf_counter()
+
+    if not rows or min_v is None:
+        return JsonResponse({f"p{p}": None for p in FLOW_PERCENTILES} | {"count": 0})
+
+    relative_accuracy = rows[0][0]
+    bins = [row[1:] for row in rows]
+    percentiles, total = _sketch_quantiles(bins, relative_accuracy, FLOW_PERCENTILES, float(min_v), float(max_v))
+    t2 = time.perf_counter()
+    print(
+        "[flow_percentiles_api] "
+        f"id={id_misuratore} bins={len(bins)} count={total} "
+        f"query_ms={(t1 - t0)*1000:.1f} total_ms={(t2 - t0)*1000:.1f}"
+    )
+    return JsonResponse(
+        {
+            **percentiles,
+            "count": total,
+            "relative_accuracy": relative_accuracy,
+        }
+    )
+
 @login_required
 def misuratore_detail(request, id_misuratore):
     misuratore = (